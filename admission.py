@@ -0,0 +1,223 @@
+"""
+Контроль допуска запросов пользователей к обработчикам, которые ходят в API погоды.
+
+Каждый запрос проходит три проверки:
+1. Повтор: тот же запрос того же пользователя к тому же обработчику в течение
+   ADMISSION_DEDUP_WINDOW секунд после допущенного (двойное нажатие кнопки) пропускается.
+   Запрос, отвеченный из кэша, повтором не считается — его можно сразу повторить.
+2. Token bucket пользователя: ADMISSION_USER_RATE токенов в минуту, запас ADMISSION_USER_BURST;
+   запрос стоит столько токенов, сколько запросов к API он может сделать.
+3. Общий лимит: одновременно в API идут не больше ADMISSION_CONCURRENCY обработчиков,
+   остальные ждут места не дольше ADMISSION_WAIT секунд.
+
+Не прошедший 2 или 3 запрос не отбрасывается, а выполняется в режиме «только кэш»
+(http_client.PRIORITY_CACHE_ONLY): пользователь получает сохранённые данные или
+сообщение о перегрузке, а API и потоки-обработчики остаются другим пользователям.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Hashable, Optional, Tuple
+
+import metrics
+
+ADMISSION_USER_RATE = float(os.getenv('ADMISSION_USER_RATE', 20))
+# Запас рассчитан на обычный сеанс: пара сравнений, расширенные данные и несколько
+# запросов погоды подряд (~30 токенов) не упираются в лимит
+ADMISSION_USER_BURST = float(os.getenv('ADMISSION_USER_BURST', 40))
+ADMISSION_CONCURRENCY = int(os.getenv('ADMISSION_CONCURRENCY', 8))
+ADMISSION_WAIT = float(os.getenv('ADMISSION_WAIT', 2))
+ADMISSION_DEDUP_WINDOW = float(os.getenv('ADMISSION_DEDUP_WINDOW', 5))
+# Сколько пользователей держим в памяти; бакеты давно не писавших пользователей полные и удаляются
+ADMISSION_MAX_USERS = 10000
+
+# Решения контроля допуска
+ADMITTED = 'admitted'
+DUPLICATE = 'duplicate'
+THROTTLED = 'throttled'    # пользователь исчерпал свой бакет
+BUSY = 'busy'              # нет места в общем лимите одновременных запросов
+CACHE_ONLY = (THROTTLED, BUSY)
+
+
+class UserBuckets:
+    """
+    Token bucket на каждого пользователя (в памяти процесса).
+
+    Бакет пополняется на rate токенов в минуту до burst. Отсутствующий бакет считается
+    полным, поэтому при переполнении словаря удаляются бакеты, которые уже пополнились.
+    """
+
+    def __init__(self, rate: float = ADMISSION_USER_RATE, burst: float = ADMISSION_USER_BURST,
+                 max_users: int = ADMISSION_MAX_USERS):
+        """
+        Args:
+            rate: Токенов в минуту
+            burst: Ёмкость бакета
+            max_users: Максимум бакетов в памяти
+        """
+        self.rate = rate / 60
+        self.burst = burst
+        self.max_users = max_users
+        # user_id -> [токенов на момент updated, updated]
+        self._buckets: Dict[Hashable, list] = {}
+        self._lock = threading.Lock()
+
+    def _level(self, bucket: list, now: float) -> float:
+        return min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+
+    def take(self, user_id: Hashable, cost: float = 1, now: Optional[float] = None) -> Tuple[bool, float]:
+        """
+        Берёт cost токенов из бакета пользователя.
+
+        Returns:
+            (успех, через сколько секунд токенов хватит)
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                if len(self._buckets) >= self.max_users:
+                    self._prune(now)
+                bucket = self._buckets[user_id] = [self.burst, now]
+            tokens = self._level(bucket, now)
+            bucket[1] = now
+            if tokens >= cost:
+                bucket[0] = tokens - cost
+                return True, 0.0
+            bucket[0] = tokens
+            return False, (cost - tokens) / self.rate if self.rate > 0 else float('inf')
+
+    def refund(self, user_id: Hashable, cost: float = 1):
+        """Возвращает токены запроса, который так и не пошёл в API"""
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is not None:
+                bucket[0] = min(self.burst, bucket[0] + cost)
+
+    def _prune(self, now: float):
+        full = [user_id for user_id, bucket in self._buckets.items() if self._level(bucket, now) >= self.burst]
+        for user_id in full:
+            del self._buckets[user_id]
+        if len(self._buckets) >= self.max_users:
+            # Все активны — оставляем половину, писавшую последней
+            ranked = sorted(self._buckets, key=lambda user_id: self._buckets[user_id][1])
+            for user_id in ranked[:len(ranked) // 2]:
+                del self._buckets[user_id]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class RecentKeys:
+    """Ключи, встречавшиеся за последние window секунд (окно повторов)"""
+
+    def __init__(self, window: float = ADMISSION_DEDUP_WINDOW):
+        self.window = window
+        # Ключи идут в порядке времени: устаревшие всегда в начале
+        self._seen: 'OrderedDict[Hashable, float]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        while self._seen:
+            oldest, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.window:
+                break
+            del self._seen[oldest]
+
+    def contains(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """Был ли ключ в окне (не запоминает его)"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._expire(now)
+            return key in self._seen
+
+    def seen(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """True, если ключ уже был в окне; иначе запоминает его"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._expire(now)
+            if key in self._seen:
+                return True
+            self._seen[key] = now
+            return False
+
+    def forget(self, key: Hashable):
+        with self._lock:
+            self._seen.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+
+class AdmissionController:
+    """Решает, как выполнить запрос пользователя: полностью, только из кэша или пропустить как повтор"""
+
+    def __init__(self, rate: float = ADMISSION_USER_RATE, burst: float = ADMISSION_USER_BURST,
+                 concurrency: int = ADMISSION_CONCURRENCY, wait: float = ADMISSION_WAIT,
+                 dedup_window: float = ADMISSION_DEDUP_WINDOW):
+        self.buckets = UserBuckets(rate, burst)
+        self.recent = RecentKeys(dedup_window)
+        self.concurrency = concurrency
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(concurrency) if concurrency > 0 else None
+        self._stats_lock = threading.Lock()
+        self.stats = {ADMITTED: 0, DUPLICATE: 0, THROTTLED: 0, BUSY: 0}
+
+    def _count(self, decision: str, handler: str):
+        with self._stats_lock:
+            self.stats[decision] += 1
+        metrics.ADMISSION_DECISIONS.inc(handler=handler, decision=decision)
+
+    @contextmanager
+    def admit(self, user_id: Hashable, key: Hashable = None, cost: float = 1, handler: str = ''):
+        """
+        Контекст запроса пользователя; отдаёт решение (ADMITTED, DUPLICATE, THROTTLED, BUSY).
+
+        key — что делает запрос (обработчик и текст сообщения или данные кнопки);
+        None — без проверки повторов. Ключ запоминается только для ADMITTED: повтор
+        после ответа из кэша (THROTTLED, BUSY) не отбрасывается.
+        Место в общем лимите занимается только для ADMITTED и освобождается на выходе.
+        """
+        if key is not None and self.recent.contains((user_id, key)):
+            self._count(DUPLICATE, handler)
+            yield DUPLICATE
+            return
+
+        granted, _ = self.buckets.take(user_id, cost)
+        if not granted:
+            self._count(THROTTLED, handler)
+            yield THROTTLED
+            return
+
+        if self._slots is not None and not self._slots.acquire(timeout=self.wait):
+            # В API запрос не пойдёт — токены пользователю возвращаем
+            self.buckets.refund(user_id, cost)
+            self._count(BUSY, handler)
+            yield BUSY
+            return
+
+        # Одинаковые запросы могли одновременно пройти первую проверку — допускается только первый
+        if key is not None and self.recent.seen((user_id, key)):
+            if self._slots is not None:
+                self._slots.release()
+            self.buckets.refund(user_id, cost)
+            self._count(DUPLICATE, handler)
+            yield DUPLICATE
+            return
+
+        self._count(ADMITTED, handler)
+        metrics.ADMISSION_IN_FLIGHT.inc()
+        try:
+            yield ADMITTED
+        finally:
+            metrics.ADMISSION_IN_FLIGHT.dec()
+            if self._slots is not None:
+                self._slots.release()
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['users'] = len(self.buckets)
+        return stats
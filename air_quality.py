@@ -0,0 +1,143 @@
+from array import array
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+QUALITY_LEVELS = {
+    1: "Хорошо",
+    2: "Удовлетворительно",
+    3: "Умеренно",
+    4: "Плохо",
+    5: "Очень плохо"
+}
+
+# Верхние границы уровней 1-4 в μg/m³; всё, что выше последней границы, — уровень 5
+BAND_EDGES = {
+    "so2": (20, 80, 250, 350),
+    "no2": (40, 70, 150, 200),
+    "pm10": (20, 50, 100, 200),
+    "pm2_5": (10, 25, 50, 75),
+    "o3": (60, 100, 140, 180),
+    "co": (4400, 9400, 12400, 15400),
+}
+
+POLLUTANT_NAMES = {
+    "so2": "SO₂",
+    "no2": "NO₂",
+    "pm10": "PM₁₀",
+    "pm2_5": "PM₂.₅",
+    "o3": "O₃",
+    "co": "CO"
+}
+
+
+class AirQualityClassifier:
+    """
+    Классификатор качества воздуха по границам уровней загрязнителей.
+
+    Границы переводятся в отсортированные кортежи один раз при создании,
+    уровень значения находится двоичным поиском (bisect). Граница относится
+    к следующему уровню: so2 = 20 — уже «Удовлетворительно».
+    """
+
+    def __init__(self, band_edges: Mapping[str, Sequence[float]] = BAND_EDGES):
+        """
+        Args:
+            band_edges: {загрязнитель: возрастающие верхние границы уровней 1..N-1}
+        """
+        self.pollutants = tuple(band_edges)
+        self._edges = {pollutant: tuple(sorted(edges)) for pollutant, edges in band_edges.items()}
+
+    def level(self, pollutant: str, value: float) -> int:
+        """Уровень (1..5) одного значения загрязнителя"""
+        return bisect_right(self._edges[pollutant], value) + 1
+
+    def classify(self, components: Mapping[str, float]) -> Dict[str, object]:
+        """
+        Классифицирует показания одного места.
+
+        Returns:
+            {'levels': {загрязнитель: уровень}, 'max_level': общий уровень}
+            (загрязнители без показаний пропускаются; без показаний общий уровень — 1)
+        """
+        levels = {pollutant: self.level(pollutant, components[pollutant])
+                  for pollutant in self.pollutants if pollutant in components}
+        return {'levels': levels, 'max_level': max(levels.values(), default=1)}
+
+    def classify_columns(self, columns: Mapping[str, Sequence[float]],
+                         size: Optional[int] = None) -> Tuple[Dict[str, array], array]:
+        """
+        Классифицирует массивы показаний: столбец на загрязнитель, строка на место или час.
+
+        Args:
+            columns: {загрязнитель: последовательность значений одинаковой длины}
+            size: Число строк, если ни одного известного столбца нет
+
+        Returns:
+            (уровни по загрязнителям, общий уровень по строкам) — массивы array('b')
+        """
+        known = [pollutant for pollutant in self.pollutants if pollutant in columns]
+        if size is None:
+            size = len(columns[known[0]]) if known else 0
+        levels = {}
+        max_levels = array('b', [1]) * size
+        for pollutant in known:
+            edges = self._edges[pollutant]
+            column = array('b', [bisect_right(edges, value) + 1 for value in columns[pollutant]])
+            if len(column) != size:
+                raise ValueError(f"Длина столбца {pollutant} ({len(column)}) не совпадает с {size}")
+            levels[pollutant] = column
+            max_levels = array('b', map(max, max_levels, column))
+        return levels, max_levels
+
+    def classify_many(self, readings: Iterable[Mapping[str, float]]) -> List[Dict[str, object]]:
+        """
+        Классифицирует список показаний (сетку мест или почасовую историю).
+
+        Показания с одинаковым набором загрязнителей (обычно это все показания)
+        раскладываются по столбцам и классифицируются одним вызовом classify_columns;
+        записи без какого-то загрязнителя просто не получают по нему уровня.
+        """
+        readings = list(readings)
+        groups: Dict[Tuple[str, ...], List[int]] = {}
+        for index, reading in enumerate(readings):
+            present = tuple(pollutant for pollutant in self.pollutants if pollutant in reading)
+            groups.setdefault(present, []).append(index)
+
+        results: List[Dict[str, object]] = [{}] * len(readings)
+        for present, rows in groups.items():
+            columns = {pollutant: [readings[index][pollutant] for index in rows] for pollutant in present}
+            levels, max_levels = self.classify_columns(columns, size=len(rows))
+            for row, index in enumerate(rows):
+                results[index] = {'levels': {pollutant: levels[pollutant][row] for pollutant in present},
+                                  'max_level': max_levels[row]}
+        return results
+
+
+CLASSIFIER = AirQualityClassifier()
+
+
+def format_air_quality(components: Mapping[str, float], classification: Mapping[str, object],
+                       extended: bool = False) -> str:
+    """Текстовый отчёт о качестве воздуха по готовой классификации"""
+    levels = classification['levels']
+    max_level = classification['max_level']
+    results = []
+    for pollutant, level in levels.items():
+        name = POLLUTANT_NAMES.get(pollutant, pollutant)
+        results.append(f"  {name}: {components[pollutant]} μg/m³ [{QUALITY_LEVELS[level]}]")
+
+    output = f"\n🌬️  Качество воздуха: {QUALITY_LEVELS[max_level]}\n"
+    output += "\n".join(results)
+
+    if extended:
+        output += "\n\n📊 Все компоненты воздуха:"
+        for component, value in components.items():
+            if component not in BAND_EDGES and not component.startswith('_'):
+                output += f"\n  {component}: {value} μg/m³"
+
+    if max_level >= 4:
+        output += "\n⚠️  Высокий уровень загрязнения! Ограничьте время на улице."
+    elif max_level == 3:
+        output += "\n⚠️  Умеренное загрязнение. Чувствительным людям быть осторожнее."
+
+    return output
@@ -0,0 +1,198 @@
+"""
+Бенчмарк функций weather_app против локальной заглушки OpenWeatherMap.
+
+Сценарии:
+  - cold       — каждый вызов по новому месту, кэш пуст (путь до API);
+  - warm       — повторные вызовы по одному месту (кэш в памяти);
+  - concurrent — несколько потоков одновременно, половина вызовов по общим местам.
+
+Результат — JSON (в stdout или в файл --output), его удобно сравнивать между версиями:
+    python -m benchmarks.bench_weather --latency 0.05 --error-rate 0.02 --output bench.json
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_owm import FakeOpenWeatherMap
+
+FUNCTIONS = ('get_current_weather', 'get_weather_by_city', 'get_hourly_weather', 'get_air_pollution')
+SCENARIOS = ('cold', 'warm', 'concurrent')
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """Перцентиль по ближайшему рангу для отсортированного списка"""
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, max(0, int(round(fraction * len(samples) + 0.5)) - 1))
+    return samples[index]
+
+
+class Locations:
+    """Источник мест: каждое новое место попадает в свою ячейку кэша"""
+
+    def __init__(self):
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def fresh(self) -> int:
+        with self._lock:
+            return next(self._counter)
+
+    @staticmethod
+    def coordinates(index: int) -> tuple:
+        # Шаг 0.37° больше любого шага сетки кэша, поэтому места не делят ячейки
+        return round(-50 + (index // 250) * 0.37, 4), round(-90 + (index % 250) * 0.37, 4)
+
+    @staticmethod
+    def city(index: int) -> str:
+        return f"Bench City {index}"
+
+
+def make_call(weather_app, name: str, index: int):
+    """Возвращает функцию без аргументов, вызывающую name для места index"""
+    lat, lon = Locations.coordinates(index)
+    if name == 'get_current_weather':
+        return lambda: weather_app.get_current_weather(latitude=lat, longitude=lon)
+    if name == 'get_weather_by_city':
+        city = Locations.city(index)
+        return lambda: weather_app.get_weather_by_city(city)
+    if name == 'get_hourly_weather':
+        return lambda: weather_app.get_hourly_weather(lat, lon)
+    if name == 'get_air_pollution':
+        return lambda: weather_app.get_air_pollution(lat, lon)
+    raise ValueError(f"Неизвестная функция: {name}")
+
+
+def timed(call) -> tuple:
+    """Выполняет вызов; возвращает (длительность в секундах, была ли ошибка)"""
+    started = time.perf_counter()
+    try:
+        result = call()
+        failed = not result or (isinstance(result, dict) and 'error' in result)
+    except Exception:
+        failed = True
+    return time.perf_counter() - started, failed
+
+
+def summarize(durations: list, errors: int, elapsed: float, upstream: int) -> dict:
+    durations = sorted(durations)
+    return {
+        'calls': len(durations),
+        'errors': errors,
+        'elapsed_s': round(elapsed, 4),
+        'throughput_per_s': round(len(durations) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(durations, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(durations, 0.99) * 1000, 3),
+        'max_ms': round(durations[-1] * 1000, 3) if durations else 0.0,
+        'upstream_requests': upstream,
+    }
+
+
+def run_scenario(weather_app, fake: FakeOpenWeatherMap, locations: Locations, name: str,
+                 scenario: str, iterations: int, concurrency: int) -> dict:
+    if scenario == 'cold':
+        calls = [make_call(weather_app, name, locations.fresh()) for _ in range(iterations)]
+    elif scenario == 'warm':
+        call = make_call(weather_app, name, locations.fresh())
+        call()
+        calls = [call] * iterations
+    else:
+        # Половина вызовов по нескольким общим местам (проверка объединения запросов), остальные — по новым
+        shared = [make_call(weather_app, name, locations.fresh()) for _ in range(max(1, concurrency // 2))]
+        calls = [shared[i % len(shared)] if i % 2 else make_call(weather_app, name, locations.fresh())
+                 for i in range(iterations)]
+
+    fake.reset_counters()
+    started = time.perf_counter()
+    if scenario == 'concurrent':
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(timed, calls))
+    else:
+        results = [timed(call) for call in calls]
+    elapsed = time.perf_counter() - started
+
+    durations = [duration for duration, _ in results]
+    errors = sum(1 for _, failed in results if failed)
+    return summarize(durations, errors, elapsed, fake.requests)
+
+
+def run(args) -> dict:
+    fake = FakeOpenWeatherMap(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                              rate_429=args.rate_429, retry_after=args.retry_after, seed=args.seed).start()
+    cache_dir = tempfile.mkdtemp(prefix='weather-bench-')
+    # weather_app читает настройки при импорте, поэтому окружение задаётся до него
+    os.environ.update({
+        'API_KEY': os.getenv('API_KEY') or 'bench',
+        'OWM_API_URL': fake.url,
+        'OWM_PRO_API_URL': fake.url,
+        'CACHE_DIR': cache_dir,
+        'OWM_CALLS_PER_MINUTE': '0',
+        'OWM_CALLS_PER_DAY': '0',
+        'OWM_QUOTA_FILE': os.path.join(cache_dir, 'quota.db'),
+    })
+    os.makedirs(cache_dir, exist_ok=True)
+    import weather_app
+
+    locations = Locations()
+    results = {}
+    try:
+        for name in args.functions:
+            results[name] = {}
+            for scenario in args.scenarios:
+                # Функции weather_app печатают ход работы; в отчёт это не попадает
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results[name][scenario] = run_scenario(weather_app, fake, locations, name, scenario,
+                                                           args.iterations, args.concurrency)
+    finally:
+        fake.stop()
+
+    return {
+        'config': {
+            'latency_s': args.latency,
+            'jitter_s': args.jitter,
+            'error_rate': args.error_rate,
+            'rate_429': args.rate_429,
+            'iterations': args.iterations,
+            'concurrency': args.concurrency,
+            'python': sys.version.split()[0],
+        },
+        'results': results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарк weather_app против заглушки OpenWeatherMap')
+    parser.add_argument('--latency', type=float, default=0.02, help='задержка ответа заглушки, с')
+    parser.add_argument('--jitter', type=float, default=0.0, help='случайная добавка к задержке, с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 500')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--retry-after', type=float, default=0.1, help='Retry-After для ответов 429, с')
+    parser.add_argument('--iterations', type=int, default=50, help='вызовов на сценарий')
+    parser.add_argument('--concurrency', type=int, default=8, help='потоков в сценарии concurrent')
+    parser.add_argument('--functions', nargs='+', choices=FUNCTIONS, default=list(FUNCTIONS))
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=0, help='зерно генератора ошибок заглушки')
+    parser.add_argument('--output', help='файл для JSON отчёта (по умолчанию stdout)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = json.dumps(run(args), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
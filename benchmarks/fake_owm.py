@@ -0,0 +1,194 @@
+"""
+Локальная заглушка OpenWeatherMap для бенчмарков.
+
+Отвечает на те же пути, что и настоящий API (weather, forecast, forecast/hourly,
+air_pollution, geo/1.0/direct), с настраиваемой задержкой, долей ошибок 5xx и 429.
+
+Запуск отдельно:
+    python -m benchmarks.fake_owm --port 8080 --latency 0.05 --error-rate 0.01
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+def _weather(lat: float, lon: float) -> dict:
+    temp = round(15 + 10 * ((lat * 7 + lon * 3) % 1), 2)
+    return {
+        'coord': {'lat': lat, 'lon': lon},
+        'name': f'Place {lat:.2f},{lon:.2f}',
+        'main': {'temp': temp, 'feels_like': temp - 1, 'humidity': 60, 'pressure': 1012},
+        'wind': {'speed': 3.5},
+        'clouds': {'all': 40},
+        'sys': {'sunrise': 1700000000, 'sunset': 1700030000},
+        'weather': [{'id': 803, 'main': 'Clouds', 'description': 'облачно с прояснениями', 'icon': '04d'}],
+    }
+
+
+def _forecast(lat: float, lon: float, count: int, step: int) -> dict:
+    start = int(time.time()) // step * step
+    items = []
+    for index in range(count):
+        temp = round(10 + 5 * ((index % 8) / 8), 2)
+        items.append({
+            'dt': start + index * step,
+            'main': {'temp': temp, 'feels_like': temp - 1, 'humidity': 70, 'pressure': 1010},
+            'wind': {'speed': 4.0, 'deg': 180},
+            'weather': [{'id': 500, 'main': 'Rain', 'description': 'небольшой дождь', 'icon': '10d'}],
+            'dt_txt': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start + index * step)),
+        })
+    return {'cod': '200', 'cnt': count, 'list': items,
+            'city': {'name': f'Place {lat:.2f},{lon:.2f}', 'coord': {'lat': lat, 'lon': lon}, 'timezone': 10800}}
+
+
+def _air_pollution(lat: float, lon: float) -> dict:
+    return {'coord': {'lat': lat, 'lon': lon}, 'list': [{
+        'main': {'aqi': 2},
+        'components': {'co': 230.3, 'no': 0.1, 'no2': 12.5, 'o3': 68.7, 'so2': 3.2,
+                       'pm2_5': 8.1, 'pm10': 12.4, 'nh3': 1.1},
+    }]}
+
+
+def _geocode(query: str) -> list:
+    if query.lower().startswith('unknown'):
+        return []
+    digest = hashlib.md5(query.lower().encode('utf-8')).digest()
+    lat = round(-60 + digest[0] / 255 * 120, 4)
+    lon = round(-180 + digest[1] / 255 * 360, 4)
+    return [{'name': query, 'lat': lat, 'lon': lon, 'country': 'XX', 'local_names': {'ru': query}}]
+
+
+class FakeOpenWeatherMap:
+    """
+    HTTP сервер, имитирующий OpenWeatherMap.
+
+    Args:
+        latency: Задержка ответа в секундах
+        jitter: Случайная добавка к задержке (0..jitter секунд)
+        error_rate: Доля ответов 500
+        rate_429: Доля ответов 429 (с заголовком Retry-After)
+        retry_after: Значение Retry-After для ответов 429
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, rate_429: float = 0.0, retry_after: float = 0.2, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.requests = 0
+        self.by_path = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.by_path = {}
+
+    def _roll(self) -> float:
+        with self._lock:
+            return self._random.random()
+
+    def _respond(self, path: str, query: dict):
+        """Возвращает (статус, заголовки, тело) для запроса"""
+        with self._lock:
+            self.requests += 1
+            self.by_path[path] = self.by_path.get(path, 0) + 1
+        delay = self.latency + (self._roll() * self.jitter if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        roll = self._roll()
+        if roll < self.rate_429:
+            return 429, {'Retry-After': str(self.retry_after)}, {'cod': 429, 'message': 'rate limit'}
+        if roll < self.rate_429 + self.error_rate:
+            return 500, {}, {'cod': 500, 'message': 'internal error'}
+
+        if path == '/geo/1.0/direct':
+            return 200, {}, _geocode(query.get('q', ''))
+        try:
+            lat, lon = float(query['lat']), float(query['lon'])
+        except (KeyError, ValueError):
+            return 400, {}, {'cod': 400, 'message': 'wrong latitude or longitude'}
+        if path == '/data/2.5/weather':
+            return 200, {}, _weather(lat, lon)
+        if path == '/data/2.5/forecast':
+            return 200, {}, _forecast(lat, lon, 40, 10800)
+        if path == '/data/2.5/forecast/hourly':
+            return 200, {}, _forecast(lat, lon, 96, 3600)
+        if path == '/data/2.5/air_pollution':
+            return 200, {}, _air_pollution(lat, lon)
+        return 404, {}, {'cod': 404, 'message': 'not found'}
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Без этого заголовки и тело уходят разными пакетами и ответ ждёт отложенный ACK (~40 мс)
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+                status, headers, body = fake._respond(parts.path, query)
+                payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> 'FakeOpenWeatherMap':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-owm', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Заглушка OpenWeatherMap')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = FakeOpenWeatherMap(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                              error_rate=args.error_rate, rate_429=args.rate_429)
+    print(f"Заглушка OpenWeatherMap: {fake.url}")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,141 @@
+if __name__ == "__main__":
+    # .env читается только при запуске из командной строки и до импорта модулей с настройками;
+    # импорт из тестов и инструментов окружение процесса не меняет
+    from dotenv import load_dotenv
+    load_dotenv()
+
 import telebot
 from telebot import types
 import os
-from dotenv import load_dotenv
 import weather_app
-import json
+import metrics
+from admission import ADMITTED, DUPLICATE, AdmissionController, RecentKeys
+from scheduler import NotificationScheduler, defer_quiet_hours, next_due_time, spread_offset
+from user_store import open_user_store, shard_of
+from webhook import UpdateDispatcher, WebhookServer
+import functools
 import threading
 import time
 from datetime import datetime
-
-load_dotenv()
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-
-if not BOT_TOKEN: 
-    raise ValueError("BOT_TOKEN не установлен")
-
-bot = telebot.TeleBot(BOT_TOKEN)
+# Адрес Bot API можно переопределить (локальный Bot API сервер или тестовая заглушка)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+# Создаётся в create_bot(); импорт модуля ничего не запускает
+bot = None
+
+# Режим получения обновлений: 'polling' или 'webhook'
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 16))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 100))
+WEBHOOK_OVERFLOW = os.getenv("WEBHOOK_OVERFLOW", "block")
+# Порт для метрик Prometheus (/metrics); не задан — сервер метрик не запускается
+METRICS_PORT = os.getenv("METRICS_PORT")
+# Число рабочих процессов; больше 1 — запуск через супервизор (см. supervisor.py)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", 1))
 
 user_data = {}
 USER_DATA_FILE = 'user_data.json'
-
-def load_user_data():
-    """Загружает данные пользователей из файла"""
-    global user_data
-    try:
-        with open(USER_DATA_FILE, 'r', encoding='utf-8') as f:
-            user_data = json.load(f)
-    except FileNotFoundError:
-        user_data = {}
-
-def save_user_data():
-    """Сохраняет данные пользователей в файл"""
-    with open(USER_DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(user_data, f, ensure_ascii=False, indent=2)
-
-load_user_data()
+user_store = None
+
+# Рассылка уведомлений: интервал по умолчанию и варианты на выбор пользователя (часы)
+NOTIFICATION_INTERVAL = 7200
+NOTIFICATION_INTERVAL_CHOICES = (1, 2, 4, 8)
+# Случайный сдвиг интервала (±10%) и окно, на которое растягиваются уведомления,
+# просроченные за время простоя бота
+NOTIFICATION_JITTER = 0.1
+NOTIFICATION_CATCHUP = 600
+# Планировщик просыпается к ближайшему уведомлению, но не реже раза в NOTIFICATION_TICK секунд
+# и рассылает за раз не больше NOTIFICATION_BATCH_SIZE уведомлений
+NOTIFICATION_TICK = 30
+NOTIFICATION_BATCH_SIZE = 500
+# Тихие часы (местное время) и часовой пояс, пока он не известен из ответа погоды
+QUIET_HOURS = (23, 7)
+DEFAULT_TZ_OFFSET = int(os.getenv("NOTIFICATION_TZ_OFFSET", 3 * 3600))
+NOTIFICATION_FETCH_WORKERS = 8
+NOTIFICATION_SEND_WORKERS = 8
+notification_scheduler = NotificationScheduler()
+# Прогрев кэша при запуске: сколько запросов к API можно потратить (0 — не прогревать)
+WARMUP_BUDGET = int(os.getenv("WARMUP_BUDGET", 60))
+WARMUP_ENDPOINTS = ('weather', 'forecast5d')
+# Контроль допуска к обработчикам, которые ходят в API погоды (лимиты — в admission.py)
+admission = AdmissionController()
+# Предупреждение о лимите показывается не чаще раза в THROTTLE_NOTICE_INTERVAL секунд
+THROTTLE_NOTICE_INTERVAL = 60
+THROTTLE_NOTICE = "⏳ Слишком много запросов. Пока показываю сохранённые данные, свежие загружу чуть позже."
+_throttle_notices = RecentKeys(THROTTLE_NOTICE_INTERVAL)
+
+def load_user_data(shard=None):
+    """
+    Загружает данные пользователей из хранилища (при первом запуске переносит user_data.json).
+
+    shard — (номер, всего): рабочий процесс супервизора загружает только своих пользователей.
+    user_data.json он не переносит — это делает супервизор до запуска процессов (migrate_user_data).
+    """
+    global user_data, user_store
+    user_store = open_user_store(legacy_json_path=USER_DATA_FILE, migrate=shard is None)
+    users = user_store.load_all()
+    if shard is not None:
+        index, count = shard
+        users = {user_id: data for user_id, data in users.items() if shard_of(user_id, count) == index}
+    user_data = users
+
+def migrate_user_data():
+    """Переносит user_data.json в хранилище (один раз, до запуска рабочих процессов)"""
+    open_user_store(legacy_json_path=USER_DATA_FILE).close()
+
+def save_user(user_id):
+    """Сохраняет настройки одного пользователя"""
+    user_store.upsert(user_id, user_data[user_id])
+
+def save_users(user_ids):
+    """Сохраняет настройки нескольких пользователей одной транзакцией"""
+    user_store.upsert_many({user_id: user_data[user_id] for user_id in user_ids})
+
+def request_key(update):
+    """Что именно запрошено: данные кнопки, координаты или текст сообщения"""
+    if isinstance(update, types.CallbackQuery):
+        return update.data
+    if update.location:
+        return (update.location.latitude, update.location.longitude)
+    return update.text
+
+def admitted(cost=1, dedup=True):
+    """
+    Декоратор контроля допуска для обработчиков, которые ходят в API погоды.
+
+    cost — сколько запросов к API может сделать обработчик. Повтор того же запроса
+    (dedup) пропускается, а сверх лимита пользователя или общего лимита обработчик
+    выполняется в режиме «только кэш».
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(update):
+            is_call = isinstance(update, types.CallbackQuery)
+            user_id = update.from_user.id
+            # Одинаковый текст в разных обработчиках — разные запросы
+            key = (func.__name__, request_key(update)) if dedup else None
+            with admission.admit(user_id, key, cost, handler=func.__name__) as decision:
+                if decision == ADMITTED:
+                    return func(update)
+                if decision == DUPLICATE:
+                    if is_call:
+                        bot.answer_callback_query(update.id)
+                    return
+                if not is_call and not _throttle_notices.seen(user_id):
+                    bot.send_message(update.chat.id, THROTTLE_NOTICE)
+                http_client = weather_app.http_client
+                with http_client.request_priority(http_client.PRIORITY_CACHE_ONLY):
+                    return func(update)
+        return wrapper
+    return decorator
 
 def get_main_keyboard():
     """Создает главную клавиатуру"""
@@ -48,7 +149,7 @@ def get_main_keyboard():
     markup.add(btn1, btn2, btn3, btn4, btn5, btn6)
     return markup
 
-@bot.message_handler(commands=['start'])
+@metrics.track_handler
 def send_welcome(message):
     """Приветствие и главное меню"""
     user_id = str(message.from_user.id)
@@ -57,7 +158,7 @@ def send_welcome(message):
             'location': None,
             'notifications': False
         }
-        save_user_data()
+        save_user(user_id)
     
     welcome_text = """🌤️ Привет! Я бот погоды.
 
@@ -65,7 +166,7 @@ def send_welcome(message):
 🌡️ Погода сейчас - текущая погода в городе
 📅 Прогноз на 5 дней - детальный прогноз
 📍 Поиск по геолокации - отправь местоположение
-🔔 Уведомления - погодные оповещения каждые 2 часа
+🔔 Уведомления - погодные оповещения по расписанию
 🌍 Сравнить города - сравнение погоды в двух городах
 📊 Расширенные данные - полная информация о погоде
 
@@ -73,7 +174,8 @@ def send_welcome(message):
     
     bot.send_message(message.chat.id, welcome_text, reply_markup=get_main_keyboard())
 
-@bot.message_handler(content_types=['location'])
+@metrics.track_handler
+@admitted()
 def handle_location(message):
     """Обработка геолокации"""
     user_id = str(message.from_user.id)
@@ -81,7 +183,10 @@ def handle_location(message):
     lon = message.location.longitude
     
     user_data[user_id]['location'] = {'lat': lat, 'lon': lon}
-    save_user_data()
+    # Уведомления, включённые до отправки местоположения, начинают приходить только теперь
+    if is_subscribed(user_data[user_id]) and notification_scheduler.due_at(user_id) is None:
+        plan_notification(user_id)
+    save_user(user_id)
     
     weather = weather_app.get_current_weather(latitude=lat, longitude=lon)
     
@@ -91,23 +196,39 @@ def handle_location(message):
         text = format_current_weather(weather)
         bot.send_message(message.chat.id, text, parse_mode='HTML')
 
-@bot.message_handler(func=lambda message: message.text == '🌡️ Погода сейчас')
+@metrics.track_handler
 def weather_now_handler(message):
     """Запрос текущей погоды"""
     msg = bot.send_message(message.chat.id, "Введите название города:")
     bot.register_next_step_handler(msg, get_weather_now)
 
+@metrics.track_handler
+@admitted(cost=2)
 def get_weather_now(message):
     """Получает текущую погоду по городу"""
     city = message.text.strip()
     weather = weather_app.get_current_weather(city=city)
     
     if "error" in weather:
-        bot.send_message(message.chat.id, f"❌ {weather['error']}")
+        bot.send_message(message.chat.id, f"❌ {weather['error']}{format_suggestions(weather)}")
     else:
         text = format_current_weather(weather)
         bot.send_message(message.chat.id, text, parse_mode='HTML')
 
+def format_suggestions(error):
+    """Подсказка похожих названий для ошибки «Город не найден»"""
+    suggestions = error.get('suggestions')
+    if not suggestions:
+        return ""
+    return f"\nВозможно, вы имели в виду: {', '.join(suggestions)}"
+
+def format_stale_note(*datasets):
+    """Пометка о том, что показаны последние известные данные из кэша"""
+    ages = [age for age in map(weather_app.stale_age, datasets) if age is not None]
+    if not ages:
+        return ""
+    return f"\n\n⚠️ Сервис погоды недоступен, данные обновлены {max(ages) // 60} мин назад"
+
 def format_current_weather(weather):
     """Форматирует данные о текущей погоде"""
     try:
@@ -126,11 +247,12 @@ def format_current_weather(weather):
 🌪️ Ветер: {wind_speed} м/с
 🔽 Давление: {pressure} hPa
 ☁️ {description}"""
-        return text
+        return text + format_stale_note(weather)
     except Exception as e:
         return f"❌ Ошибка форматирования данных: {e}"
 
-@bot.message_handler(func=lambda message: message.text == '📅 Прогноз на 5 дней')
+@metrics.track_handler
+@admitted()
 def forecast_handler(message):
     """Прогноз на 5 дней"""
     user_id = str(message.from_user.id)
@@ -142,57 +264,39 @@ def forecast_handler(message):
     location = user_data[user_id]['location']
     forecast = get_5day_forecast(location['lat'], location['lon'])
     
-    if "error" in forecast:
+    if weather_app.is_error(forecast):
         bot.send_message(message.chat.id, f"❌ {forecast['error']}")
         return
     
     show_forecast_menu(message.chat.id, forecast)
 
 def get_5day_forecast(lat, lon):
-    """Получает прогноз на 5 дней"""
-    cached = weather_app.load_from_cache_by_key(lat, lon, 'forecast5d')
-    if cached:
-        return cached
-    
-    url = f"https://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&appid={weather_app.API_KEY}&units=metric&lang=ru"
-    
-    try:
-        response = weather_app.http_client.get_with_retries(url)
-        if response and response.status_code == 200:
-            data = response.json()
-            weather_app.save_to_cache_by_key(data, lat, lon, 'forecast5d')
+    """Получает прогноз на 5 дней (CompactForecast)"""
+    data = weather_app.get_forecast_5days(lat, lon)
+    if weather_app.is_error(data):
+        if data['error'] == weather_app.CACHE_ONLY_ERROR:
             return data
-        else:
-            return {"error": "Ошибка получения прогноза"}
-    except Exception as e:
-        return {"error": str(e)}
+        return {"error": "Ошибка получения прогноза"}
+    return data
 
 def show_forecast_menu(chat_id, forecast_data, message_id=None):
     """Показывает меню прогноза на 5 дней"""
-    days = {}
-    
-    for item in forecast_data['list']:
-        date = datetime.fromtimestamp(item['dt']).strftime('%Y-%m-%d')
-        if date not in days:
-            days[date] = []
-        days[date].append(item)
-    
     markup = types.InlineKeyboardMarkup(row_width=2)
     
-    for date in list(days.keys())[:5]:
-        day_name = datetime.strptime(date, '%Y-%m-%d').strftime('%d.%m (%a)')
-        avg_temp = sum(d['main']['temp'] for d in days[date]) / len(days[date])
-        btn_text = f"{day_name} | {avg_temp:.1f}°C"
+    for date, day in list(forecast_data.day_summaries().items())[:5]:
+        btn_text = f"{day['label']} | {day['avg_temp']:.1f}°C"
         markup.add(types.InlineKeyboardButton(btn_text, callback_data=f"day_{date}"))
     
     text = "📅 <b>Прогноз погоды на 5 дней</b>\n\nВыберите день для детальной информации:"
+    text += format_stale_note(forecast_data)
     
     if message_id:
         bot.edit_message_text(text, chat_id, message_id, parse_mode='HTML', reply_markup=markup)
     else:
         bot.send_message(chat_id, text, parse_mode='HTML', reply_markup=markup)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('day_'))
+@metrics.track_handler
+@admitted(dedup=False)
 def show_day_details(call):
     """Показывает детали конкретного дня"""
     user_id = str(call.from_user.id)
@@ -205,20 +309,16 @@ def show_day_details(call):
     location = user_data[user_id]['location']
     forecast = get_5day_forecast(location['lat'], location['lon'])
     
-    day_data = [item for item in forecast['list'] 
-                if datetime.fromtimestamp(item['dt']).strftime('%Y-%m-%d') == date]
+    day = None if weather_app.is_error(forecast) else forecast.day_summaries().get(date)
     
-    if not day_data:
+    if not day:
         bot.answer_callback_query(call.id, "❌ Данные не найдены")
         return
     
-    text = f"📅 <b>Прогноз на {datetime.strptime(date, '%Y-%m-%d').strftime('%d.%m.%Y')}</b>\n\n"
+    text = f"📅 <b>Прогноз на {day['title']}</b>\n\n"
     
-    for item in day_data[:8]:
-        time = datetime.fromtimestamp(item['dt']).strftime('%H:%M')
-        temp = item['main']['temp']
-        desc = item['weather'][0]['description']
-        text += f"🕐 {time}: {temp}°C, {desc}\n"
+    for when, temp, description in forecast.day_rows(date)[:8]:
+        text += f"🕐 {when}: {temp:g}°C, {description}\n"
     
     markup = types.InlineKeyboardMarkup()
     markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_forecast"))
@@ -227,7 +327,8 @@ def show_day_details(call):
                          parse_mode='HTML', reply_markup=markup)
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == 'back_to_forecast')
+@metrics.track_handler
+@admitted(dedup=False)
 def back_to_forecast(call):
     """Возврат к меню прогноза"""
     user_id = str(call.from_user.id)
@@ -239,49 +340,99 @@ def back_to_forecast(call):
     location = user_data[user_id]['location']
     forecast = get_5day_forecast(location['lat'], location['lon'])
     
+    if weather_app.is_error(forecast):
+        bot.answer_callback_query(call.id, f"❌ {forecast['error']}")
+        return
+    
     show_forecast_menu(call.message.chat.id, forecast, call.message.message_id)
     bot.answer_callback_query(call.id)
 
-@bot.message_handler(func=lambda message: message.text == '🔔 Уведомления')
-def notifications_handler(message):
-    """Управление уведомлениями"""
-    user_id = str(message.from_user.id)
-    
+def format_quiet_hours(quiet_hours):
+    return f"{quiet_hours[0]:02d}:00–{quiet_hours[1]:02d}:00"
+
+def notifications_menu(user_id):
+    """Текст и клавиатура настроек уведомлений пользователя"""
     markup = types.InlineKeyboardMarkup(row_width=2)
-    status = user_data.get(user_id, {}).get('notifications', False)
-    
-    if status:
-        btn = types.InlineKeyboardButton("❌ Отключить", callback_data="notif_off")
-        text = "🔔 Уведомления <b>включены</b>\n\nВы получаете погодные оповещения каждые 2 часа."
+    data = user_data.get(user_id, {})
+    
+    if data.get('notifications', False):
+        hours = data.get('notify_interval', NOTIFICATION_INTERVAL) // 3600
+        quiet_hours = data.get('quiet_hours')
+        text = f"🔔 Уведомления <b>включены</b>\n\nВы получаете погодные оповещения каждые {hours} ч."
+        if quiet_hours:
+            text += f"\nНочью ({format_quiet_hours(quiet_hours)}) уведомления не приходят."
+        markup.add(types.InlineKeyboardButton("❌ Отключить", callback_data="notif_off"))
+        markup.row(*[types.InlineKeyboardButton(f"{'✅ ' if choice == hours else ''}{choice} ч",
+                                                callback_data=f"notif_every_{choice}")
+                     for choice in NOTIFICATION_INTERVAL_CHOICES])
+        if quiet_hours:
+            markup.add(types.InlineKeyboardButton("🔔 Присылать и ночью", callback_data="notif_quiet_off"))
+        else:
+            markup.add(types.InlineKeyboardButton(f"🌙 Не беспокоить {format_quiet_hours(QUIET_HOURS)}",
+                                                  callback_data="notif_quiet_on"))
     else:
-        btn = types.InlineKeyboardButton("✅ Включить", callback_data="notif_on")
         text = "🔕 Уведомления <b>отключены</b>\n\nВключите их, чтобы получать погодные оповещения."
+        markup.add(types.InlineKeyboardButton("✅ Включить", callback_data="notif_on"))
     
-    markup.add(btn)
+    return text, markup
+
+@metrics.track_handler
+def notifications_handler(message):
+    """Управление уведомлениями"""
+    text, markup = notifications_menu(str(message.from_user.id))
     bot.send_message(message.chat.id, text, parse_mode='HTML', reply_markup=markup)
 
-@bot.callback_query_handler(func=lambda call: call.data in ['notif_on', 'notif_off'])
+@metrics.track_handler
 def toggle_notifications(call):
     """Переключает уведомления"""
     user_id = str(call.from_user.id)
     
     if call.data == 'notif_on':
         user_data[user_id]['notifications'] = True
+        if is_subscribed(user_data[user_id]):
+            plan_notification(user_id)
         text = "✅ Уведомления включены!"
     else:
         user_data[user_id]['notifications'] = False
+        user_data[user_id].pop('next_due', None)
+        notification_scheduler.cancel(user_id)
         text = "❌ Уведомления отключены!"
     
-    save_user_data()
+    save_user(user_id)
     bot.answer_callback_query(call.id, text, show_alert=True)
     bot.delete_message(call.message.chat.id, call.message.message_id)
 
-@bot.message_handler(func=lambda message: message.text == '🌍 Сравнить города')
+@metrics.track_handler
+def notification_settings(call):
+    """Меняет интервал уведомлений и тихие часы"""
+    user_id = str(call.from_user.id)
+    data = user_data.get(user_id)
+    if not data or not data.get('notifications'):
+        bot.answer_callback_query(call.id, "❌ Уведомления отключены")
+        return
+    
+    if call.data.startswith('notif_every_'):
+        data['notify_interval'] = int(call.data.replace('notif_every_', '')) * 3600
+    else:
+        data['quiet_hours'] = list(QUIET_HOURS) if call.data == 'notif_quiet_on' else None
+    # Новое расписание отсчитывается от текущего момента
+    if is_subscribed(data):
+        plan_notification(user_id)
+    save_user(user_id)
+    
+    text, markup = notifications_menu(user_id)
+    bot.edit_message_text(text, call.message.chat.id, call.message.message_id,
+                          parse_mode='HTML', reply_markup=markup)
+    bot.answer_callback_query(call.id, "✅ Сохранено")
+
+@metrics.track_handler
 def compare_cities_handler(message):
     """Запрос сравнения городов"""
     msg = bot.send_message(message.chat.id, "Введите два города через запятую (например: Москва, Париж):")
     bot.register_next_step_handler(msg, compare_cities)
 
+@metrics.track_handler
+@admitted(cost=4)
 def compare_cities(message):
     """Сравнивает погоду в двух городах"""
     try:
@@ -290,15 +441,15 @@ def compare_cities(message):
             bot.send_message(message.chat.id, "❌ Введите ровно два города через запятую!")
             return
         
-        weather1 = weather_app.get_current_weather(city=cities[0])
-        weather2 = weather_app.get_current_weather(city=cities[1])
+        results = weather_app.get_batch('weather', cities)
+        weather1, weather2 = results[cities[0]], results[cities[1]]
         
         if "error" in weather1:
-            bot.send_message(message.chat.id, f"❌ {cities[0]}: {weather1['error']}")
+            bot.send_message(message.chat.id, f"❌ {cities[0]}: {weather1['error']}{format_suggestions(weather1)}")
             return
         
         if "error" in weather2:
-            bot.send_message(message.chat.id, f"❌ {cities[1]}: {weather2['error']}")
+            bot.send_message(message.chat.id, f"❌ {cities[1]}: {weather2['error']}{format_suggestions(weather2)}")
             return
         
         text = format_comparison(weather1, weather2)
@@ -330,9 +481,9 @@ def format_comparison(w1, w2):
    {w1['name']}: {w1['weather'][0]['description']}
    {w2['name']}: {w2['weather'][0]['description']}"""
     
-    return text
+    return text + format_stale_note(w1, w2)
 
-@bot.message_handler(func=lambda message: message.text == '📊 Расширенные данные')
+@metrics.track_handler
 def extended_data_handler(message):
     """Запрос расширенных данных"""
     markup = types.InlineKeyboardMarkup(row_width=1)
@@ -342,7 +493,8 @@ def extended_data_handler(message):
     
     bot.send_message(message.chat.id, "Выберите способ поиска:", reply_markup=markup)
 
-@bot.callback_query_handler(func=lambda call: call.data == 'ext_geo')
+@metrics.track_handler
+@admitted(cost=2)
 def extended_by_geo(call):
     """Расширенные данные по геолокации"""
     user_id = str(call.from_user.id)
@@ -355,28 +507,32 @@ def extended_by_geo(call):
     show_extended_data(call.message.chat.id, lat=location['lat'], lon=location['lon'])
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == 'ext_city')
+@metrics.track_handler
 def extended_by_city_request(call):
     """Запрос города для расширенных данных"""
     msg = bot.send_message(call.message.chat.id, "Введите название города:")
     bot.register_next_step_handler(msg, extended_by_city)
     bot.answer_callback_query(call.id)
 
+@metrics.track_handler
+@admitted(cost=3)
 def extended_by_city(message):
     """Расширенные данные по городу"""
     city = message.text.strip()
-    coords = weather_app.get_coordinates(city)
+    place = weather_app.geocode(city)
     
-    if not coords:
-        bot.send_message(message.chat.id, "❌ Город не найден!")
+    if "error" in place:
+        bot.send_message(message.chat.id, f"❌ {place['error']}{format_suggestions(place)}")
         return
     
-    show_extended_data(message.chat.id, lat=coords[0], lon=coords[1], city=city)
+    show_extended_data(message.chat.id, lat=place['lat'], lon=place['lon'], city=place['name'] or city)
 
 def show_extended_data(chat_id, lat, lon, city=None):
     """Показывает расширенные данные о погоде"""
-    weather = weather_app.get_weather_by_coordinates(lat, lon)
-    air_pollution = weather_app.get_air_pollution(lat, lon)
+    weather, air_pollution = weather_app.gather(
+        (weather_app.get_weather_by_coordinates, lat, lon),
+        (weather_app.get_air_pollution, lat, lon)
+    )
     
     if "error" in weather:
         bot.send_message(chat_id, f"❌ {weather['error']}")
@@ -412,38 +568,255 @@ def show_extended_data(chat_id, lat, lon, city=None):
             air_text = weather_app.analize_air_pollution(air_pollution, extended=True)
             text += f"\n{air_text}"
         
+        text += format_stale_note(weather, air_pollution)
+        
         bot.send_message(chat_id, text, parse_mode='HTML')
         
     except Exception as e:
         bot.send_message(chat_id, f"❌ Ошибка: {e}")
 
+def _send_notification(user_id, text):
+    """Отправляет одно уведомление, возвращает True при успехе"""
+    try:
+        bot.send_message(int(user_id), text, parse_mode='HTML')
+        return True
+    except Exception:
+        return False
+
+def is_subscribed(data):
+    """Нужно ли слать пользователю уведомления (включены и есть местоположение)"""
+    return bool(data.get('notifications') and data.get('location'))
+
+def plan_notification(user_id, now=None):
+    """Назначает следующее уведомление пользователя по его интервалу и тихим часам (без сохранения)"""
+    now = time.time() if now is None else now
+    data = user_data[user_id]
+    due = next_due_time(now, data.get('notify_interval', NOTIFICATION_INTERVAL), NOTIFICATION_JITTER,
+                        data.get('quiet_hours'), data.get('tz_offset', DEFAULT_TZ_OFFSET))
+    data['next_due'] = int(due)
+    notification_scheduler.schedule(user_id, data['next_due'])
+
+def load_notification_schedule(now=None):
+    """
+    Строит очередь уведомлений из user_data при запуске.
+
+    Сохранённое next_due переживает перезапуск. Уведомления, просроченные за время
+    простоя, растягиваются на NOTIFICATION_CATCHUP секунд, а подписчики без next_due
+    (записи до появления расписания) — равномерно на свой интервал, чтобы не уйти разом.
+    """
+    now = time.time() if now is None else now
+    items = []
+    for user_id, data in list(user_data.items()):
+        if not is_subscribed(data):
+            continue
+        due = data.get('next_due')
+        if due is None:
+            due = now + spread_offset(user_id, data.get('notify_interval', NOTIFICATION_INTERVAL))
+        elif due < now:
+            due = now + spread_offset(user_id, NOTIFICATION_CATCHUP)
+        due = defer_quiet_hours(due, data.get('quiet_hours'), data.get('tz_offset', DEFAULT_TZ_OFFSET),
+                                spread_offset(user_id, NOTIFICATION_CATCHUP))
+        items.append((user_id, due))
+    notification_scheduler.schedule_many(items)
+    return len(items)
+
+def run_notification_cycle(user_ids=None):
+    """
+    Рассылка уведомлений пользователям user_ids (по умолчанию — всем подписчикам).
+
+    Подписчики группируются по ячейке кэша погоды: погода запрашивается и
+    форматируется один раз на ячейку, затем сообщение рассылается всем её пользователям.
+    """
+    started = time.monotonic()
+    cells = {}
+    for user_id in (list(user_data) if user_ids is None else user_ids):
+        data = user_data.get(user_id)
+        if data and is_subscribed(data):
+            location = data['location']
+            cell = weather_app.quantize_coordinates(location['lat'], location['lon'], 'weather')
+            cells.setdefault(cell, []).append(user_id)
+    
+    stats = {'users': sum(len(users) for users in cells.values()), 'cells': len(cells),
+             'sent': 0, 'failed': 0, 'fetch_errors': 0}
+    
+    http_client = weather_app.http_client
+    with ThreadPoolExecutor(NOTIFICATION_SEND_WORKERS) as send_pool, \
+            http_client.request_priority(http_client.PRIORITY_BACKGROUND):
+        sends = []
+        for cell, weather in weather_app.iter_batch('weather', list(cells),
+                                                    max_workers=NOTIFICATION_FETCH_WORKERS):
+            if "error" in weather:
+                stats['fetch_errors'] += 1
+                continue
+            
+            # Часовой пояс места нужен для тихих часов следующего уведомления
+            if weather.get('timezone') is not None:
+                for user_id in cells[cell]:
+                    user_data[user_id]['tz_offset'] = weather['timezone']
+            
+            text = f"🔔 <b>Погодное уведомление</b>\n\n"
+            text += format_current_weather(weather)
+            for user_id in cells[cell]:
+                sends.append(send_pool.submit(_send_notification, user_id, text))
+        
+        for future in as_completed(sends):
+            stats['sent' if future.result() else 'failed'] += 1
+    
+    stats['duration'] = round(time.monotonic() - started, 3)
+    metrics.NOTIFICATION_CYCLE.observe(stats['duration'])
+    for counter, value in stats.items():
+        metrics.NOTIFICATION_LAST.set(value, counter=counter)
+    print(f"🔔 Рассылка: {stats['users']} польз., {stats['cells']} ячеек, отправлено {stats['sent']}, "
+          f"ошибок отправки {stats['failed']}, ошибок погоды {stats['fetch_errors']} за {stats['duration']} с")
+    return stats
+
+def send_due_notifications(now=None):
+    """
+    Рассылает наступившие уведомления и назначает этим пользователям следующие.
+
+    Из очереди берутся только наступившие записи (не больше NOTIFICATION_BATCH_SIZE),
+    поэтому стоимость прохода зависит от числа уведомлений, а не подписчиков.
+    Возвращает статистику рассылки или None, если рассылать нечего.
+    """
+    now = time.time() if now is None else now
+    due = [user_id for user_id, _ in notification_scheduler.pop_due(now, limit=NOTIFICATION_BATCH_SIZE)
+           if user_id in user_data and is_subscribed(user_data[user_id])]
+    if not due:
+        return None
+    try:
+        return run_notification_cycle(due)
+    finally:
+        # Следующее уведомление назначается и при ошибке рассылки, иначе пользователь выпал бы из очереди
+        for user_id in due:
+            plan_notification(user_id, now)
+        save_users(due)
+        metrics.NOTIFICATION_LAST.set(len(notification_scheduler), counter='scheduled')
+
 def weather_notification_worker():
-    """Фоновая задача для отправки уведомлений"""
+    """Фоновая задача: спит до ближайшего уведомления в очереди и рассылает наступившие"""
     while True:
         try:
-            time.sleep(7200)
-            
-            for user_id, data in user_data.items():
-                if data.get('notifications') and data.get('location'):
-                    location = data['location']
-                    weather = weather_app.get_current_weather(
-                        latitude=location['lat'], 
-                        longitude=location['lon']
-                    )
-                    
-                    if "error" not in weather:
-                        text = f"🔔 <b>Погодное уведомление</b>\n\n"
-                        text += format_current_weather(weather)
-                        
-                        try:
-                            bot.send_message(int(user_id), text, parse_mode='HTML')
-                        except:
-                            pass
-        except:
-            pass
-
-notification_thread = threading.Thread(target=weather_notification_worker, daemon=True)
-notification_thread.start()
-
-print("🤖 Бот запущен...")
-bot.polling(none_stop=True)
\ No newline at end of file
+            next_due = notification_scheduler.next_due()
+            delay = NOTIFICATION_TICK if next_due is None else min(NOTIFICATION_TICK, next_due - time.time())
+            if delay > 0:
+                notification_scheduler.wait(delay)
+                continue
+            send_due_notifications()
+        except Exception as e:
+            print(f"❌ Ошибка рассылки уведомлений: {e}")
+            time.sleep(NOTIFICATION_TICK)
+
+def start_notifications():
+    """Строит расписание уведомлений и запускает фоновую рассылку"""
+    scheduled = load_notification_schedule()
+    metrics.NOTIFICATION_LAST.set(scheduled, counter='scheduled')
+    print(f"🔔 Уведомлений в расписании: {scheduled}")
+    thread = threading.Thread(target=weather_notification_worker, name='notifications', daemon=True)
+    thread.start()
+    return thread
+
+def warm_up_cache(budget=None):
+    """
+    Прогревает кэш для мест подписчиков после перезапуска.
+
+    Места берутся из user_data (пользователи с включёнными уведомлениями), самые
+    популярные ячейки — первыми. В API уходит не больше budget запросов с приоритетом
+    PRIORITY_PREFETCH, поэтому прогрев не отнимает квоту у запросов пользователей.
+    """
+    budget = WARMUP_BUDGET if budget is None else budget
+    locations = [(data['location']['lat'], data['location']['lon'])
+                 for data in list(user_data.values())
+                 if data.get('notifications') and data.get('location')]
+    stats = weather_app.warm_cache(locations, WARMUP_ENDPOINTS, budget=budget)
+    print(f"🔥 Прогрев кэша: {stats['cells']} ячеек, из кэша {stats['cached']}, загружено {stats['fetched']}, "
+          f"ошибок {stats['failed']}, пропущено {stats['skipped']} за {stats['duration']} с")
+    return stats
+
+def start_warm_up(budget=None):
+    """Запускает прогрев кэша в фоне, чтобы он не задерживал приём обновлений"""
+    thread = threading.Thread(target=warm_up_cache, args=(budget,), name='cache-warmup', daemon=True)
+    thread.start()
+    return thread
+
+def process_raw_update(update):
+    """Передаёт сырое обновление из webhook в обработчики telebot"""
+    bot.process_new_updates([types.Update.de_json(update)])
+
+def run_webhook():
+    """Принимает обновления через webhook и обрабатывает их пулом потоков"""
+    if not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL не установлен")
+    
+    # Обработчики вызываются в потоках диспетчера, собственный пул telebot не нужен
+    bot.threaded = False
+    dispatcher = UpdateDispatcher(process_raw_update, workers=WEBHOOK_WORKERS,
+                                  queue_size=WEBHOOK_QUEUE_SIZE, overflow=WEBHOOK_OVERFLOW)
+    dispatcher.start()
+    server = WebhookServer(dispatcher, host=WEBHOOK_HOST, port=WEBHOOK_PORT,
+                           path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+    bot.remove_webhook()
+    bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+    print(f"🌐 Webhook слушает {WEBHOOK_HOST}:{server.port}{WEBHOOK_PATH}")
+    server.serve_forever()
+
+def register_handlers(bot):
+    """Регистрирует обработчики бота (порядок важен: срабатывает первый подходящий)"""
+    bot.register_message_handler(send_welcome, commands=['start'])
+    bot.register_message_handler(handle_location, content_types=['location'])
+    bot.register_message_handler(weather_now_handler, func=lambda message: message.text == '🌡️ Погода сейчас')
+    bot.register_message_handler(forecast_handler, func=lambda message: message.text == '📅 Прогноз на 5 дней')
+    bot.register_callback_query_handler(show_day_details, func=lambda call: call.data.startswith('day_'))
+    bot.register_callback_query_handler(back_to_forecast, func=lambda call: call.data == 'back_to_forecast')
+    bot.register_message_handler(notifications_handler, func=lambda message: message.text == '🔔 Уведомления')
+    bot.register_callback_query_handler(toggle_notifications, func=lambda call: call.data in ['notif_on', 'notif_off'])
+    bot.register_callback_query_handler(notification_settings,
+                                        func=lambda call: call.data.startswith(('notif_every_', 'notif_quiet_')))
+    bot.register_message_handler(compare_cities_handler, func=lambda message: message.text == '🌍 Сравнить города')
+    bot.register_message_handler(extended_data_handler, func=lambda message: message.text == '📊 Расширенные данные')
+    bot.register_callback_query_handler(extended_by_geo, func=lambda call: call.data == 'ext_geo')
+    bot.register_callback_query_handler(extended_by_city_request, func=lambda call: call.data == 'ext_city')
+
+def create_bot(token=None):
+    """Создаёт бота, регистрирует обработчики и делает его текущим для модуля"""
+    global bot
+    token = token or BOT_TOKEN
+    if not token:
+        raise ValueError("BOT_TOKEN не установлен")
+    if TELEGRAM_API_URL:
+        telebot.apihelper.API_URL = TELEGRAM_API_URL
+    bot = telebot.TeleBot(token)
+    register_handlers(bot)
+    return bot
+
+def start_services(metrics_port=None):
+    """Запускает фоновые задачи процесса: метрики, прогрев кэша, предзагрузку и рассылку"""
+    if metrics_port:
+        metrics.start_server(metrics_port)
+        print(f"📈 Метрики: http://127.0.0.1:{metrics_port}/metrics")
+    
+    if WARMUP_BUDGET > 0:
+        start_warm_up()
+    if weather_app.PREFETCH_TOP_K > 0:
+        weather_app.start_prefetcher()
+    start_notifications()
+
+def main():
+    """Точка входа: загружает пользователей, запускает фоновые задачи и приём обновлений"""
+    if BOT_WORKERS > 1:
+        import supervisor
+        supervisor.main([])
+        return
+    
+    weather_app.check_config()
+    create_bot()
+    load_user_data()
+    start_services(int(METRICS_PORT) if METRICS_PORT else None)
+    
+    print("🤖 Бот запущен...")
+    if BOT_MODE == 'webhook':
+        run_webhook()
+    else:
+        bot.polling(none_stop=True)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,337 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import heapq
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class MemoryCache:
+    """
+    Потокобезопасный LRU-кэш в памяти с ограничением по числу записей и TTL.
+
+    Используется как первый уровень перед файловым кэшем: горячие ключи
+    отдаются без обращения к диску.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 600):
+        """
+        Args:
+            max_entries: Максимум записей, при превышении вытесняется самая старая по доступу
+            ttl: Время жизни записи в секундах (отсчитывается от fetched_at)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Возвращает значение, если оно есть и не устарело"""
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """Возвращает (значение, fetched_at), если запись есть и не устарела"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            fetched_at, value = entry
+            if time.time() - fetched_at >= self.ttl:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value, fetched_at
+
+    def set(self, key: Hashable, value: Any, fetched_at: Optional[float] = None):
+        """Кладёт значение в кэш; fetched_at — время получения данных (unix time)"""
+        if fetched_at is None:
+            fetched_at = time.time()
+        with self._lock:
+            self._entries[key] = (fetched_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable):
+        """Удаляет запись из кэша"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Очищает кэш и счётчики"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики попаданий, промахов и вытеснений"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом.
+
+    Пока для ключа выполняется запрос, остальные потоки не идут в API,
+    а ждут его результат. Исключение лидера пробрасывается всем ожидающим.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error: Optional[BaseException] = None
+            self.waiters = 0
+
+    def __init__(self):
+        self._calls: Dict[Hashable, "SingleFlight._Call"] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn, *args, **kwargs) -> Any:
+        """Выполняет fn(*args, **kwargs) не более одного раза на ключ одновременно"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self) -> int:
+        """Число ключей, по которым сейчас идёт запрос"""
+        with self._lock:
+            return len(self._calls)
+
+
+class AccessTracker:
+    """
+    Частота обращений к ключам с экспоненциальным затуханием.
+
+    Каждое обращение добавляет 1 к счётчику ключа, а счётчик убывает вдвое
+    каждые half_life секунд, поэтому top() отражает недавнюю популярность.
+    Хранится не больше max_keys ключей: при переполнении удаляются наименее популярные.
+    """
+
+    def __init__(self, half_life: float = 1800, max_keys: int = 10000):
+        """
+        Args:
+            half_life: Период полураспада счётчика в секундах
+            max_keys: Максимум отслеживаемых ключей
+        """
+        self.half_life = half_life
+        self.max_keys = max_keys
+        # key -> [счётчик на момент updated, updated, данные ключа]
+        self._entries: Dict[Hashable, list] = {}
+        self._lock = threading.Lock()
+
+    def _decayed(self, entry: list, now: float) -> float:
+        return entry[0] * 0.5 ** ((now - entry[1]) / self.half_life)
+
+    def hit(self, key: Hashable, meta: Any = None, now: Optional[float] = None):
+        """Учитывает обращение к ключу; meta — данные, нужные чтобы его обновить"""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= self.max_keys:
+                    self._prune(now)
+                self._entries[key] = [1.0, now, meta]
+            else:
+                entry[0] = self._decayed(entry, now) + 1
+                entry[1] = now
+                if meta is not None:
+                    entry[2] = meta
+
+    def _prune(self, now: float):
+        # Оставляем более популярную половину, чтобы не чистить при каждом новом ключе
+        ranked = sorted(self._entries, key=lambda key: self._decayed(self._entries[key], now))
+        for key in ranked[:max(1, len(ranked) // 2)]:
+            del self._entries[key]
+
+    def score(self, key: Hashable, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            return self._decayed(entry, now) if entry else 0.0
+
+    def top(self, k: int, min_score: float = 0.0, now: Optional[float] = None) -> List[Tuple[Hashable, float, Any]]:
+        """k самых популярных ключей: [(ключ, счётчик, данные)] по убыванию счётчика"""
+        now = time.time() if now is None else now
+        with self._lock:
+            scored = [(key, self._decayed(entry, now), entry[2]) for key, entry in self._entries.items()]
+        scored = [item for item in scored if item[1] >= min_score]
+        return heapq.nlargest(k, scored, key=lambda item: item[1])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCacheStore:
+    """
+    Файловый кэш ответов API в одной базе SQLite.
+
+    Данные хранятся компактным JSON, сжатым zlib. У каждой записи есть срок
+    хранения (expires_at): фоновая сборка удаляет просроченные записи пачкой
+    и при превышении max_bytes вытесняет самые старые. База работает в режиме
+    auto_vacuum=INCREMENTAL: после удаления освободившиеся страницы возвращаются
+    системе (PRAGMA incremental_vacuum), и файл на диске действительно уменьшается.
+    """
+
+    def __init__(self, path: str, max_bytes: Optional[int] = None):
+        """
+        Args:
+            path: Путь к файлу базы
+            max_bytes: Ограничение суммарного размера сжатых данных (None — без ограничения);
+                файл базы больше на служебные страницы и индексы
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._gc_thread: Optional[threading.Thread] = None
+        self._gc_stop = threading.Event()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        # Режим auto_vacuum задаётся до создания таблиц; базу старого формата переводим VACUUM
+        self._conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        if self._conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            try:
+                self._conn.execute('VACUUM')
+            except sqlite3.OperationalError as e:
+                # База занята другим процессом — переведём при следующем запуске
+                print(f"❌ Не удалось включить incremental vacuum для {path}: {e}")
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            ' key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, fetched_at REAL NOT NULL,'
+            ' expires_at REAL NOT NULL, size INTEGER NOT NULL, payload BLOB NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_fetched_at ON entries (fetched_at)')
+
+    @staticmethod
+    def _encode(data: Any) -> bytes:
+        return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    @staticmethod
+    def _decode(payload: bytes) -> Any:
+        return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Возвращает (данные, fetched_at) для неистёкшей записи или None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT payload, fetched_at FROM entries WHERE key = ? AND expires_at > ?',
+                (key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            return self._decode(row[0]), row[1]
+        except (zlib.error, ValueError):
+            self.delete(key)
+            return None
+
+    def set(self, key: str, endpoint: str, data: Any, fetched_at: float, ttl: float):
+        """Сохраняет запись; она хранится ttl секунд от fetched_at"""
+        payload = self._encode(data)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entries (key, endpoint, fetched_at, expires_at, size, payload) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, endpoint, fetched_at, fetched_at + ttl, len(payload), payload)
+            )
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def collect_garbage(self) -> int:
+        """Удаляет просроченные записи и вытесняет старые сверх max_bytes; возвращает число удалённых"""
+        with self._lock:
+            removed = self._conn.execute('DELETE FROM entries WHERE expires_at <= ?', (time.time(),)).rowcount
+            if self.max_bytes:
+                total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+                if total > self.max_bytes:
+                    excess = total - self.max_bytes
+                    rows = self._conn.execute('SELECT key, size FROM entries ORDER BY fetched_at').fetchall()
+                    victims = []
+                    for key, size in rows:
+                        if excess <= 0:
+                            break
+                        victims.append((key,))
+                        excess -= size
+                    self._conn.executemany('DELETE FROM entries WHERE key = ?', victims)
+                    removed += len(victims)
+            if removed:
+                # Возвращаем освободившиеся страницы и обрезаем журнал WAL. executescript выполняет
+                # прагму до конца; execute освободил бы одну страницу за вызов
+                self._conn.executescript('PRAGMA incremental_vacuum;')
+                self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        return removed
+
+    def start_gc(self, interval: float = 300):
+        """Запускает фоновую сборку мусора раз в interval секунд"""
+        if self._gc_thread is not None:
+            return
+
+        def run():
+            while not self._gc_stop.wait(interval):
+                try:
+                    self.collect_garbage()
+                except sqlite3.Error as e:
+                    print(f"❌ Ошибка очистки кэша: {e}")
+
+        self._gc_thread = threading.Thread(target=run, name='cache-gc', daemon=True)
+        self._gc_thread.start()
+
+    def stats(self) -> Dict[str, Any]:
+        """Число записей и размер данных по endpoint'ам"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT endpoint, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY endpoint'
+            ).fetchall()
+        return {endpoint: {'entries': count, 'bytes': size} for endpoint, count, size in rows}
+
+    def close(self):
+        self._gc_stop.set()
+        with self._lock:
+            self._conn.close()
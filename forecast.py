@@ -0,0 +1,228 @@
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import sys
+
+# Версия формата to_dict(); версия 1 — без индекса по дням (он строится при чтении),
+# записи неизвестной версии пересобираются из ответа API
+FORMAT_VERSION = 2
+
+
+def _centi(value: Optional[float]) -> int:
+    return int(round((value or 0) * 100))
+
+
+class CompactForecast:
+    """
+    Прогноз (почасовой или на 5 дней) в виде столбцов типизированных массивов.
+
+    Вместо списка вложенных словарей OpenWeatherMap хранятся массивы: время (unix),
+    температура и ощущаемая температура в сотых долях градуса, влажность, скорость
+    ветра в сотых м/с и номер погодного условия. Условия (id, описание, иконка)
+    хранятся один раз в таблице conditions, строки интернированы.
+
+    Срезы (по индексам, по времени, по дню) — тоже CompactForecast.
+
+    Индекс по местным дням (границы слотов, подписи, средняя/мин/макс температура и
+    время слотов «ЧЧ:ММ») строится один раз при получении прогноза и хранится вместе
+    с ним в кэше, поэтому меню и кнопки дней не разбирают время заново.
+    """
+
+    __slots__ = ('city', 'timezone', 'timestamps', 'temp', 'feels_like', 'humidity', 'wind_speed',
+                 'weather', 'conditions', 'stale_age', '_days')
+
+    def __init__(self, city: str = '', timezone_offset: int = 0, conditions: Optional[List[tuple]] = None):
+        self.city = city
+        self.timezone = timezone_offset
+        self.timestamps = array('q')
+        self.temp = array('h')
+        self.feels_like = array('h')
+        self.humidity = array('B')
+        self.wind_speed = array('H')
+        self.weather = array('H')
+        self.conditions: List[tuple] = conditions if conditions is not None else []
+        # Возраст данных в секундах, если отдана устаревшая запись кэша (см. weather_app.mark_stale)
+        self.stale_age: Optional[int] = None
+        self._days = None
+
+    @classmethod
+    def from_owm(cls, data: Dict[str, Any]) -> 'CompactForecast':
+        """Собирает прогноз из ответа OpenWeatherMap (forecast или forecast/hourly)"""
+        city = data.get('city', {})
+        forecast = cls(sys.intern(city.get('name', '')), city.get('timezone', 0))
+        codes = {}
+        for item in data['list']:
+            main = item.get('main', {})
+            condition = item.get('weather') or [{}]
+            condition = (condition[0].get('id', 0), condition[0].get('description', ''),
+                         condition[0].get('icon', ''))
+            code = codes.get(condition)
+            if code is None:
+                code = codes[condition] = len(forecast.conditions)
+                forecast.conditions.append((condition[0], sys.intern(condition[1]), sys.intern(condition[2])))
+            forecast.timestamps.append(item['dt'])
+            forecast.temp.append(_centi(main.get('temp')))
+            forecast.feels_like.append(_centi(main.get('feels_like')))
+            forecast.humidity.append(int(main.get('humidity') or 0))
+            forecast.wind_speed.append(_centi(item.get('wind', {}).get('speed')))
+            forecast.weather.append(code)
+        forecast._days = forecast._build_days()
+        return forecast
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Представление для JSON (файловый кэш)"""
+        return {
+            'format': FORMAT_VERSION,
+            'city': self.city,
+            'timezone': self.timezone,
+            'conditions': [list(condition) for condition in self.conditions],
+            'timestamps': self.timestamps.tolist(),
+            'temp': self.temp.tolist(),
+            'feels_like': self.feels_like.tolist(),
+            'humidity': self.humidity.tolist(),
+            'wind_speed': self.wind_speed.tolist(),
+            'weather': self.weather.tolist(),
+            'days': self._day_index(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'CompactForecast':
+        """Восстанавливает прогноз из to_dict(); для ответа API старого формата — из from_owm()"""
+        if data.get('format') not in (1, FORMAT_VERSION):
+            return cls.from_owm(data)
+        conditions = [(code, sys.intern(description), sys.intern(icon))
+                      for code, description, icon in data['conditions']]
+        forecast = cls(sys.intern(data['city']), data['timezone'], conditions)
+        forecast.timestamps = array('q', data['timestamps'])
+        forecast.temp = array('h', data['temp'])
+        forecast.feels_like = array('h', data['feels_like'])
+        forecast.humidity = array('B', data['humidity'])
+        forecast.wind_speed = array('H', data['wind_speed'])
+        forecast.weather = array('H', data['weather'])
+        forecast._days = data.get('days') or forecast._build_days()
+        return forecast
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __getitem__(self, index: slice) -> 'CompactForecast':
+        """Срез по индексам слотов: forecast[:24]"""
+        if not isinstance(index, slice):
+            raise TypeError("CompactForecast поддерживает только срезы; для одного слота используйте row()")
+        part = CompactForecast(self.city, self.timezone, self.conditions)
+        part.timestamps = self.timestamps[index]
+        part.temp = self.temp[index]
+        part.feels_like = self.feels_like[index]
+        part.humidity = self.humidity[index]
+        part.wind_speed = self.wind_speed[index]
+        part.weather = self.weather[index]
+        part.stale_age = self.stale_age
+        return part
+
+    def copy(self) -> 'CompactForecast':
+        """Копия с тем же индексом по дням (индекс не меняется, поэтому общий)"""
+        part = self[:]
+        part._days = self._days
+        return part
+
+    def between(self, start: float, end: float) -> 'CompactForecast':
+        """Слоты со временем в интервале [start, end) (unix time); двоичный поиск по времени"""
+        return self[bisect_left(self.timestamps, start):bisect_left(self.timestamps, end)]
+
+    def local_time(self, index: int) -> datetime:
+        """Местное время слота в часовом поясе города"""
+        return datetime.fromtimestamp(self.timestamps[index], timezone(timedelta(seconds=self.timezone)))
+
+    def _build_days(self) -> Dict[str, Dict[str, Any]]:
+        # Слоты идут по времени, поэтому каждый день — непрерывный диапазон индексов
+        days = {}
+        for index in range(len(self)):
+            local_time = self.local_time(index)
+            date = local_time.strftime('%Y-%m-%d')
+            day = days.get(date)
+            if day is None:
+                day = days[date] = {
+                    'start': index,
+                    'label': local_time.strftime('%d.%m (%a)'),
+                    'title': local_time.strftime('%d.%m.%Y'),
+                    'times': [],
+                }
+            day['stop'] = index + 1
+            day['times'].append(local_time.strftime('%H:%M'))
+        for day in days.values():
+            temps = self.temp[day['start']:day['stop']]
+            day['avg_temp'] = sum(temps) / len(temps) / 100
+            day['min_temp'] = min(temps) / 100
+            day['max_temp'] = max(temps) / 100
+        return days
+
+    def _day_index(self) -> Dict[str, Dict[str, Any]]:
+        if self._days is None:
+            self._days = self._build_days()
+        return self._days
+
+    def dates(self) -> List[str]:
+        """Местные даты прогноза (YYYY-MM-DD) по порядку"""
+        return list(self._day_index())
+
+    def day_summaries(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Индекс по дням: {дата: {'label', 'title', 'avg_temp', 'min_temp', 'max_temp',
+        'times', 'start', 'stop'}} по порядку. Не изменять — индекс общий с кэшем.
+        """
+        return self._day_index()
+
+    def day(self, date: str) -> Optional['CompactForecast']:
+        """Слоты одной местной даты или None"""
+        day = self._day_index().get(date)
+        return self[day['start']:day['stop']] if day else None
+
+    def day_rows(self, date: str) -> List[Tuple[str, float, str]]:
+        """(время «ЧЧ:ММ», температура, описание) по слотам дня; пусто, если дня нет"""
+        day = self._day_index().get(date)
+        if not day:
+            return []
+        return [(when, self.temp[index] / 100, self.description(index))
+                for when, index in zip(day['times'], range(day['start'], day['stop']))]
+
+    def days(self) -> Dict[str, 'CompactForecast']:
+        """{дата: прогноз на этот день} по порядку"""
+        return {date: self[day['start']:day['stop']] for date, day in self._day_index().items()}
+
+    def temperatures(self) -> List[float]:
+        return [value / 100 for value in self.temp]
+
+    @property
+    def avg_temp(self) -> float:
+        return sum(self.temp) / len(self.temp) / 100 if self.temp else 0.0
+
+    @property
+    def min_temp(self) -> float:
+        return min(self.temp) / 100 if self.temp else 0.0
+
+    @property
+    def max_temp(self) -> float:
+        return max(self.temp) / 100 if self.temp else 0.0
+
+    def description(self, index: int) -> str:
+        return self.conditions[self.weather[index]][1]
+
+    def row(self, index: int) -> Dict[str, Any]:
+        """Один слот в виде словаря (для вывода и отладки)"""
+        condition = self.conditions[self.weather[index]]
+        return {
+            'dt': self.timestamps[index],
+            'temp': self.temp[index] / 100,
+            'feels_like': self.feels_like[index] / 100,
+            'humidity': self.humidity[index],
+            'wind_speed': self.wind_speed[index] / 100,
+            'weather_id': condition[0],
+            'description': condition[1],
+            'icon': condition[2],
+        }
+
+    def rows(self) -> Iterator[Tuple[datetime, float, str]]:
+        """(местное время, температура, описание) по каждому слоту"""
+        for index in range(len(self)):
+            yield self.local_time(index), self.temp[index] / 100, self.description(index)
@@ -0,0 +1,208 @@
+import csv
+import os
+import re
+import threading
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Встроенный справочник городов; GAZETTEER_FILE может указывать на свой CSV того же формата
+# или на выгрузку GeoNames (cities15000.txt и т.п., формат определяется по расширению .txt)
+DEFAULT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'cities.csv')
+# Опечатка исправляется без запроса к API, только если запрос не короче FUZZY_MIN_LENGTH
+# символов и ближе всего к одному городу: короткие названия легко спутать с соседними
+FUZZY_MIN_LENGTH = 5
+FUZZY_MAX_DISTANCE = 1
+
+City = namedtuple('City', ['name', 'name_en', 'country', 'lat', 'lon', 'population'])
+
+# Транслитерация кириллицы в латиницу (упрощённая, как в загранпаспортах);
+# по ней строится ключ поиска, поэтому «Moskva», «Москва» и «moskwa» оказываются рядом
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh',
+    'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    'є': 'ye', 'і': 'i', 'ї': 'yi', 'ґ': 'g', 'ў': 'u',
+}
+_TRANSLIT_TABLE = str.maketrans(TRANSLIT)
+_SEPARATORS = re.compile(r"[^0-9a-z]+")
+_CYRILLIC = re.compile('[а-яё]', re.IGNORECASE)
+_LATIN_ACCENTS = str.maketrans('áàâäãåçéèêëíìîïñóòôöõúùûüýÿ', 'aaaaaaceeeeiiiinooooouuuuyy')
+
+
+def search_key(name: str) -> str:
+    """
+    Ключ поиска: нижний регистр, латиница, слова через один пробел.
+
+    «Санкт-Петербург» и «Sankt Peterburg» дают один ключ «sankt peterburg».
+    """
+    key = name.casefold().translate(_TRANSLIT_TABLE).translate(_LATIN_ACCENTS)
+    return _SEPARATORS.sub(' ', key).strip()
+
+
+class _Node:
+    __slots__ = ('children', 'cities')
+
+    def __init__(self):
+        self.children: Dict[str, '_Node'] = {}
+        self.cities: List[int] = []
+
+
+class Gazetteer:
+    """
+    Локальный справочник городов: точный, префиксный и нечёткий поиск.
+
+    Все названия (русское, английское, альтернативные) приводятся к ключу поиска
+    (search_key) и складываются в словарь для точного поиска и в префиксное дерево
+    для поиска по началу названия и по расстоянию редактирования. При нескольких
+    городах с одним названием первым идёт самый населённый.
+    """
+
+    def __init__(self, cities: Iterable[Tuple[City, Iterable[str]]] = ()):
+        self.cities: List[City] = []
+        self._exact: Dict[str, List[int]] = {}
+        self._root = _Node()
+        for city, names in cities:
+            self.add(city, names)
+
+    def add(self, city: City, names: Iterable[str] = ()):
+        """Добавляет город под его названиями (name, name_en и names)"""
+        index = len(self.cities)
+        self.cities.append(city)
+        keys = {search_key(name) for name in (city.name, city.name_en, *names) if name}
+        for key in keys - {''}:
+            ids = self._exact.setdefault(key, [])
+            ids.append(index)
+            ids.sort(key=lambda i: -self.cities[i].population)
+            node = self._root
+            for char in key:
+                node = node.children.setdefault(char, _Node())
+            node.cities = ids
+
+    def __len__(self) -> int:
+        return len(self.cities)
+
+    def lookup(self, query: str) -> Optional[City]:
+        """Точное совпадение (с учётом транслитерации), самый населённый из одноимённых"""
+        ids = self._exact.get(search_key(query))
+        return self.cities[ids[0]] if ids else None
+
+    def prefix(self, query: str, limit: int = 5) -> List[City]:
+        """Города, одно из названий которых начинается с query, по убыванию населения"""
+        node = self._root
+        for char in search_key(query):
+            node = node.children.get(char)
+            if node is None:
+                return []
+        found = set()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            found.update(node.cities)
+            stack.extend(node.children.values())
+        return [self.cities[i] for i in sorted(found, key=lambda i: -self.cities[i].population)[:limit]]
+
+    def fuzzy(self, query: str, max_distance: Optional[int] = None, limit: int = 5) -> List[Tuple[City, int]]:
+        """
+        Города с названием на расстоянии редактирования не больше max_distance.
+
+        По умолчанию допускается 1 ошибка для коротких запросов и 2 для длинных.
+        Обход дерева отсекает ветви, где уже ни одна строка таблицы не укладывается в порог.
+        """
+        key = search_key(query)
+        if not key:
+            return []
+        if max_distance is None:
+            max_distance = 1 if len(key) <= 5 else 2
+        best: Dict[int, int] = {}
+        first_row = list(range(len(key) + 1))
+        stack = [(child, char, first_row) for char, child in self._root.children.items()]
+        while stack:
+            node, char, previous = stack.pop()
+            row = [previous[0] + 1]
+            for j, query_char in enumerate(key, 1):
+                row.append(min(row[j - 1] + 1, previous[j] + 1, previous[j - 1] + (query_char != char)))
+            if node.cities and row[-1] <= max_distance:
+                for index in node.cities:
+                    if row[-1] < best.get(index, max_distance + 1):
+                        best[index] = row[-1]
+            if min(row) <= max_distance:
+                stack.extend((child, next_char, row) for next_char, child in node.children.items())
+        ranked = sorted(best.items(), key=lambda item: (item[1], -self.cities[item[0]].population))
+        return [(self.cities[index], distance) for index, distance in ranked[:limit]]
+
+    def closest(self, query: str, max_distance: int = FUZZY_MAX_DISTANCE,
+                min_length: int = FUZZY_MIN_LENGTH) -> Optional[City]:
+        """
+        Город, в названии которого запрос отличается не больше чем на max_distance правок.
+
+        None — если запрос короче min_length или одинаково близких городов с разными
+        названиями несколько: тогда решает API геокодирования, а пользователю
+        предлагаются варианты (suggest).
+        """
+        if len(search_key(query)) < min_length:
+            return None
+        matches = self.fuzzy(query, max_distance=max_distance, limit=2)
+        if not matches:
+            return None
+        (best, distance), rest = matches[0], matches[1:]
+        if rest and rest[0][1] == distance and rest[0][0].name != best.name:
+            return None
+        return best
+
+    def suggest(self, query: str, limit: int = 3) -> List[City]:
+        """Варианты «возможно, вы имели в виду»: сначала близкие по написанию, затем по началу"""
+        suggestions = [city for city, _ in self.fuzzy(query, limit=limit)]
+        if len(suggestions) < limit and len(search_key(query)) >= 3:
+            for city in self.prefix(query, limit=limit):
+                if city not in suggestions:
+                    suggestions.append(city)
+        return suggestions[:limit]
+
+
+def _read_csv(path: str):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            city = City(row['name'], row.get('name_en') or '', row.get('country') or '',
+                        float(row['lat']), float(row['lon']), int(row.get('population') or 0))
+            alt_names = [name for name in (row.get('alt_names') or '').split('|') if name]
+            yield city, alt_names
+
+
+def _read_geonames(path: str):
+    # Формат GeoNames: geonameid, name, asciiname, alternatenames, latitude, longitude, ..., population (15)
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 15:
+                continue
+            alternates = [name for name in fields[3].split(',') if name]
+            # Из альтернативных названий берём кириллические — по ним ищут пользователи
+            russian = [name for name in alternates if _CYRILLIC.search(name)]
+            name = russian[0] if russian else fields[1]
+            city = City(name, fields[1], fields[8], float(fields[4]), float(fields[5]), int(fields[14] or 0))
+            yield city, [fields[2], *russian]
+
+
+def load_gazetteer(path: Optional[str] = None) -> Gazetteer:
+    """Загружает справочник из CSV (name,name_en,country,lat,lon,population,alt_names) или выгрузки GeoNames"""
+    path = path or os.getenv('GAZETTEER_FILE') or DEFAULT_FILE
+    reader = _read_geonames if path.endswith('.txt') else _read_csv
+    return Gazetteer(reader(path))
+
+
+_gazetteer: Optional[Gazetteer] = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer() -> Gazetteer:
+    """Общий справочник процесса (загружается при первом обращении; без файла — пустой)"""
+    global _gazetteer
+    with _gazetteer_lock:
+        if _gazetteer is None:
+            try:
+                _gazetteer = load_gazetteer()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"❌ Не удалось загрузить справочник городов: {e}")
+                _gazetteer = Gazetteer()
+        return _gazetteer
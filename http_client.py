@@ -1,28 +1,453 @@
 import requests
-from typing import Optional, Dict, Any, Union
+from requests.adapters import HTTPAdapter
+from typing import Optional, Dict, Any, Union, Tuple
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import os
+import random
+import sqlite3
+import threading
 import time
+import metrics
 
+# Настройки пула соединений. Сессия одна на процесс и переиспользует keep-alive
+# соединения; pool_maxsize ограничивает число соединений на один хост.
+POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', 4))
+POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 16))
+POOL_BLOCK = os.getenv('HTTP_POOL_BLOCK', '1') == '1'
+CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 10))
 
-def get_with_retries(url: str, params: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None, timeout: int = 10, retries: int = 3) -> Optional[requests.Response]:
-    for attempt in range(retries):
+# Повторы и автоматический выключатель (circuit breaker)
+RETRY_ATTEMPTS = int(os.getenv('HTTP_RETRY_ATTEMPTS', 3))
+RETRY_BUDGET = float(os.getenv('HTTP_RETRY_BUDGET', 5))
+BREAKER_THRESHOLD = int(os.getenv('HTTP_BREAKER_THRESHOLD', 5))
+BREAKER_RECOVERY = float(os.getenv('HTTP_BREAKER_RECOVERY', 30))
+
+# Квота API: лимиты вызовов в минуту и в сутки (0 — без ограничения), общие для
+# всех потоков и процессов на хосте через файл QUOTA_FILE
+QUOTA_PER_MINUTE = int(os.getenv('OWM_CALLS_PER_MINUTE', 60))
+QUOTA_PER_DAY = int(os.getenv('OWM_CALLS_PER_DAY', 0))
+QUOTA_FILE = os.getenv('OWM_QUOTA_FILE', os.path.join(os.getenv('CACHE_DIR', '.cache'), 'quota.db'))
+
+# Приоритеты запросов: фоновые задачи не могут выбрать квоту ниже своего резерва
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_PREFETCH = 2
+# Запросы в API не отправляются вовсе: вызывающий код отвечает из кэша (см. admission.py)
+PRIORITY_CACHE_ONLY = 3
+# Доля квоты, которую класс не может трогать (остаётся более приоритетным)
+QUOTA_RESERVE = {PRIORITY_INTERACTIVE: 0.0, PRIORITY_BACKGROUND: 0.3, PRIORITY_PREFETCH: 0.5}
+# Сколько секунд запрос может ждать свободной квоты, прежде чем сдаться
+QUOTA_MAX_WAIT = {PRIORITY_INTERACTIVE: 5.0, PRIORITY_BACKGROUND: 60.0, PRIORITY_PREFETCH: 0.0}
+
+Timeout = Union[float, Tuple[float, float], None]
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def configure(pool_connections: Optional[int] = None, pool_maxsize: Optional[int] = None,
+              pool_block: Optional[bool] = None, connect_timeout: Optional[float] = None,
+              read_timeout: Optional[float] = None):
+    """
+    Меняет настройки пула соединений и таймаутов
+    
+    Args:
+        pool_connections: Число хостов, для которых хранятся пулы
+        pool_maxsize: Максимум соединений на один хост
+        pool_block: Ждать свободное соединение вместо открытия лишнего
+        connect_timeout: Таймаут установки соединения в секундах
+        read_timeout: Таймаут чтения ответа в секундах
+    """
+    global POOL_CONNECTIONS, POOL_MAXSIZE, POOL_BLOCK, CONNECT_TIMEOUT, READ_TIMEOUT
+    if pool_connections is not None:
+        POOL_CONNECTIONS = pool_connections
+    if pool_maxsize is not None:
+        POOL_MAXSIZE = pool_maxsize
+    if pool_block is not None:
+        POOL_BLOCK = pool_block
+    if connect_timeout is not None:
+        CONNECT_TIMEOUT = connect_timeout
+    if read_timeout is not None:
+        READ_TIMEOUT = read_timeout
+    close()
+
+
+def get_session() -> requests.Session:
+    """Возвращает общую сессию с пулом keep-alive соединений (создаётся лениво)"""
+    global _session
+    session = _session
+    if session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                                      pool_block=POOL_BLOCK)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+            session = _session
+    return session
+
+
+def close():
+    """Закрывает общую сессию и все соединения пула"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def _timeout(timeout: Timeout) -> Timeout:
+    """Раскладывает таймаут на (connect, read); None — значения из настроек"""
+    if timeout is None:
+        return (CONNECT_TIMEOUT, READ_TIMEOUT)
+    return timeout
+
+
+class RetryPolicy:
+    """
+    Политика повторов: decorrelated jitter, учёт Retry-After и общий бюджет времени на запрос.
+
+    Args:
+        max_attempts: Максимум попыток (включая первую)
+        base_delay: Минимальная пауза между попытками в секундах
+        max_delay: Максимальная пауза между попытками в секундах
+        budget: Сколько секунд всего можно потратить на запрос с повторами
+        retry_statuses: HTTP статусы, после которых имеет смысл повторить запрос
+    """
+
+    def __init__(self, max_attempts: int = RETRY_ATTEMPTS, base_delay: float = 0.3, max_delay: float = 4.0,
+                 budget: float = RETRY_BUDGET, retry_statuses: Tuple[int, ...] = (429, 500, 502, 503, 504)):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.retry_statuses = retry_statuses
+
+    def next_delay(self, previous: float) -> float:
+        """Следующая пауза: случайная между base_delay и утроенной предыдущей"""
+        return min(self.max_delay, random.uniform(self.base_delay, max(self.base_delay, previous * 3)))
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель для одного endpoint'а.
+
+    После threshold неудачных запросов подряд переходит в состояние 'open' и
+    recovery_timeout секунд сразу отказывает, не нагружая упавший сервис. Затем
+    пропускает один пробный запрос ('half_open'): успех закрывает выключатель, ошибка открывает снова.
+    """
+
+    def __init__(self, threshold: Optional[int] = None, recovery_timeout: Optional[float] = None):
+        self.threshold = threshold or BREAKER_THRESHOLD
+        self.recovery_timeout = recovery_timeout if recovery_timeout is not None else BREAKER_RECOVERY
+        self._state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == 'open' and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                return 'half_open'
+            return self._state
+
+    def allow(self) -> bool:
+        """Можно ли сейчас отправить запрос"""
+        with self._lock:
+            if self._state == 'closed':
+                return True
+            if time.monotonic() - self._opened_at < self.recovery_timeout or self._trial_in_progress:
+                return False
+            self._state = 'half_open'
+            self._trial_in_progress = True
+            return True
+
+    def cancel(self):
+        """Отменяет пропущенный allow() запрос, который так и не был отправлен"""
+        with self._lock:
+            self._trial_in_progress = False
+
+    def record_success(self):
+        with self._lock:
+            self._state = 'closed'
+            self._failures = 0
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_progress = False
+            if self._state == 'half_open' or self._failures >= self.threshold:
+                self._state = 'open'
+                self._opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        state = self.state
+        with self._lock:
+            return {'state': state, 'failures': self._failures}
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(url: str) -> CircuitBreaker:
+    """Возвращает выключатель для хоста и пути URL (без параметров запроса)"""
+    parts = urlsplit(url)
+    key = f"{parts.netloc}{parts.path}"
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker()
+        return breaker
+
+
+def get_circuit_states() -> Dict[str, Dict[str, Any]]:
+    """Состояние всех выключателей: {'host/path': {'state': ..., 'failures': ...}}"""
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {key: breaker.snapshot() for key, breaker in breakers.items()}
+
+
+class QuotaManager:
+    """
+    Token bucket квоты API, общий для потоков и процессов (состояние в SQLite).
+
+    Минутный и суточный бакеты пополняются непрерывно. Запрос с приоритетом p
+    берёт токен, только если после этого в бакете останется не меньше
+    QUOTA_RESERVE[p] от ёмкости: так уведомления и предзагрузка не выедают
+    квоту интерактивных запросов.
+    """
+
+    def __init__(self, path: str = QUOTA_FILE, per_minute: int = QUOTA_PER_MINUTE, per_day: int = QUOTA_PER_DAY,
+                 reserve: Optional[Dict[int, float]] = None):
+        self.path = path
+        self.limits = {'minute': (per_minute, 60.0), 'day': (per_day, 86400.0)}
+        self.reserve = reserve or QUOTA_RESERVE
+        self.granted = 0
+        self.denied = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+
+    def try_acquire(self, priority: int = PRIORITY_INTERACTIVE) -> Tuple[bool, float]:
+        """
+        Пытается взять один токен.
+
+        Returns:
+            (успех, через сколько секунд появится нужный токен)
+        """
+        now = time.time()
+        reserve = self.reserve.get(priority, 0.0)
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                levels = {}
+                wait = 0.0
+                for name, (capacity, period) in self.limits.items():
+                    if capacity <= 0:
+                        continue
+                    row = self._conn.execute('SELECT tokens, updated FROM buckets WHERE name = ?', (name,)).fetchone()
+                    tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * capacity / period)
+                    levels[name] = tokens
+                    needed = 1 + reserve * capacity
+                    if tokens < needed:
+                        wait = max(wait, (needed - tokens) * period / capacity)
+                granted = wait == 0.0
+                for name, tokens in levels.items():
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)',
+                        (name, tokens - 1 if granted else tokens, now)
+                    )
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            if granted:
+                self.granted += 1
+            else:
+                self.denied += 1
+        return granted, wait
+
+    def acquire(self, priority: int = PRIORITY_INTERACTIVE, max_wait: Optional[float] = None) -> bool:
+        """Ждёт токен не дольше max_wait секунд (по умолчанию QUOTA_MAX_WAIT[priority])"""
+        if max_wait is None:
+            max_wait = QUOTA_MAX_WAIT.get(priority, 0.0)
+        deadline = time.monotonic() + max_wait
+        while True:
+            granted, wait = self.try_acquire(priority)
+            if granted:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(max(wait, 0.05), remaining))
+
+    def stats(self) -> Dict[str, Any]:
+        """Текущий остаток токенов и счётчики выданных/отклонённых"""
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute('SELECT name, tokens, updated FROM buckets').fetchall()
+        tokens = {}
+        for name, level, updated in rows:
+            capacity, period = self.limits.get(name, (0, 1.0))
+            if capacity > 0:
+                tokens[name] = round(min(capacity, level + (now - updated) * capacity / period), 2)
+        return {'tokens': tokens, 'granted': self.granted, 'denied': self.denied}
+
+
+_quota: Optional[QuotaManager] = None
+_quota_lock = threading.Lock()
+_context = threading.local()
+
+
+def get_quota_manager() -> Optional[QuotaManager]:
+    """Возвращает общий QuotaManager или None, если лимиты не заданы"""
+    global _quota
+    if QUOTA_PER_MINUTE <= 0 and QUOTA_PER_DAY <= 0:
+        return None
+    with _quota_lock:
+        if _quota is None:
+            _quota = QuotaManager()
+        return _quota
+
+
+def current_priority() -> int:
+    """Приоритет запросов текущего потока"""
+    return getattr(_context, 'priority', PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def request_priority(priority: int):
+    """Задаёт приоритет квоты для запросов, выполняемых в текущем потоке"""
+    previous = current_priority()
+    _context.priority = priority
+    try:
+        yield
+    finally:
+        _context.priority = previous
+
+
+def upstream_allowed() -> bool:
+    """Можно ли текущему потоку обращаться к API (False в режиме «только кэш»)"""
+    return current_priority() != PRIORITY_CACHE_ONLY
+
+
+def _acquire_quota() -> bool:
+    quota = get_quota_manager()
+    return quota is None or quota.acquire(current_priority())
+
+
+def _parse_retry_after(response: requests.Response) -> Optional[float]:
+    """Читает заголовок Retry-After (секунды или HTTP дата)"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _timed_get(endpoint: str, url: str, **kwargs) -> requests.Response:
+    """GET через общую сессию с записью длительности и статуса в метрики"""
+    kwargs['timeout'] = _timeout(kwargs.get('timeout'))
+    started = time.perf_counter()
+    try:
+        response = get_session().get(url, **kwargs)
+    except requests.exceptions.RequestException:
+        metrics.UPSTREAM_RESPONSES.inc(endpoint=endpoint, status='error')
+        raise
+    finally:
+        metrics.UPSTREAM_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+    metrics.UPSTREAM_RESPONSES.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+
+def get_with_retries(url: str, params: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None,
+                     timeout: Timeout = None, retries: Optional[int] = None,
+                     policy: Optional[RetryPolicy] = None) -> Optional[requests.Response]:
+    """
+    Выполняет GET запрос с повторами по политике policy
+    
+    Args:
+        url: URL для запроса
+        params: Параметры запроса
+        headers: Заголовки запроса
+        timeout: Таймаут в секундах или пара (connect, read); по умолчанию из настроек пула
+        retries: Число попыток (по умолчанию из политики)
+        policy: Политика повторов (по умолчанию DEFAULT_RETRY_POLICY)
+    
+    Returns:
+        Response объект или None, если запрос не удался или выключатель endpoint'а разомкнут
+    """
+    if not upstream_allowed():
+        return None
+    policy = policy or DEFAULT_RETRY_POLICY
+    attempts = retries or policy.max_attempts
+    breaker = get_circuit_breaker(url)
+    if not breaker.allow():
+        return None
+    
+    endpoint = urlsplit(url).path
+    deadline = time.monotonic() + policy.budget
+    delay = policy.base_delay
+    last_error = None
+    for attempt in range(attempts):
+        retry_after = None
+        # Нет квоты — не ждём бесконечно: вызывающий код отдаст данные из кэша
+        if not _acquire_quota():
+            print(f"⏳ Квота API исчерпана, запрос {endpoint} отклонён")
+            breaker.cancel()
+            return None
+        if attempt:
+            metrics.UPSTREAM_RETRIES.inc(endpoint=endpoint)
         try:
-            response = requests.get(url, params=params, headers=headers, timeout=timeout)
-            if response.status_code == 429 or (500 <= response.status_code < 600):
-                if attempt < retries - 1:
-                    backoff_time = 2 ** attempt
-                    time.sleep(backoff_time)
-                continue
-            response.raise_for_status()
-            return response
+            response = _timed_get(endpoint, url, params=params, headers=headers, timeout=timeout)
         except requests.exceptions.RequestException as e:
-            if attempt == retries - 1:
-                return None
-            backoff_time = 2 ** attempt
-            time.sleep(backoff_time)
+            last_error = e
+        else:
+            if response.status_code in policy.retry_statuses:
+                last_error = f"HTTP {response.status_code}"
+                retry_after = _parse_retry_after(response)
+            else:
+                # Сервис ответил: для выключателя это успех, даже если статус 4xx
+                breaker.record_success()
+                if response.status_code >= 400:
+                    return None
+                return response
+        
+        if attempt == attempts - 1:
+            break
+        delay = policy.next_delay(delay)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if time.monotonic() + delay > deadline:
+            break
+        time.sleep(delay)
+    
+    breaker.record_failure()
+    print(f"❌ Запрос {endpoint} не удался: {last_error}")
     return None
 
 
-def get(url: str, params: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None, timeout: int = 10) -> Optional[requests.Response]:
+def get(url: str, params: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None, timeout: Timeout = None) -> Optional[requests.Response]:
     """
     Выполняет GET запрос к указанному URL
     
@@ -30,7 +455,7 @@ def get(url: str, params: Optional[Dict[str, Any]] = None, headers: Optional[Dic
         url: URL для запроса
         params: Параметры запроса
         headers: Заголовки запроса
-        timeout: Таймаут в секундах
+        timeout: Таймаут в секундах или пара (connect, read); по умолчанию из настроек пула
     
     Returns:
         Response объект или None в случае ошибки
@@ -39,7 +464,7 @@ def get(url: str, params: Optional[Dict[str, Any]] = None, headers: Optional[Dic
 
 
 def post(url: str, data: Optional[Dict[str, Any]] = None, json_data: Optional[Dict[str, Any]] = None, 
-         headers: Optional[Dict[str, str]] = None, timeout: int = 10) -> Optional[requests.Response]:
+         headers: Optional[Dict[str, str]] = None, timeout: Timeout = None) -> Optional[requests.Response]:
     """
     Выполняет POST запрос к указанному URL
     
@@ -48,13 +473,13 @@ def post(url: str, data: Optional[Dict[str, Any]] = None, json_data: Optional[Di
         data: Данные формы
         json_data: JSON данные
         headers: Заголовки запроса
-        timeout: Таймаут в секундах
+        timeout: Таймаут в секундах или пара (connect, read); по умолчанию из настроек пула
     
     Returns:
         Response объект или None в случае ошибки
     """
     try:
-        response = requests.post(url, data=data, json=json_data, headers=headers, timeout=timeout)
+        response = get_session().post(url, data=data, json=json_data, headers=headers, timeout=_timeout(timeout))
         response.raise_for_status()  # Базовая проверка статуса
         return response
     except requests.exceptions.RequestException:
@@ -62,7 +487,7 @@ def post(url: str, data: Optional[Dict[str, Any]] = None, json_data: Optional[Di
 
 
 def get_simple(url: str, params: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None, 
-               timeout: int = 10) -> Optional[requests.Response]:
+               timeout: Timeout = None) -> Optional[requests.Response]:
     """
     Простой GET запрос без автоматической проверки статуса (для совместимости)
     
@@ -70,13 +495,26 @@ def get_simple(url: str, params: Optional[Dict[str, Any]] = None, headers: Optio
         url: URL для запроса
         params: Параметры запроса
         headers: Заголовки запроса
-        timeout: Таймаут в секундах
+        timeout: Таймаут в секундах или пара (connect, read); по умолчанию из настроек пула
     
     Returns:
         Response объект или None в случае ошибки
     """
+    if not upstream_allowed():
+        return None
+    breaker = get_circuit_breaker(url)
+    if not breaker.allow():
+        return None
+    if not _acquire_quota():
+        breaker.cancel()
+        return None
     try:
-        response = requests.get(url, params=params, headers=headers, timeout=timeout)
-        return response
+        response = _timed_get(urlsplit(url).path, url, params=params, headers=headers, timeout=timeout)
     except requests.exceptions.RequestException:
+        breaker.record_failure()
         return None
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
@@ -0,0 +1,140 @@
+import heapq
+import random
+import threading
+import time
+import zlib
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+DAY = 86400
+
+
+def _seconds_of_day(ts: float, tz_offset: int) -> float:
+    return (ts + tz_offset) % DAY
+
+
+def in_quiet_hours(ts: float, quiet_hours: Optional[Sequence[int]], tz_offset: int = 0) -> bool:
+    """
+    Попадает ли момент ts в тихие часы [начало, конец) по местному времени.
+
+    quiet_hours — (час начала, час конца); окно может переходить через полночь: (23, 7).
+    """
+    if not quiet_hours:
+        return False
+    start, end = quiet_hours[0] * 3600, quiet_hours[1] * 3600
+    moment = _seconds_of_day(ts, tz_offset)
+    if start <= end:
+        return start <= moment < end
+    return moment >= start or moment < end
+
+
+def quiet_hours_end(ts: float, quiet_hours: Sequence[int], tz_offset: int = 0) -> float:
+    """Ближайший после ts конец тихих часов (unix time)"""
+    end = quiet_hours[1] * 3600
+    moment = _seconds_of_day(ts, tz_offset)
+    return ts + (end - moment) % DAY
+
+
+def defer_quiet_hours(due: float, quiet_hours: Optional[Sequence[int]], tz_offset: int = 0,
+                      spread: float = 0.0) -> float:
+    """Переносит момент из тихих часов на их конец плюс spread секунд"""
+    if in_quiet_hours(due, quiet_hours, tz_offset):
+        return quiet_hours_end(due, quiet_hours, tz_offset) + spread
+    return due
+
+
+def next_due_time(now: float, interval: float, jitter: float = 0.1,
+                  quiet_hours: Optional[Sequence[int]] = None, tz_offset: int = 0,
+                  quiet_spread: float = 900, rng=random) -> float:
+    """
+    Время следующего уведомления.
+
+    Интервал случайно сдвигается на ±jitter от своей длины, чтобы подписчики,
+    включившие уведомления одновременно, со временем разошлись. Момент в тихих
+    часах переносится на их конец плюс случайные 0..quiet_spread секунд — иначе
+    все утренние уведомления ушли бы в одну секунду.
+    """
+    due = now + interval * (1 + rng.uniform(-jitter, jitter))
+    return defer_quiet_hours(due, quiet_hours, tz_offset, rng.uniform(0, quiet_spread))
+
+
+def spread_offset(key: Hashable, window: float) -> float:
+    """Детерминированное смещение 0..window для ключа (одинаковое в любом процессе)"""
+    return zlib.crc32(str(key).encode('utf-8')) / 2 ** 32 * window
+
+
+class NotificationScheduler:
+    """
+    Очередь уведомлений по времени: двоичная куча (heapq) из (время, ключ).
+
+    Перенос и отмена не ищут запись в куче: актуальное время ключа хранится в словаре,
+    а устаревшие записи пропускаются при извлечении (и вычищаются, когда их
+    становится больше, чем актуальных). Поэтому pop_due() стоит O(k log n)
+    для k наступивших уведомлений и не зависит от числа подписчиков.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, str, Hashable]] = []
+        self._due: Dict[Hashable, float] = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._due) + 64:
+            self._heap = [(due, str(key), key) for key, due in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def schedule(self, key: Hashable, due: float):
+        """Назначает (или переносит) уведомление ключа на время due"""
+        with self._lock:
+            self._due[key] = due
+            heapq.heappush(self._heap, (due, str(key), key))
+            self._compact()
+        self._changed.set()
+
+    def schedule_many(self, items: Iterable[Tuple[Hashable, float]]):
+        """Назначает много уведомлений сразу (куча перестраивается за O(n))"""
+        with self._lock:
+            self._due.update(items)
+            self._heap = [(due, str(key), key) for key, due in self._due.items()]
+            heapq.heapify(self._heap)
+        self._changed.set()
+
+    def cancel(self, key: Hashable):
+        with self._lock:
+            self._due.pop(key, None)
+            self._compact()
+
+    def due_at(self, key: Hashable) -> Optional[float]:
+        with self._lock:
+            return self._due.get(key)
+
+    def next_due(self) -> Optional[float]:
+        """Время ближайшего уведомления или None, если очередь пуста"""
+        with self._lock:
+            while self._heap:
+                due, _, key = self._heap[0]
+                if self._due.get(key) == due:
+                    return due
+                heapq.heappop(self._heap)
+            return None
+
+    def pop_due(self, now: Optional[float] = None, limit: Optional[int] = None) -> List[Tuple[Hashable, float]]:
+        """Извлекает наступившие уведомления (не больше limit): [(ключ, время)] по времени"""
+        now = time.time() if now is None else now
+        result = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and (limit is None or len(result) < limit):
+                due, _, key = heapq.heappop(self._heap)
+                if self._due.get(key) == due:
+                    del self._due[key]
+                    result.append((key, due))
+        return result
+
+    def wait(self, timeout: float) -> bool:
+        """Ждёт до timeout секунд или до изменения расписания (True — расписание изменилось)"""
+        changed = self._changed.wait(timeout)
+        self._changed.clear()
+        return changed
+
+    def __len__(self) -> int:
+        return len(self._due)
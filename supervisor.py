@@ -0,0 +1,230 @@
+"""
+Супервизор: запускает бота в нескольких рабочих процессах.
+
+Супервизор получает обновления Telegram (long polling или webhook) и раскладывает их
+по процессам через очереди multiprocessing по номеру шарда пользователя, поэтому
+все обновления пользователя (и его next-step обработчики) попадают в один процесс.
+Каждый процесс загружает только своих пользователей и рассылает уведомления только им.
+Кэш погоды, геокэш, квота и хранилище пользователей — общие файлы (SQLite WAL / атомарная запись).
+
+Запуск:
+    BOT_WORKERS=4 python bot.py
+    python supervisor.py --workers 4
+"""
+if __name__ == '__main__':
+    # .env читается только при запуске из командной строки и до импорта модулей с настройками;
+    # импорт из тестов и инструментов окружение процесса не меняет
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import argparse
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from telebot import apihelper
+
+import bot
+import weather_app
+from user_store import shard_of
+from webhook import UpdateDispatcher, WebhookServer, update_user_id
+
+# Размер очереди обновлений каждого процесса и потоков-обработчиков в нём
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", 1000))
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", 8))
+# Сколько супервизор ждёт места в очереди процесса, прежде чем отказать webhook'у (503)
+ROUTE_TIMEOUT = 1.0
+POLLING_TIMEOUT = 20
+RESTART_DELAY = 1.0
+
+
+class ShardRouter:
+    """
+    Раскладывает сырые обновления по очередям рабочих процессов.
+
+    Совместим с WebhookServer (метод submit), поэтому тот же сервер принимает
+    обновления и в однопроцессном режиме, и под супервизором.
+    """
+
+    def __init__(self, queues: List[Any], put_timeout: Optional[float] = ROUTE_TIMEOUT):
+        self.queues = queues
+        self.put_timeout = put_timeout
+        self._stats_lock = threading.Lock()
+        self.stats = {'routed': 0, 'rejected': 0}
+
+    def shard(self, update: Dict[str, Any]) -> int:
+        """Номер процесса для обновления"""
+        user_id = update_user_id(update)
+        key = user_id if user_id is not None else update.get('update_id', 0)
+        return shard_of(key, len(self.queues))
+
+    def submit(self, update: Dict[str, Any]) -> bool:
+        """Ставит обновление в очередь процесса; False — очередь переполнена"""
+        try:
+            self.queues[self.shard(update)].put(update, timeout=self.put_timeout)
+        except queue.Full:
+            with self._stats_lock:
+                self.stats['rejected'] += 1
+            return False
+        with self._stats_lock:
+            self.stats['routed'] += 1
+        return True
+
+
+def worker_main(index: int, count: int, updates, metrics_port: Optional[int] = None):
+    """Рабочий процесс: свой шард пользователей, рассылка по нему и обработка своих обновлений"""
+    # Остановкой управляет супервизор (через очередь), Ctrl+C в терминале процесс не прерывает
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    weather_app.check_config()
+    instance = bot.create_bot()
+    # Обработчики вызываются в потоках диспетчера, собственный пул telebot не нужен
+    instance.threaded = False
+    bot.load_user_data(shard=(index, count))
+    bot.start_services(metrics_port)
+
+    dispatcher = UpdateDispatcher(bot.process_raw_update, workers=WORKER_THREADS,
+                                  queue_size=WORKER_QUEUE_SIZE, overflow='block', put_timeout=None)
+    dispatcher.start()
+    print(f"🤖 Процесс {index + 1}/{count} запущен: пользователей {len(bot.user_data)}")
+    while True:
+        update = updates.get()
+        if update is None:
+            break
+        dispatcher.submit(update)
+    dispatcher.stop()
+
+
+class Supervisor:
+    """Запускает и перезапускает рабочие процессы, принимает обновления и раздаёт их"""
+
+    def __init__(self, workers: int, mode: str = bot.BOT_MODE, queue_size: int = WORKER_QUEUE_SIZE):
+        if workers < 1:
+            raise ValueError("Нужен хотя бы один рабочий процесс")
+        user_store = os.getenv('USER_STORE', 'sqlite')
+        if user_store != 'sqlite':
+            raise ValueError(f"Несколько процессов поддерживаются только с USER_STORE=sqlite, а не {user_store}")
+        self.workers = workers
+        self.mode = mode
+        self.queue_size = queue_size
+        # spawn: рабочий процесс начинает с чистого интерпретатора, без потоков и соединений родителя
+        self._context = multiprocessing.get_context('spawn')
+        self.queues = [self._context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.router = ShardRouter(self.queues)
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self._stop = threading.Event()
+        self._metrics_port = int(bot.METRICS_PORT) if bot.METRICS_PORT else None
+
+    def _spawn(self, index: int):
+        # Каждый процесс отдаёт свои метрики на своём порту: METRICS_PORT, METRICS_PORT + 1, ...
+        port = self._metrics_port + index if self._metrics_port else None
+        process = self._context.Process(target=worker_main, name=f'bot-worker-{index}',
+                                        args=(index, self.workers, self.queues[index], port))
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def check_workers(self):
+        """Перезапускает упавшие процессы"""
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive() and not self._stop.is_set():
+                print(f"⚠️ Процесс {index + 1} завершился с кодом {process.exitcode}, перезапуск")
+                # Упавший процесс мог остаться владельцем блокировки чтения очереди, поэтому новому
+                # процессу — новая очередь; необработанные обновления старой очереди теряются
+                self.queues[index] = self._context.Queue(maxsize=self.queue_size)
+                time.sleep(RESTART_DELAY)
+                self._spawn(index)
+
+    def stop(self, timeout: float = 10):
+        """Просит процессы разобрать свои очереди и завершиться"""
+        self._stop.set()
+        for updates in self.queues:
+            try:
+                updates.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+    def poll(self, token: str):
+        """Получает обновления long polling'ом и раздаёт их процессам"""
+        apihelper.delete_webhook(token)
+        offset = None
+        while not self._stop.is_set():
+            try:
+                updates = apihelper.get_updates(token, offset=offset, timeout=POLLING_TIMEOUT,
+                                                long_polling_timeout=POLLING_TIMEOUT)
+            except Exception as e:
+                print(f"❌ Ошибка получения обновлений: {e}")
+                time.sleep(3)
+                continue
+            for update in updates:
+                # Очереди ограничены: если процессы не успевают, ждём, а не теряем обновления
+                while not self.router.submit(update) and not self._stop.is_set():
+                    pass
+                offset = update['update_id'] + 1
+
+    def serve_webhook(self, token: str):
+        """Принимает обновления через webhook и раздаёт их процессам"""
+        if not bot.WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL не установлен")
+        server = WebhookServer(self.router, host=bot.WEBHOOK_HOST, port=bot.WEBHOOK_PORT,
+                               path=bot.WEBHOOK_PATH, secret_token=bot.WEBHOOK_SECRET)
+        apihelper.delete_webhook(token)
+        apihelper.set_webhook(token, url=bot.WEBHOOK_URL, secret_token=bot.WEBHOOK_SECRET)
+        print(f"🌐 Webhook слушает {bot.WEBHOOK_HOST}:{server.port}{bot.WEBHOOK_PATH}")
+        server.start()
+        return server
+
+    def run(self, token: Optional[str] = None):
+        """Запускает процессы и приём обновлений; работает до Ctrl+C"""
+        token = token or bot.BOT_TOKEN
+        if not token:
+            raise ValueError("BOT_TOKEN не установлен")
+        weather_app.check_config()
+        if bot.TELEGRAM_API_URL:
+            apihelper.API_URL = bot.TELEGRAM_API_URL
+
+        signal.signal(signal.SIGTERM, lambda *_: self._stop.set())
+        # Миграция пользователей — до запуска процессов, иначе все они переносили бы файл одновременно
+        bot.migrate_user_data()
+        self.start()
+        server = None
+        if self.mode == 'webhook':
+            server = self.serve_webhook(token)
+        else:
+            threading.Thread(target=self.poll, args=(token,), name='supervisor-polling', daemon=True).start()
+        print(f"🤖 Супервизор запущен: {self.workers} процессов, режим {self.mode}")
+
+        try:
+            while not self._stop.wait(1):
+                self.check_workers()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if server is not None:
+                server.shutdown()
+            self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Запуск бота в нескольких процессах')
+    parser.add_argument('--workers', type=int, default=max(bot.BOT_WORKERS, 1),
+                        help='число рабочих процессов (по умолчанию BOT_WORKERS)')
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default=bot.BOT_MODE)
+    args = parser.parse_args(argv)
+    Supervisor(args.workers, mode=args.mode).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import pytest
+from telebot import types
+
+import bot
+from admission import ADMITTED, BUSY, DUPLICATE, THROTTLED, AdmissionController, RecentKeys, UserBuckets
+
+
+def test_bucket_refills_over_time():
+    buckets = UserBuckets(rate=60, burst=2)
+    assert buckets.take('u', now=0)[0]
+    assert buckets.take('u', now=0)[0]
+    granted, wait = buckets.take('u', now=0)
+    assert not granted and wait == pytest.approx(1.0)
+    assert buckets.take('u', now=1.0)[0]
+
+
+def test_bucket_refund_is_capped():
+    buckets = UserBuckets(rate=60, burst=2)
+    buckets.take('u', cost=2, now=0)
+    buckets.refund('u', 5)
+    assert buckets.take('u', cost=2, now=0)[0]
+    assert not buckets.take('u', now=0)[0]
+
+
+def test_recent_keys_window():
+    recent = RecentKeys(window=5)
+    assert not recent.contains('k', now=0)
+    assert not recent.seen('k', now=0)
+    assert recent.seen('k', now=4)
+    assert not recent.contains('k', now=5)
+
+
+def _decision(controller, *args, **kwargs):
+    with controller.admit(*args, **kwargs) as decision:
+        return decision
+
+
+def test_duplicate_only_after_admitted():
+    controller = AdmissionController(rate=0, burst=1, concurrency=0, dedup_window=60)
+    assert _decision(controller, 1, 'k') == ADMITTED
+    assert _decision(controller, 1, 'k') == DUPLICATE
+    # Другой ключ не повтор, но бакет пуст
+    assert _decision(controller, 1, 'other') == THROTTLED
+    # Ответ из кэша не запоминается: повтор того же запроса снова THROTTLED, а не DUPLICATE
+    assert _decision(controller, 1, 'other') == THROTTLED
+
+
+def test_busy_refunds_tokens_and_does_not_mark_key():
+    controller = AdmissionController(rate=0, burst=1, concurrency=1, wait=0, dedup_window=60)
+    with controller.admit(1, 'a') as first:
+        assert first == ADMITTED
+        assert _decision(controller, 2, 'b') == BUSY
+    assert _decision(controller, 2, 'b') == ADMITTED
+
+
+def test_concurrency_slot_released():
+    controller = AdmissionController(rate=600, burst=10, concurrency=1, wait=0)
+    for _ in range(3):
+        assert _decision(controller, 1) == ADMITTED
+    assert controller.get_stats()[ADMITTED] == 3
+
+
+class StubBot:
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+
+    def answer_callback_query(self, *args, **kwargs):
+        pass
+
+
+def _message(user_id, text):
+    return types.Message.de_json({
+        'message_id': 1, 'date': 0, 'text': text,
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'u'},
+        'chat': {'id': user_id, 'type': 'private'},
+    })
+
+
+@pytest.fixture
+def stub_bot(monkeypatch):
+    stub = StubBot()
+    monkeypatch.setattr(bot, 'bot', stub)
+    monkeypatch.setattr(bot, 'admission', AdmissionController(rate=600, burst=100, concurrency=4, dedup_window=60))
+    return stub
+
+
+def test_same_text_in_different_handlers_is_not_duplicate(stub_bot, monkeypatch):
+    calls = []
+    monkeypatch.setattr(bot.weather_app, 'get_current_weather', lambda city: calls.append('now') or {'error': 'x'})
+    monkeypatch.setattr(bot.weather_app, 'geocode',
+                        lambda city: calls.append('coords') or {'lat': 55.75, 'lon': 37.62, 'name': city})
+    monkeypatch.setattr(bot, 'show_extended_data', lambda chat_id, **kwargs: calls.append('extended'))
+
+    bot.get_weather_now(_message(1, 'Москва'))
+    bot.extended_by_city(_message(1, 'Москва'))
+    assert calls == ['now', 'coords', 'extended']
+
+    # А настоящий повтор в том же обработчике пропускается
+    bot.get_weather_now(_message(1, 'Москва'))
+    assert calls == ['now', 'coords', 'extended']
+
+
+def test_retry_after_cache_only_answer_is_not_dropped(stub_bot, monkeypatch):
+    monkeypatch.setattr(bot, 'admission', AdmissionController(rate=0, burst=0, concurrency=4, dedup_window=60))
+    priorities = []
+
+    def current_weather(city):
+        priorities.append(bot.weather_app.http_client.current_priority())
+        return {'error': 'x'}
+
+    monkeypatch.setattr(bot.weather_app, 'get_current_weather', current_weather)
+    bot.get_weather_now(_message(2, 'Казань'))
+    bot.get_weather_now(_message(2, 'Казань'))
+    assert priorities == [bot.weather_app.http_client.PRIORITY_CACHE_ONLY] * 2
+    # Предупреждение о лимите — один раз
+    assert stub_bot.sent.count(bot.THROTTLE_NOTICE) == 1
+
+
+def test_ordinary_session_is_not_throttled(stub_bot, monkeypatch):
+    # Лимиты по умолчанию; все запросы подряд, без пополнения бакета
+    monkeypatch.setattr(bot, 'admission', AdmissionController())
+    http_client = bot.weather_app.http_client
+    priorities = []
+
+    def record(result):
+        def func(*args, **kwargs):
+            priorities.append(http_client.current_priority())
+            return result(*args) if callable(result) else result
+        return func
+
+    monkeypatch.setattr(bot.weather_app, 'get_current_weather', record({'error': 'x'}))
+    monkeypatch.setattr(bot.weather_app, 'get_batch',
+                        record(lambda endpoint, cities: {city: {'error': 'x'} for city in cities}))
+    monkeypatch.setattr(bot.weather_app, 'geocode', record({'lat': 55.75, 'lon': 37.62, 'name': 'Казань'}))
+    monkeypatch.setattr(bot, 'show_extended_data', lambda chat_id, **kwargs: None)
+
+    session = [
+        (bot.get_weather_now, 'Москва'), (bot.compare_cities, 'Москва, Париж'),
+        (bot.extended_by_city, 'Казань'), (bot.get_weather_now, 'Париж'),
+        (bot.get_weather_now, 'Казань'), (bot.compare_cities, 'Казань, Сочи'),
+        (bot.extended_by_city, 'Москва'), (bot.get_weather_now, 'Сочи'),
+        (bot.compare_cities, 'Сочи, Тверь'), (bot.extended_by_city, 'Тверь'),
+    ]
+    for handler, text in session:
+        handler(_message(3, text))
+    assert priorities == [http_client.PRIORITY_INTERACTIVE] * len(session)
+    assert bot.THROTTLE_NOTICE not in stub_bot.sent
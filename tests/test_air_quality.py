@@ -0,0 +1,26 @@
+from air_quality import CLASSIFIER, AirQualityClassifier
+
+
+def test_edge_belongs_to_next_level():
+    assert CLASSIFIER.level('so2', 19.9) == 1
+    assert CLASSIFIER.level('so2', 20) == 2
+    assert CLASSIFIER.level('co', 20000) == 5
+
+
+def test_classify_many_matches_classify():
+    readings = [
+        {'so2': 10, 'no2': 75, 'pm10': 10, 'pm2_5': 5, 'o3': 30, 'co': 300},
+        {'pm2_5': 80, 'co': 100},
+        {},
+        {'so2': 300, 'no2': 10, 'pm10': 10, 'pm2_5': 5, 'o3': 30, 'co': 300, 'nh3': 4},
+    ]
+    assert CLASSIFIER.classify_many(readings) == [CLASSIFIER.classify(reading) for reading in readings]
+    assert CLASSIFIER.classify_many(readings)[2] == {'levels': {}, 'max_level': 1}
+
+
+def test_classify_columns():
+    classifier = AirQualityClassifier({'a': (1, 2), 'b': (10,)})
+    levels, max_levels = classifier.classify_columns({'a': [0, 1, 5], 'b': [20, 0, 0]})
+    assert list(levels['a']) == [1, 2, 3]
+    assert list(levels['b']) == [2, 1, 1]
+    assert list(max_levels) == [2, 2, 3]
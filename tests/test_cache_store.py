@@ -0,0 +1,37 @@
+import os
+import sqlite3
+import time
+
+from cache_store import SQLiteCacheStore
+
+
+def _file_size(path):
+    return sum(os.path.getsize(name) for name in (path, f'{path}-wal') if os.path.exists(name))
+
+
+def test_set_get_and_expiry(tmp_path):
+    store = SQLiteCacheStore(str(tmp_path / 'cache.db'))
+    now = time.time()
+    store.set('fresh', 'weather', {'temp': 1}, now, 60)
+    store.set('old', 'weather', {'temp': 2}, now - 120, 60)
+    assert store.get('fresh') == ({'temp': 1}, now)
+    assert store.get('old') is None
+    assert store.collect_garbage() == 1
+    assert store.stats()['weather']['entries'] == 1
+
+
+def test_eviction_shrinks_file(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    # База старого формата (без auto_vacuum) переводится при открытии
+    sqlite3.connect(path).close()
+    store = SQLiteCacheStore(path, max_bytes=100_000)
+    now = time.time()
+    for index in range(2000):
+        store.set(f'k{index}', 'weather', {'payload': os.urandom(300).hex()}, now + index / 1000, 3600)
+    store._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+    before = _file_size(path)
+    assert store.collect_garbage() > 0
+    assert store.stats()['weather']['bytes'] <= 100_000
+    assert _file_size(path) < before / 2
+    # Вытесняются самые старые
+    assert store.get('k1999') is not None and store.get('k0') is None
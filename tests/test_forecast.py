@@ -0,0 +1,76 @@
+import json
+
+from forecast import CompactForecast
+
+# 2023-11-14 22:00 UTC = 2023-11-15 01:00 по Москве
+START = 1700000000 - 1700000000 % 3600
+
+
+def owm_forecast(slots=16, timezone_offset=10800):
+    return {
+        'city': {'name': 'Москва', 'timezone': timezone_offset},
+        'list': [{
+            'dt': START + index * 3 * 3600,
+            'main': {'temp': index - 2.5, 'feels_like': index - 4, 'humidity': 70},
+            'wind': {'speed': 3.2},
+            'weather': [{'id': 800 if index % 2 else 500, 'description': 'ясно' if index % 2 else 'дождь',
+                         'icon': '01d' if index % 2 else '10d'}],
+        } for index in range(slots)],
+    }
+
+
+def test_from_owm_columns():
+    forecast = CompactForecast.from_owm(owm_forecast())
+    assert len(forecast) == 16
+    assert forecast.row(0)['temp'] == -2.5
+    assert forecast.row(1)['description'] == 'ясно'
+    assert len(forecast.conditions) == 2
+
+
+def test_day_index_uses_city_timezone():
+    forecast = CompactForecast.from_owm(owm_forecast())
+    summaries = forecast.day_summaries()
+    assert forecast.dates() == list(summaries)
+    first = summaries[forecast.dates()[0]]
+    assert first['title'] == forecast.local_time(0).strftime('%d.%m.%Y')
+    assert first['times'][0] == forecast.local_time(0).strftime('%H:%M')
+    assert sum(day['stop'] - day['start'] for day in summaries.values()) == len(forecast)
+    temps = [row[1] for row in forecast.day_rows(forecast.dates()[1])]
+    day = summaries[forecast.dates()[1]]
+    assert (day['min_temp'], day['max_temp']) == (min(temps), max(temps))
+    assert day['avg_temp'] == sum(temps) / len(temps)
+
+
+def test_round_trip_keeps_columns_and_day_index():
+    forecast = CompactForecast.from_owm(owm_forecast())
+    restored = CompactForecast.from_dict(json.loads(json.dumps(forecast.to_dict(), ensure_ascii=False)))
+    assert restored.to_dict() == forecast.to_dict()
+    assert restored.day_summaries() == forecast.day_summaries()
+    date = forecast.dates()[-1]
+    assert restored.day_rows(date) == forecast.day_rows(date)
+
+
+def test_from_dict_reads_format_1_and_raw_owm():
+    forecast = CompactForecast.from_owm(owm_forecast())
+    old = forecast.to_dict()
+    old['format'] = 1
+    del old['days']
+    assert CompactForecast.from_dict(old).day_summaries() == forecast.day_summaries()
+    assert CompactForecast.from_dict(owm_forecast()).to_dict() == forecast.to_dict()
+
+
+def test_copy_keeps_day_index():
+    forecast = CompactForecast.from_owm(owm_forecast())
+    copy = forecast.copy()
+    copy.stale_age = 60
+    assert copy._days is forecast._days
+    assert forecast.stale_age is None
+
+
+def test_slices():
+    forecast = CompactForecast.from_owm(owm_forecast())
+    date = forecast.dates()[1]
+    day = forecast.day(date)
+    assert len(day) == len(forecast.day_summaries()[date]['times'])
+    assert len(forecast.between(START, START + 6 * 3600)) == 2
+    assert forecast.day('1999-01-01') is None and forecast.day_rows('1999-01-01') == []
@@ -0,0 +1,57 @@
+from gazetteer import City, Gazetteer, load_gazetteer, search_key
+
+
+def _gazetteer():
+    return Gazetteer([
+        (City('Москва', 'Moscow', 'RU', 55.75, 37.62, 13000000), ['Мск']),
+        (City('Санкт-Петербург', 'Saint Petersburg', 'RU', 59.94, 30.31, 5600000), ['Питер', 'СПб']),
+        (City('Тула', 'Tula', 'RU', 54.19, 37.62, 470000), []),
+        (City('Тура', 'Tura', 'RU', 64.27, 100.22, 5000), []),
+        (City('Новосибирск', 'Novosibirsk', 'RU', 55.03, 82.92, 1600000), []),
+        (City('Новосибирск', 'Novosibirsk', 'XX', 0.0, 0.0, 10), []),
+    ])
+
+
+def test_search_key_transliterates():
+    assert search_key('Санкт-Петербург') == search_key('Sankt  Peterburg') == 'sankt peterburg'
+    assert search_key('Ёлки') == search_key('елки')
+
+
+def test_lookup_prefers_most_populous():
+    gazetteer = _gazetteer()
+    assert gazetteer.lookup('спб').name == 'Санкт-Петербург'
+    assert gazetteer.lookup('novosibirsk').country == 'RU'
+    assert gazetteer.lookup('Тверь') is None
+
+
+def test_prefix():
+    names = [city.name for city in _gazetteer().prefix('ту')]
+    assert names == ['Тула', 'Тура']
+    assert _gazetteer().prefix('xyz') == []
+
+
+def test_fuzzy_ranks_by_distance_then_population():
+    gazetteer = _gazetteer()
+    assert [(city.name, distance) for city, distance in gazetteer.fuzzy('Тула')] == [('Тула', 0), ('Тура', 1)]
+    assert gazetteer.fuzzy('Моска', max_distance=1)[0][0].name == 'Москва'
+    assert gazetteer.fuzzy('Мсквааа', max_distance=1) == []
+
+
+def test_closest_fixes_only_unambiguous_long_typos():
+    gazetteer = _gazetteer()
+    assert gazetteer.closest('Новосибирк').country == 'RU'
+    # Короткие названия не исправляются: «Тула» и «Тура» отличаются одной буквой
+    assert gazetteer.closest('Тулв') is None
+    assert gazetteer.closest('Санкт-Петербур').name == 'Санкт-Петербург'
+    assert gazetteer.closest('Новосибрк') is None
+
+
+def test_suggest_adds_prefix_matches():
+    names = [city.name for city in _gazetteer().suggest('Санкт')]
+    assert names == ['Санкт-Петербург']
+
+
+def test_bundled_file_loads():
+    gazetteer = load_gazetteer()
+    assert len(gazetteer) > 100
+    assert gazetteer.lookup('Moskva').name == 'Москва'
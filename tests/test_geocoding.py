@@ -0,0 +1,99 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import weather_app
+from cache_store import SQLiteCacheStore
+from gazetteer import City, Gazetteer
+
+
+class Response:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+@pytest.fixture
+def geocoder(tmp_path, monkeypatch):
+    """Пустой справочник, свой файловый кэш и подменённый ответ API геокодирования"""
+    monkeypatch.setattr(weather_app, 'GEO_CACHE_FILE', str(tmp_path / 'geocoding.json'))
+    monkeypatch.setattr(weather_app, '_disk_cache', SQLiteCacheStore(str(tmp_path / 'cache.db')))
+    monkeypatch.setattr(weather_app, 'get_gazetteer', lambda: Gazetteer())
+    monkeypatch.setenv('API_KEY', 'test')
+    responses = []
+    monkeypatch.setattr(weather_app.http_client, 'get_simple', lambda url, params=None: responses.pop(0))
+    return responses
+
+
+@pytest.mark.parametrize('response', [None, Response(429), Response(503)])
+def test_busy_geocoder_is_not_city_not_found(geocoder, response):
+    geocoder.extend([response, Response(200, [{'name': 'Tver', 'lat': 56.86, 'lon': 35.9}])])
+    assert weather_app.geocode('Тверь') == {'error': weather_app.GEOCODING_BUSY_ERROR}
+    # Отказ не кэшируется: следующий запрос снова идёт в API и находит город
+    assert weather_app.geocode('Тверь') == {'lat': 56.86, 'lon': 35.9, 'name': 'Tver'}
+
+
+def test_not_found_is_cached(geocoder):
+    geocoder.append(Response(200, []))
+    assert weather_app.geocode('Нетакогограда')['error'] == 'Город не найден'
+    assert weather_app.geocode('Нетакогограда')['error'] == 'Город не найден'
+    assert geocoder == []
+
+
+def test_geocache_entries_expire(geocoder, monkeypatch):
+    geocoder.extend([Response(200, []), Response(200, [{'name': 'Tver', 'lat': 56.86, 'lon': 35.9}])])
+    weather_app.geocode('Тверь')
+    # Отрицательный ответ хранится GEO_NEGATIVE_CACHE_DURATION, затем город запрашивается заново
+    later = time.time() + weather_app.GEO_NEGATIVE_CACHE_DURATION.total_seconds() + 1
+    monkeypatch.setattr(weather_app.time, 'time', lambda: later)
+    assert weather_app.geocode('Тверь')['name'] == 'Tver'
+
+
+def test_legacy_geocache_is_imported(tmp_path, monkeypatch):
+    now = datetime.now()
+    legacy = {
+        'тверь': {'lat': 56.86, 'lon': 35.9, 'name': 'Тверь', 'fetched_at': now.isoformat()},
+        'старый': {'lat': 1.0, 'lon': 2.0, 'name': 'Старый', 'fetched_at': (now - timedelta(days=60)).isoformat()},
+    }
+    (tmp_path / 'geocoding.json').write_text(json.dumps(legacy), encoding='utf-8')
+    monkeypatch.setattr(weather_app, 'GEO_CACHE_FILE', str(tmp_path / 'geocoding.json'))
+    monkeypatch.setattr(weather_app, '_disk_cache', SQLiteCacheStore(str(tmp_path / 'cache.db')))
+    weather_app._import_legacy_geo_cache()
+    assert weather_app._geo_cache_lookup('тверь') == {'lat': 56.86, 'lon': 35.9, 'name': 'Тверь'}
+    assert weather_app._geo_cache_lookup('старый') is None
+    assert not (tmp_path / 'geocoding.json').exists()
+
+
+def test_weather_by_city_shows_resolved_name(geocoder, monkeypatch):
+    station = {'name': 'Tverskaya Zastava', 'main': {'temp': 3}}
+    monkeypatch.setattr(weather_app, 'get_weather_by_coordinates', lambda lat, lon: station)
+    geocoder.append(Response(200, [{'name': 'Moscow', 'local_names': {'ru': 'Москва'}, 'lat': 55.75, 'lon': 37.62}]))
+    assert weather_app.get_weather_by_city('moscow')['name'] == 'Москва'
+    # Запись кэша, общая для всех пользователей ячейки, не меняется
+    assert station['name'] == 'Tverskaya Zastava'
+
+
+def test_typo_is_fixed_by_gazetteer_without_api(geocoder, monkeypatch):
+    gazetteer = Gazetteer([(City('Новосибирск', 'Novosibirsk', 'RU', 55.03, 82.92, 1600000), [])])
+    monkeypatch.setattr(weather_app, 'get_gazetteer', lambda: gazetteer)
+    assert weather_app.geocode('Новосибирк') == {'lat': 55.03, 'lon': 82.92, 'name': 'Новосибирск'}
+    assert geocoder == []
+
+
+def test_batch_shows_resolved_names(geocoder, monkeypatch):
+    gazetteer = Gazetteer([(City('Москва', 'Moscow', 'RU', 55.7558, 37.6173, 13000000), [])])
+    monkeypatch.setattr(weather_app, 'get_gazetteer', lambda: gazetteer)
+    cell = {'name': 'Place 55.76,37.62', 'main': {'temp': 3}}
+    monkeypatch.setattr(weather_app, 'load_from_cache_by_key', lambda lat, lon, endpoint: None)
+    monkeypatch.setitem(weather_app.BATCH_FUNCTIONS, 'weather', lambda lat, lon: cell)
+    result = weather_app.get_batch('weather', ['Москва', (55.7558, 37.6173)])
+    assert result['Москва']['name'] == 'Москва'
+    # По координатам — название из ответа; общий объект не меняется
+    assert result[(55.7558, 37.6173)] is cell
+    assert cell['name'] == 'Place 55.76,37.62'
+    assert geocoder == []
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+from http_client import (PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, PRIORITY_PREFETCH, CircuitBreaker,
+                         QuotaManager)
+
+RESERVE = {PRIORITY_INTERACTIVE: 0.0, PRIORITY_BACKGROUND: 0.3, PRIORITY_PREFETCH: 0.5}
+
+
+@pytest.fixture
+def quota(tmp_path):
+    # Суточный лимит: за время теста бакет практически не пополняется
+    return QuotaManager(str(tmp_path / 'quota.db'), per_minute=0, per_day=10, reserve=RESERVE)
+
+
+def _take_all(quota, priority):
+    taken = 0
+    while quota.try_acquire(priority)[0]:
+        taken += 1
+    return taken
+
+
+def test_reserves_keep_tokens_for_higher_priorities(quota):
+    # Предзагрузка оставляет половину, фоновые — 30%, интерактивные берут остаток
+    assert _take_all(quota, PRIORITY_PREFETCH) == 5
+    assert _take_all(quota, PRIORITY_BACKGROUND) == 2
+    assert _take_all(quota, PRIORITY_INTERACTIVE) == 3
+    granted, wait = quota.try_acquire(PRIORITY_INTERACTIVE)
+    assert not granted and wait == pytest.approx(86400 / 10, rel=0.01)
+    assert quota.stats()['granted'] == 10
+
+
+def test_quota_is_shared_through_file(quota, tmp_path):
+    assert _take_all(quota, PRIORITY_INTERACTIVE) == 10
+    other = QuotaManager(str(tmp_path / 'quota.db'), per_minute=0, per_day=10, reserve=RESERVE)
+    assert not other.try_acquire(PRIORITY_INTERACTIVE)[0]
+
+
+def test_acquire_gives_up_after_max_wait(quota):
+    _take_all(quota, PRIORITY_INTERACTIVE)
+    started = time.monotonic()
+    assert not quota.acquire(PRIORITY_INTERACTIVE, max_wait=0.1)
+    assert time.monotonic() - started < 1
+
+
+def test_minute_bucket_refills(tmp_path):
+    quota = QuotaManager(str(tmp_path / 'quota.db'), per_minute=600, per_day=0, reserve=RESERVE)
+    assert _take_all(quota, PRIORITY_INTERACTIVE) >= 600
+    assert quota.acquire(PRIORITY_INTERACTIVE, max_wait=1)
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(threshold=2, recovery_timeout=60)
+    breaker.record_failure()
+    assert breaker.allow() and breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+
+def test_breaker_success_resets_failures():
+    breaker = CircuitBreaker(threshold=2, recovery_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+
+
+def test_breaker_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(threshold=1, recovery_timeout=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+    assert not breaker.allow()
+    # Пробный запрос не удался — снова открыт
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow()
+
+
+def test_breaker_cancelled_trial_can_be_retried():
+    breaker = CircuitBreaker(threshold=1, recovery_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.cancel()
+    assert breaker.allow()
@@ -0,0 +1,41 @@
+import threading
+
+import pytest
+
+import weather_app
+from cache_store import AccessTracker
+from forecast import CompactForecast
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    tracker = AccessTracker()
+    monkeypatch.setattr(weather_app, '_access', tracker)
+    return tracker
+
+
+def test_batch_cache_hits_count_toward_popularity(tracker, monkeypatch):
+    monkeypatch.setattr(weather_app, 'load_from_cache_by_key', lambda lat, lon, endpoint: {'list': []})
+    lat, lon = weather_app.quantize_coordinates(55.75, 37.62, 'forecast5d')
+    weather_app.get_batch('forecast5d', [(55.75, 37.62), (55.75, 37.62)])
+    [(key, score, meta)] = tracker.top(10)
+    assert key == weather_app.get_cache_key(lat, lon, 'forecast5d')
+    assert score == pytest.approx(2)
+    # Предзагрузка обновит ключ с той же функцией извлечения, что и get_forecast_5days
+    assert meta == ('forecast5d', lat, lon, CompactForecast.from_owm)
+
+
+def test_prefetch_runs_outside_shared_pool(tracker, monkeypatch):
+    threads = []
+
+    def fetch_and_cache(endpoint, lat, lon, extract=None, min_age=None):
+        threads.append(threading.current_thread().name)
+        return {'main': {'temp': 1}}
+
+    monkeypatch.setattr(weather_app, '_fresh_entry', lambda key, endpoint, max_age: None)
+    monkeypatch.setattr(weather_app, '_fetch_and_cache', fetch_and_cache)
+    for _ in range(3):
+        tracker.hit('weather:55.75:37.62', ('weather', 55.75, 37.62, None))
+    run = weather_app.Prefetcher(tracker=tracker, min_score=1).run_once()
+    assert run['refreshed'] == 1
+    assert threads[0].startswith('cache-prefetch')
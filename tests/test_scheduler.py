@@ -0,0 +1,83 @@
+import random
+
+from scheduler import (DAY, NotificationScheduler, defer_quiet_hours, in_quiet_hours, next_due_time,
+                       quiet_hours_end, spread_offset)
+
+HOUR = 3600
+
+
+def test_pop_due_in_time_order():
+    scheduler = NotificationScheduler()
+    scheduler.schedule('b', 20)
+    scheduler.schedule('a', 10)
+    scheduler.schedule('c', 30)
+    assert scheduler.next_due() == 10
+    assert scheduler.pop_due(now=25) == [('a', 10), ('b', 20)]
+    assert scheduler.pop_due(now=25) == []
+    assert len(scheduler) == 1 and scheduler.due_at('c') == 30
+
+
+def test_reschedule_and_cancel_skip_stale_entries():
+    scheduler = NotificationScheduler()
+    scheduler.schedule('a', 10)
+    scheduler.schedule('b', 15)
+    scheduler.schedule('a', 40)
+    scheduler.cancel('b')
+    assert scheduler.next_due() == 40
+    assert scheduler.pop_due(now=30) == []
+    assert scheduler.pop_due(now=40) == [('a', 40)]
+    assert scheduler.next_due() is None
+
+
+def test_pop_due_limit():
+    scheduler = NotificationScheduler()
+    scheduler.schedule_many((user_id, user_id) for user_id in range(10))
+    assert [key for key, _ in scheduler.pop_due(now=100, limit=3)] == [0, 1, 2]
+    assert len(scheduler) == 7
+
+
+def test_heap_is_compacted_after_many_reschedules():
+    scheduler = NotificationScheduler()
+    for due in range(1000):
+        scheduler.schedule('a', due)
+    assert len(scheduler._heap) <= 2 * len(scheduler) + 65
+    assert scheduler.pop_due(now=DAY) == [('a', 999)]
+
+
+def test_wait_wakes_on_schedule():
+    scheduler = NotificationScheduler()
+    assert not scheduler.wait(0)
+    scheduler.schedule('a', 1)
+    assert scheduler.wait(0)
+
+
+def test_quiet_hours_across_midnight():
+    quiet = (23, 7)
+    assert in_quiet_hours(23 * HOUR, quiet)
+    assert in_quiet_hours(3 * HOUR, quiet)
+    assert not in_quiet_hours(7 * HOUR, quiet)
+    assert not in_quiet_hours(12 * HOUR, quiet)
+    assert not in_quiet_hours(3 * HOUR, None)
+    # 03:00 по Москве (UTC+3) — это 00:00 UTC
+    assert in_quiet_hours(DAY, quiet, tz_offset=3 * HOUR)
+    assert quiet_hours_end(DAY + 23 * HOUR, quiet) == 2 * DAY + 7 * HOUR
+
+
+def test_defer_quiet_hours():
+    assert defer_quiet_hours(2 * HOUR, (23, 7), spread=60) == 7 * HOUR + 60
+    assert defer_quiet_hours(12 * HOUR, (23, 7), spread=60) == 12 * HOUR
+
+
+def test_next_due_time_jitter_and_quiet_hours():
+    rng = random.Random(1)
+    for _ in range(100):
+        due = next_due_time(12 * HOUR, HOUR, jitter=0.1, rng=rng)
+        assert 12 * HOUR + 0.9 * HOUR <= due <= 12 * HOUR + 1.1 * HOUR
+    for _ in range(100):
+        due = next_due_time(22 * HOUR, 3 * HOUR, jitter=0.1, quiet_hours=(23, 7), quiet_spread=900, rng=rng)
+        assert DAY + 7 * HOUR <= due <= DAY + 7 * HOUR + 900
+
+
+def test_spread_offset_is_deterministic():
+    assert spread_offset(42, 900) == spread_offset(42, 900)
+    assert 0 <= spread_offset('user', 900) < 900
@@ -0,0 +1,19 @@
+import os
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_does_not_read_dotenv(tmp_path):
+    (tmp_path / '.env').write_text('WEATHER_DOTENV_PROBE=1\nCACHE_DIR=from-dotenv\n', encoding='utf-8')
+    env = {key: value for key, value in os.environ.items() if key not in ('WEATHER_DOTENV_PROBE', 'CACHE_DIR')}
+    env['PYTHONPATH'] = REPO
+    code = ('import os, bot, supervisor, weather_app; '
+            'print(os.getenv("WEATHER_DOTENV_PROBE"), weather_app.CACHE_DIR)')
+    result = subprocess.run([sys.executable, '-c', code], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ['None', '.cache']
+    # Импорт без побочных эффектов: каталоги и файлы не создаются
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['.env']
@@ -0,0 +1,83 @@
+import json
+import socket
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from webhook import UpdateDispatcher, WebhookServer
+
+UPDATE = {
+    'update_id': 1001,
+    'message': {
+        'message_id': 7,
+        'date': 1700000000,
+        'from': {'id': 42, 'is_bot': False, 'first_name': 'Test'},
+        'chat': {'id': 42, 'type': 'private'},
+        'text': '/start',
+    },
+}
+
+
+@pytest.fixture
+def webhook():
+    received = []
+    done = threading.Event()
+
+    def handler(update):
+        received.append(update)
+        done.set()
+
+    dispatcher = UpdateDispatcher(handler, workers=2, queue_size=10)
+    dispatcher.start()
+    server = WebhookServer(dispatcher, port=0, secret_token='secret')
+    server.start()
+    yield server, received, done
+    server.shutdown()
+    dispatcher.stop()
+
+
+def _post(server, body, token='secret', path='/webhook'):
+    request = urllib.request.Request(f'http://127.0.0.1:{server.port}{path}', data=body, method='POST',
+                                     headers={'Content-Type': 'application/json',
+                                              'X-Telegram-Bot-Api-Secret-Token': token})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_update_is_dispatched(webhook):
+    server, received, done = webhook
+    assert _post(server, json.dumps(UPDATE).encode('utf-8')) == 200
+    assert done.wait(5)
+    assert received == [UPDATE]
+
+
+@pytest.mark.parametrize('body', [b'not json', b'[1, 2]', b'"text"', b'null'])
+def test_bad_body_is_rejected(webhook, body):
+    server, received, _ = webhook
+    assert _post(server, body) == 400
+    assert received == []
+
+
+def test_wrong_token_and_path(webhook):
+    server, received, _ = webhook
+    body = json.dumps(UPDATE).encode('utf-8')
+    assert _post(server, body, token='wrong') == 403
+    assert _post(server, body, path='/other') == 404
+    assert received == []
+
+
+def test_non_ascii_token_is_forbidden(webhook):
+    server, received, _ = webhook
+    request = (b'POST /webhook HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+               b'X-Telegram-Bot-Api-Secret-Token: \xd1\x82\xd0\xbe\xd0\xba\xd0\xb5\xd0\xbd\r\n'
+               b'Content-Length: 2\r\nConnection: close\r\n\r\n{}')
+    with socket.create_connection(('127.0.0.1', server.port), timeout=5) as sock:
+        sock.sendall(request)
+        status_line = sock.makefile('rb').readline()
+    assert status_line.split()[1] == b'403'
+    assert received == []
@@ -0,0 +1,187 @@
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Dict, Optional
+
+
+class SQLiteUserStore:
+    """
+    Хранилище настроек пользователей в SQLite (WAL).
+
+    Каждое изменение — upsert одной строки в своей транзакции, поэтому стоимость
+    записи не зависит от числа пользователей, а сбой не портит остальные данные.
+    """
+
+    def __init__(self, path: str = 'user_data.db'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, data TEXT NOT NULL)'
+        )
+
+    def load_all(self) -> Dict[str, dict]:
+        """Загружает всех пользователей"""
+        with self._lock:
+            rows = self._conn.execute('SELECT user_id, data FROM users').fetchall()
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    def get(self, user_id: str) -> Optional[dict]:
+        """Возвращает настройки одного пользователя"""
+        with self._lock:
+            row = self._conn.execute('SELECT data FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def upsert(self, user_id: str, data: dict):
+        """Сохраняет настройки одного пользователя"""
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO users (user_id, data) VALUES (?, ?) '
+                'ON CONFLICT(user_id) DO UPDATE SET data = excluded.data',
+                (user_id, payload)
+            )
+
+    def upsert_many(self, users: Dict[str, dict]):
+        """Сохраняет нескольких пользователей одной транзакцией"""
+        rows = [(user_id, json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+                for user_id, data in users.items()]
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN')
+                self._conn.executemany(
+                    'INSERT INTO users (user_id, data) VALUES (?, ?) '
+                    'ON CONFLICT(user_id) DO UPDATE SET data = excluded.data',
+                    rows
+                )
+
+    def delete(self, user_id: str):
+        """Удаляет пользователя"""
+        with self._lock:
+            self._conn.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JsonUserStore:
+    """
+    Прежний формат: все пользователи в одном JSON файле.
+
+    Файл переписывается целиком, но атомарно (через временный файл).
+    """
+
+    def __init__(self, path: str = 'user_data.json'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._users = self._read()
+
+    def _read(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._users, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def load_all(self) -> Dict[str, dict]:
+        with self._lock:
+            return json.loads(json.dumps(self._users))
+
+    def get(self, user_id: str) -> Optional[dict]:
+        with self._lock:
+            data = self._users.get(user_id)
+            return dict(data) if data is not None else None
+
+    def upsert(self, user_id: str, data: dict):
+        with self._lock:
+            self._users[user_id] = json.loads(json.dumps(data))
+            self._write()
+
+    def upsert_many(self, users: Dict[str, dict]):
+        with self._lock:
+            self._users.update(json.loads(json.dumps(users)))
+            self._write()
+
+    def delete(self, user_id: str):
+        with self._lock:
+            if self._users.pop(user_id, None) is not None:
+                self._write()
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._users)
+
+    def close(self):
+        pass
+
+
+def shard_of(user_id, shards: int) -> int:
+    """
+    Номер шарда пользователя (0..shards-1).
+
+    Числовые id делятся по модулю, остальные — по crc32, чтобы номер не зависел
+    от процесса (встроенный hash() строк в разных процессах разный).
+    """
+    try:
+        return int(user_id) % shards
+    except (TypeError, ValueError):
+        return zlib.crc32(str(user_id).encode('utf-8')) % shards
+
+
+def migrate_from_json(store, json_path: str) -> int:
+    """
+    Одноразово переносит пользователей из user_data.json в хранилище.
+
+    После успешного переноса файл переименовывается в *.migrated,
+    чтобы миграция не повторялась. Возвращает число перенесённых пользователей.
+    """
+    if not os.path.exists(json_path):
+        return 0
+    with open(json_path, 'r', encoding='utf-8') as f:
+        users = json.load(f)
+    store.upsert_many(users)
+    os.replace(json_path, f"{json_path}.migrated")
+    return len(users)
+
+
+def open_user_store(backend: Optional[str] = None, path: Optional[str] = None,
+                    legacy_json_path: str = 'user_data.json', migrate: bool = True):
+    """
+    Открывает хранилище пользователей.
+
+    Args:
+        backend: 'sqlite' (по умолчанию) или 'json'; по умолчанию из USER_STORE
+        path: Путь к файлу хранилища; по умолчанию из USER_STORE_PATH
+        legacy_json_path: Файл старого формата для одноразовой миграции в SQLite
+        migrate: Выполнить миграцию; рабочие процессы супервизора её не выполняют —
+            её один раз делает супервизор до их запуска
+    """
+    backend = backend or os.getenv('USER_STORE', 'sqlite')
+    path = path or os.getenv('USER_STORE_PATH')
+    if backend == 'json':
+        return JsonUserStore(path or legacy_json_path)
+    if backend != 'sqlite':
+        raise ValueError(f"Неизвестное хранилище пользователей: {backend}")
+
+    store = SQLiteUserStore(path or 'user_data.db')
+    migrated = migrate_from_json(store, legacy_json_path) if migrate else 0
+    if migrated:
+        print(f"📦 Перенесено пользователей из {legacy_json_path}: {migrated}")
+    return store
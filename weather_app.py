@@ -1,74 +1,361 @@
-import requests
-from dotenv import load_dotenv
+if __name__ == '__main__':
+    # .env читается только при запуске из командной строки и до импорта модулей с настройками;
+    # импорт из тестов и инструментов окружение процесса не меняет
+    from dotenv import load_dotenv
+    load_dotenv()
+
 import os
 import http_client
+import metrics
+from air_quality import CLASSIFIER as AIR_QUALITY, format_air_quality
+from cache_store import AccessTracker, MemoryCache, SingleFlight, SQLiteCacheStore
+from forecast import CompactForecast
+from gazetteer import get_gazetteer
 import json
 from datetime import datetime, timedelta
 import hashlib
+import math
+import threading
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError, as_completed
 
-# Загружаем переменные окружения
-load_dotenv()
-
+# Ключ проверяется при первом запросе к API (или явно через check_config), а не при импорте
 API_KEY = os.getenv('API_KEY')
-if not API_KEY:
-    raise ValueError("API ключ не найден. Создайте файл .env с API_KEY")
 
-CACHE_DIR = '.cache'
+# Адреса API OpenWeatherMap (можно направить на свой прокси или тестовый сервер)
+OWM_API_URL = os.getenv('OWM_API_URL', 'https://api.openweathermap.org').rstrip('/')
+OWM_PRO_API_URL = os.getenv('OWM_PRO_API_URL', 'https://pro.openweathermap.org').rstrip('/')
+
+CACHE_DIR = os.getenv('CACHE_DIR', '.cache')
+# Мягкий TTL: до него данные свежие. После — отдаются сразу, а в фоне запрашивается обновление
 CACHE_DURATION = timedelta(minutes=10)
+# Жёсткий TTL: после него данные нужно получить заново, прежде чем отдавать
+CACHE_STALE_DURATION = timedelta(hours=1)
+# Сколько хранить последние известные данные на случай недоступности API
+CACHE_RETENTION = timedelta(days=1)
+STALE_WHILE_REVALIDATE = True
+# Ключ с возрастом данных в секундах, если отданы устаревшие данные
+STALE_AGE_KEY = '_stale_age'
+# Ответ в режиме «только кэш» (http_client.PRIORITY_CACHE_ONLY), когда в кэше ничего нет
+CACHE_ONLY_ERROR = "Сейчас слишком много запросов, а сохранённых данных нет. Попробуйте через минуту"
+# Геокодирование не ответило (квота, 429, 5xx): это не значит, что города нет
+GEOCODING_BUSY_ERROR = "Сервис поиска городов сейчас перегружен. Попробуйте через минуту"
+# Все ответы API хранятся в одной базе; просроченные записи удаляются фоновой очисткой
+CACHE_DB_FILE = os.path.join(CACHE_DIR, 'cache.db')
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+CACHE_GC_INTERVAL = 300
+# Размер ячейки сетки кэша в градусах по endpoint'ам. Данные OpenWeatherMap имеют
+# километровое разрешение, поэтому пользователи из одной ячейки делят одну запись,
+# а запрос в API уходит для центра ячейки. 0 или None — без квантования.
+CACHE_GRID = {
+    'weather': 0.01,       # ~1 км
+    'hourly': 0.05,        # ~5 км
+    'forecast5d': 0.05,
+    'air_pollution': 0.1,  # ~10 км
+}
+CACHE_GRID_DEFAULT = 0.01
+# Размер кэша в памяти перед файловым кэшем (число записей)
+MEMORY_CACHE_SIZE = int(os.getenv('MEMORY_CACHE_SIZE', 2048))
+
+# Геокодирование: координаты городов почти не меняются, поэтому храним их долго.
+# Отрицательные ответы ("Город не найден") храним меньше — вдруг это была опечатка в API.
+# Геокэш хранится в файловом кэше; GEO_CACHE_FILE — старый формат, переносится при запуске
+GEO_CACHE_FILE = os.path.join(CACHE_DIR, 'geocoding.json')
+GEO_CACHE_DURATION = timedelta(days=30)
+GEO_NEGATIVE_CACHE_DURATION = timedelta(hours=6)
+
+# Параллельные запросы к API: общий пул потоков и таймаут на один вызов
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', 8))
+FETCH_TIMEOUT = 15
+
+# Предзагрузка: самые популярные ключи (PREFETCH_TOP_K) обновляются за PREFETCH_LEAD секунд
+# до истечения CACHE_DURATION. Популярность — счётчик обращений с полураспадом PREFETCH_HALF_LIFE;
+# ключи со счётчиком ниже PREFETCH_MIN_SCORE не предзагружаются.
+# Предзагрузка тратит не больше PREFETCH_QUOTA_SHARE минутной квоты OpenWeatherMap.
+PREFETCH_TOP_K = int(os.getenv('PREFETCH_TOP_K', 50))
+PREFETCH_LEAD = 60
+PREFETCH_INTERVAL = 30
+PREFETCH_HALF_LIFE = 1800
+PREFETCH_MIN_SCORE = 3.0
+PREFETCH_QUOTA_SHARE = float(os.getenv('PREFETCH_QUOTA_SHARE', 0.2))
+# Фоновые обновления идут в отдельном небольшом пуле, чтобы не занимать очередь
+# общего пула FETCH_WORKERS, в котором выполняются запросы пользователей
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', 2))
+
+_executor = None
+_executor_lock = threading.Lock()
+_prefetch_executor = None
+_prefetch_executor_lock = threading.Lock()
+
+_memory_cache = MemoryCache(max_entries=MEMORY_CACHE_SIZE, ttl=CACHE_STALE_DURATION.total_seconds())
+_disk_cache = None
+_disk_cache_lock = threading.Lock()
+_disk_stats = {'hits': 0, 'misses': 0}
+_disk_stats_lock = threading.Lock()
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+_inflight = SingleFlight()
+_access = AccessTracker(half_life=PREFETCH_HALF_LIFE)
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+# Endpoint'ы OpenWeatherMap, которые кэшируются по координатам:
+# сервер ('api' или 'pro'), путь и постоянные параметры
+ENDPOINTS = {
+    'weather': ('api', '/data/2.5/weather', {'units': 'metric', 'lang': 'ru'}),
+    'hourly': ('pro', '/data/2.5/forecast/hourly', {'units': 'metric', 'lang': 'ru'}),
+    'forecast5d': ('api', '/data/2.5/forecast', {'units': 'metric', 'lang': 'ru'}),
+    'air_pollution': ('api', '/data/2.5/air_pollution', {}),
+}
+
+# Как хранить данные endpoint'а в файловом кэше: (в JSON, из JSON).
+# В памяти лежат сами объекты, прогнозы — в компактном виде (CompactForecast)
+CACHE_CODECS = {
+    'hourly': (CompactForecast.to_dict, CompactForecast.from_dict),
+    'forecast5d': (CompactForecast.to_dict, CompactForecast.from_dict),
+}
+
+def check_config():
+    """Проверяет настройки, без которых запросы к API невозможны"""
+    _api_key()
+
+def _api_key() -> str:
+    key = API_KEY or os.getenv('API_KEY')
+    if not key:
+        raise ValueError("API ключ не найден. Создайте файл .env с API_KEY")
+    return key
 
-if not os.path.exists(CACHE_DIR):
-    os.makedirs(CACHE_DIR)
+def api_url(server: str, path: str) -> str:
+    """Полный URL API: server — 'api' или 'pro'"""
+    base = OWM_PRO_API_URL if server == 'pro' else OWM_API_URL
+    return f"{base}{path}"
+
+def quantize_coordinates(lat: float, lon: float, endpoint: str) -> tuple:
+    """Возвращает центр ячейки сетки кэша, в которую попадают координаты"""
+    step = CACHE_GRID.get(endpoint, CACHE_GRID_DEFAULT)
+    if not step:
+        return lat, lon
+    return (round((math.floor(lat / step) + 0.5) * step, 6),
+            round((math.floor(lon / step) + 0.5) * step, 6))
 
 def get_cache_key(lat: float, lon: float, endpoint: str) -> str:
-    """Генерирует ключ кэша на основе координат и endpoint"""
+    """Генерирует ключ кэша на основе ячейки сетки и endpoint"""
+    lat, lon = quantize_coordinates(lat, lon, endpoint)
     key_string = f"{lat:.4f}_{lon:.4f}_{endpoint}"
     return hashlib.md5(key_string.encode()).hexdigest()
 
+def _get_disk_cache() -> SQLiteCacheStore:
+    """Открывает файловый кэш при первом обращении и запускает его очистку"""
+    global _disk_cache
+    with _disk_cache_lock:
+        if _disk_cache is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            _disk_cache = SQLiteCacheStore(CACHE_DB_FILE, max_bytes=CACHE_MAX_BYTES)
+            _disk_cache.start_gc(CACHE_GC_INTERVAL)
+            _remove_legacy_cache_files()
+            _import_legacy_geo_cache()
+        return _disk_cache
+
+def _remove_legacy_cache_files():
+    """Удаляет файлы старого формата кэша (.cache/<md5>.json)"""
+    for name in os.listdir(CACHE_DIR):
+        stem, ext = os.path.splitext(name)
+        if ext == '.json' and len(stem) == 32 and all(c in '0123456789abcdef' for c in stem):
+            try:
+                os.remove(os.path.join(CACHE_DIR, name))
+            except OSError:
+                pass
+
 def save_to_cache_by_key(data: dict, lat: float, lon: float, endpoint: str):
-    """Сохраняет данные в кэш по ключу"""
+    """Сохраняет данные в кэш по ключу (в память и на диск)"""
     cache_key = get_cache_key(lat, lon, endpoint)
-    cache_file = os.path.join(CACHE_DIR, f"{cache_key}.json")
-    
-    cache_data = {
-        'fetched_at': datetime.now().isoformat(),
-        'lat': lat,
-        'lon': lon,
-        'endpoint': endpoint,
-        'data': data
-    }
-    
-    with open(cache_file, 'w', encoding='utf-8') as f:
-        json.dump(cache_data, f, ensure_ascii=False, indent=2)
+    fetched_at = time.time()
+    _memory_cache.set(cache_key, data, fetched_at)
+    codec = CACHE_CODECS.get(endpoint)
+    payload = codec[0](data) if codec else data
+    _get_disk_cache().set(cache_key, endpoint, payload, fetched_at, CACHE_RETENTION.total_seconds())
 
-def load_from_cache_by_key(lat: float, lon: float, endpoint: str) -> dict:
-    """Загружает данные из кэша по ключу"""
+def load_cache_entry(lat: float, lon: float, endpoint: str) -> tuple:
+    """
+    Загружает запись кэша любого возраста (в пределах CACHE_RETENTION).
+
+    Returns:
+        (данные, возраст в секундах) или None
+    """
     cache_key = get_cache_key(lat, lon, endpoint)
-    cache_file = os.path.join(CACHE_DIR, f"{cache_key}.json")
-    
+    tier = 'memory'
+    entry = _memory_cache.get_entry(cache_key)
+    if entry is None:
+        tier = 'disk'
+        entry = _get_disk_cache().get(cache_key)
+        if entry is None:
+            _count_disk('misses')
+            metrics.CACHE_LOOKUPS.inc(endpoint=endpoint, result='miss', tier=tier)
+            return None
+        _count_disk('hits')
+        codec = CACHE_CODECS.get(endpoint)
+        if codec:
+            entry = codec[1](entry[0]), entry[1]
+        _memory_cache.set(cache_key, entry[0], entry[1])
+    data, fetched_at = entry
+    age = time.time() - fetched_at
+    result = 'hit' if age < CACHE_DURATION.total_seconds() else 'stale'
+    metrics.CACHE_LOOKUPS.inc(endpoint=endpoint, result=result, tier=tier)
+    return data, age
+
+def load_from_cache_by_key(lat: float, lon: float, endpoint: str) -> dict:
+    """Загружает свежие данные из кэша по ключу: сначала из памяти, затем с диска"""
+    entry = load_cache_entry(lat, lon, endpoint)
+    if entry is not None and entry[1] < CACHE_DURATION.total_seconds():
+        return entry[0]
+    return None
+
+
+def _fresh_entry(cache_key: str, endpoint: str, max_age: float) -> tuple:
+    """
+    Запись кэша моложе max_age секунд: из памяти или из общего файлового кэша.
+
+    Файловый кэш общий для всех процессов бота: если другой процесс уже обновил запись,
+    она переносится в память и повторно в API не запрашивается.
+
+    Returns:
+        (данные, fetched_at) или None
+    """
+    now = time.time()
+    entry = _memory_cache.get_entry(cache_key)
+    if entry is not None and now - entry[1] < max_age:
+        return entry
+    disk_entry = _get_disk_cache().get(cache_key)
+    if disk_entry is None or now - disk_entry[1] >= max_age:
+        return None
+    codec = CACHE_CODECS.get(endpoint)
+    if codec:
+        disk_entry = codec[1](disk_entry[0]), disk_entry[1]
+    _memory_cache.set(cache_key, disk_entry[0], disk_entry[1])
+    _count_disk('hits')
+    return disk_entry
+
+
+def _count_disk(counter: str):
+    with _disk_stats_lock:
+        _disk_stats[counter] += 1
+
+
+def get_cache_stats() -> dict:
+    """Статистика кэша: уровень в памяти и файловый уровень"""
+    with _disk_stats_lock:
+        disk = dict(_disk_stats)
+    disk['entries'] = _get_disk_cache().stats()
+    return {'memory': _memory_cache.stats(), 'disk': disk}
+
+
+# Ключи геокэша в общем файловом кэше (endpoint 'geocoding'): срок хранения и очистка —
+# те же, что у ответов API, запись нового города — одна строка, а не весь файл
+GEO_KEY_PREFIX = 'geo:'
+
+
+def normalize_city_name(city: str) -> str:
+    """Нормализует название города для ключа геокэша"""
+    return " ".join(city.replace("ё", "е").replace("Ё", "Е").split()).casefold()
+
+
+def _import_legacy_geo_cache():
+    """Переносит неистёкшие записи старого геокэша (geocoding.json) в файловый кэш"""
     try:
-        with open(cache_file, 'r', encoding='utf-8') as f:
-            cached_data = json.load(f)
-            fetched_time = datetime.fromisoformat(cached_data['fetched_at'])
-            
-            if datetime.now() - fetched_time < CACHE_DURATION:
-                return cached_data['data']
-    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        with open(GEO_CACHE_FILE, 'r', encoding='utf-8') as f:
+            legacy = json.load(f)
+    except FileNotFoundError:
+        return
+    except json.JSONDecodeError:
+        legacy = {}
+    now = datetime.now()
+    for key, entry in legacy.items():
+        try:
+            fetched_at = datetime.fromisoformat(entry['fetched_at'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        ttl = GEO_CACHE_DURATION if entry.get('lat') is not None else GEO_NEGATIVE_CACHE_DURATION
+        if now - fetched_at < ttl:
+            data = {'lat': entry.get('lat'), 'lon': entry.get('lon'), 'name': entry.get('name')}
+            _disk_cache.set(GEO_KEY_PREFIX + key, 'geocoding', data, fetched_at.timestamp(), ttl.total_seconds())
+    try:
+        os.replace(GEO_CACHE_FILE, f"{GEO_CACHE_FILE}.migrated")
+    except OSError:
+        # Файл уже перенёс другой процесс
         pass
-    
-    return None
 
 
-def get_coordinates(city: str) -> tuple:
-    """Получает координаты города"""
-    url = f"http://api.openweathermap.org/geo/1.0/direct?q={city}&appid={API_KEY}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        if data:
-            return data[0]['lat'], data[0]['lon']
-    else:
+def _geo_cache_lookup(key: str):
+    """Возвращает запись геокэша {'lat', 'lon', 'name'}, если она ещё не устарела"""
+    entry = _get_disk_cache().get(GEO_KEY_PREFIX + key)
+    return entry[0] if entry else None
+
+
+def _geo_cache_store(key: str, lat: float = None, lon: float = None, name: str = None):
+    """Сохраняет результат геокодирования (lat=None — город не найден)"""
+    ttl = GEO_CACHE_DURATION if lat is not None else GEO_NEGATIVE_CACHE_DURATION
+    _get_disk_cache().set(GEO_KEY_PREFIX + key, 'geocoding', {'lat': lat, 'lon': lon, 'name': name},
+                          time.time(), ttl.total_seconds())
+
+
+def geocode(city: str) -> dict:
+    """
+    Находит город: {'lat', 'lon', 'name'} или {"error": ...}.
+
+    Сначала — локальный справочник городов (gazetteer.py), затем геокэш, затем
+    справочник с исправлением опечатки (Gazetteer.closest) и только для неизвестных
+    названий — API геокодирования. «Город не найден»
+    (с подсказками) возвращается только по ответу API; отказ квоты, 429 и 5xx
+    дают GEOCODING_BUSY_ERROR и в геокэш не попадают.
+    """
+    place = get_gazetteer().lookup(city)
+    if place:
+        metrics.GEOCODING_LOOKUPS.inc(source='gazetteer')
+        return {'lat': place.lat, 'lon': place.lon, 'name': place.name}
+
+    key = normalize_city_name(city)
+    entry = _geo_cache_lookup(key)
+    if entry and entry['lat'] is not None:
+        metrics.GEOCODING_LOOKUPS.inc(source='cache')
+        return {'lat': entry['lat'], 'lon': entry['lon'], 'name': entry['name']}
+    place = get_gazetteer().closest(city)
+    if place:
+        metrics.GEOCODING_LOOKUPS.inc(source='gazetteer_fuzzy')
+        return {'lat': place.lat, 'lon': place.lon, 'name': place.name}
+    if entry:
+        metrics.GEOCODING_LOOKUPS.inc(source='cache')
+        return city_not_found(city)
+    if not http_client.upstream_allowed():
+        return {"error": CACHE_ONLY_ERROR}
+
+    url = api_url('api', '/geo/1.0/direct')
+    response = http_client.get_simple(url, params={'q': city, 'limit': 1, 'appid': _api_key()})
+    if response is None or response.status_code == 429 or response.status_code >= 500:
+        print(f"Ошибка геокодирования: {response.status_code if response else 'нет ответа'}")
+        return {"error": GEOCODING_BUSY_ERROR}
+    if response.status_code != 200:
         print(f"Ошибка: {response.status_code}")
+        return {"error": f"Ошибка запроса: {response.status_code}"}
+
+    data = response.json()
+    metrics.GEOCODING_LOOKUPS.inc(source='api' if data else 'not_found')
+    if data:
+        place = data[0]
+        name = place.get('local_names', {}).get('ru', place['name'])
+        _geo_cache_store(key, place['lat'], place['lon'], name)
+        return {'lat': place['lat'], 'lon': place['lon'], 'name': name}
+    _geo_cache_store(key)
+    return city_not_found(city)
+
+
+def get_coordinates(city: str) -> tuple:
+    """Координаты города (lat, lon) или None, если найти его не удалось (причина — в geocode)"""
+    place = geocode(city)
+    if is_error(place):
         return None
+    return place['lat'], place['lon']
 
 
 def get_current_weather(city: str = None, latitude: float = None, longitude: float = None) -> dict:
@@ -83,47 +370,340 @@ def get_current_weather(city: str = None, latitude: float = None, longitude: flo
     return {"error": "Укажите город или координаты"}
 
 
-def get_weather_by_coordinates(latitude: float, longitude: float) -> dict:
-    cached = load_from_cache_by_key(latitude, longitude, 'weather')
-    if cached:
-        return cached
+def fetch_endpoint(endpoint: str, latitude: float, longitude: float, extract=None) -> dict:
+    """
+    Возвращает данные endpoint'а по координатам из кэша или из API.
+
+    Одновременные промахи кэша по одному ключу объединяются: в API уходит один запрос,
+    остальные потоки получают его результат (или его исключение). Запросы разных приоритетов
+    не объединяются (см. _inflight_key).
+    Данные старше CACHE_DURATION, но моложе CACHE_STALE_DURATION отдаются сразу, а обновление
+    идёт в фоне. Если API недоступен, отдаются последние известные данные с ключом STALE_AGE_KEY.
+    В режиме «только кэш» (http_client.PRIORITY_CACHE_ONLY) отдаются данные любого возраста
+    или {"error": CACHE_ONLY_ERROR}, в API запрос не уходит.
+    extract — необязательное преобразование ответа перед сохранением в кэш.
+    """
+    # Запрашиваем центр ячейки, чтобы ответ был верен для всех, кто в неё попадает
+    latitude, longitude = quantize_coordinates(latitude, longitude, endpoint)
+    cache_key = get_cache_key(latitude, longitude, endpoint)
+    _access.hit(cache_key, (endpoint, latitude, longitude, extract))
+    entry = load_cache_entry(latitude, longitude, endpoint)
+    if entry:
+        data, age = entry
+        if age < CACHE_DURATION.total_seconds():
+            return data
+        if not http_client.upstream_allowed():
+            return mark_stale(data, age)
+        if STALE_WHILE_REVALIDATE and age < CACHE_STALE_DURATION.total_seconds():
+            _schedule_refresh(endpoint, latitude, longitude, extract)
+            return data
+    elif not http_client.upstream_allowed():
+        return {"error": CACHE_ONLY_ERROR}
     
-    url = f"https://api.openweathermap.org/data/2.5/weather?lat={latitude}&lon={longitude}&appid={API_KEY}&units=metric&lang=ru"
+    try:
+        result = _inflight.do(_inflight_key(cache_key), _fetch_and_cache, endpoint, latitude, longitude, extract)
+    except Exception:
+        if entry:
+            return mark_stale(*entry)
+        raise
+    if is_error(result) and entry:
+        return mark_stale(*entry)
+    return result
+
+
+def _inflight_key(cache_key: str) -> tuple:
+    """
+    Ключ объединения одновременных запросов: ключ кэша и приоритет текущего потока.
+
+    Запрос пользователя не ждёт фоновый запрос того же ключа: тот может ждать квоту
+    до QUOTA_MAX_WAIT[PRIORITY_BACKGROUND] секунд, а предзагрузка получает отказ сразу.
+    """
+    return cache_key, http_client.current_priority()
+
+
+def is_error(data) -> bool:
+    """True, если вместо данных вернулась ошибка ({'error': ...})"""
+    return isinstance(data, dict) and "error" in data
+
+
+def mark_stale(data, age: float):
+    """Возвращает копию данных с пометкой их возраста"""
+    if isinstance(data, dict):
+        return {**data, STALE_AGE_KEY: int(age)}
+    if isinstance(data, CompactForecast):
+        data = data.copy()
+        data.stale_age = int(age)
+    return data
+
+
+def stale_age(data):
+    """Возраст устаревших данных в секундах или None, если данные свежие"""
+    if isinstance(data, dict):
+        return data.get(STALE_AGE_KEY)
+    return getattr(data, 'stale_age', None)
+
+
+def _schedule_refresh(endpoint: str, latitude: float, longitude: float, extract=None):
+    """Ставит фоновое обновление записи кэша, если оно ещё не запущено"""
+    cache_key = get_cache_key(latitude, longitude, endpoint)
+    with _refreshing_lock:
+        if cache_key in _refreshing:
+            return
+        _refreshing.add(cache_key)
+    
+    def refresh():
+        try:
+            with http_client.request_priority(http_client.PRIORITY_PREFETCH):
+                _inflight.do(_inflight_key(cache_key), _fetch_and_cache, endpoint, latitude, longitude, extract)
+        except Exception as e:
+            print(f"❌ Ошибка фонового обновления {endpoint}: {e}")
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(cache_key)
     
+    _get_prefetch_executor().submit(refresh)
+
+
+def _fetch_and_cache(endpoint: str, latitude: float, longitude: float, extract=None,
+                     min_age: float = 0) -> dict:
+    # Пока ждали своей очереди, другой поток или другой процесс мог уже обновить кэш.
+    # min_age — с какого возраста запись обновляется (предзагрузка обновляет ещё свежие записи)
+    entry = _fresh_entry(get_cache_key(latitude, longitude, endpoint), endpoint,
+                         min_age or CACHE_DURATION.total_seconds())
+    if entry is not None:
+        return entry[0]
+    
+    server, path, params = ENDPOINTS[endpoint]
+    url = api_url(server, path)
+    params = {'lat': latitude, 'lon': longitude, 'appid': _api_key(), **params}
+    response = http_client.get_with_retries(url, params=params)
+    if response and response.status_code == 200:
+        data = response.json()
+        if extract:
+            data = extract(data)
+        save_to_cache_by_key(data, latitude, longitude, endpoint)
+        return data
+    return {"error": f"Ошибка запроса: {response.status_code if response else 'Нет ответа'}"}
+
+
+class Prefetcher:
+    """
+    Упреждающее обновление популярных ключей кэша.
+
+    Раз в interval секунд берёт top_k самых запрашиваемых ключей (см. AccessTracker)
+    и обновляет те, которым до истечения CACHE_DURATION осталось меньше lead секунд
+    (или которых нет ни в памяти, ни в общем файловом кэше). За проход делается не больше budget() запросов
+    с приоритетом PRIORITY_PREFETCH в отдельном пуле PREFETCH_WORKERS, самые популярные ключи — первыми.
+    """
+
+    def __init__(self, tracker: AccessTracker = None, top_k: int = None, lead: float = None,
+                 interval: float = None, quota_share: float = None, min_score: float = None):
+        self.tracker = tracker or _access
+        self.top_k = PREFETCH_TOP_K if top_k is None else top_k
+        self.lead = PREFETCH_LEAD if lead is None else lead
+        self.interval = PREFETCH_INTERVAL if interval is None else interval
+        self.quota_share = PREFETCH_QUOTA_SHARE if quota_share is None else quota_share
+        self.min_score = PREFETCH_MIN_SCORE if min_score is None else min_score
+        self.stats = {'runs': 0, 'refreshed': 0, 'failed': 0, 'deferred': 0}
+        self._warm = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def budget(self) -> int:
+        """Сколько запросов можно сделать за один проход"""
+        per_minute = http_client.QUOTA_PER_MINUTE
+        if not per_minute:
+            return self.top_k
+        return max(1, int(per_minute * self.quota_share * self.interval / 60))
+
+    def run_once(self) -> dict:
+        """Один проход: обновляет ключи, которые скоро истекут; возвращает счётчики прохода"""
+        fresh_for = CACHE_DURATION.total_seconds()
+        now = time.time()
+        hot = self.tracker.top(self.top_k, min_score=self.min_score, now=now)
+        due = []
+        for key, score, (endpoint, lat, lon, extract) in hot:
+            # Ключ мог уже обновить другой процесс — тогда запись берётся из общего кэша
+            if _fresh_entry(key, endpoint, fresh_for - self.lead) is None:
+                due.append((key, endpoint, lat, lon, extract))
+        
+        budget = self.budget()
+        run = {'hot': len(hot), 'due': len(due), 'refreshed': 0, 'failed': 0, 'deferred': max(0, len(due) - budget)}
+        calls = [(self._refresh, key, endpoint, lat, lon, extract, fresh_for - self.lead)
+                 for key, endpoint, lat, lon, extract in due[:budget]]
+        for (_, _, endpoint, *_), ok in zip(calls, gather(*calls, executor=_get_prefetch_executor()) if calls else []):
+            run['refreshed' if ok is True else 'failed'] += 1
+            metrics.PREFETCH_REFRESHES.inc(endpoint=endpoint, result='ok' if ok is True else 'error')
+        
+        with self._lock:
+            self._warm = [{'key': key, 'endpoint': meta[0], 'lat': meta[1], 'lon': meta[2], 'score': round(score, 2)}
+                          for key, score, meta in hot]
+            self.stats['runs'] += 1
+            for counter in ('refreshed', 'failed', 'deferred'):
+                self.stats[counter] += run[counter]
+        metrics.PREFETCH_WARM_KEYS.set(len(hot))
+        return run
+
+    @staticmethod
+    def _refresh(key: str, endpoint: str, lat: float, lon: float, extract, min_age: float) -> bool:
+        with http_client.request_priority(http_client.PRIORITY_PREFETCH):
+            result = _inflight.do(_inflight_key(key), _fetch_and_cache, endpoint, lat, lon, extract, min_age)
+        return not is_error(result)
+
+    def warm_keys(self) -> list:
+        """Ключи, которые предзагрузка держит свежими (по последнему проходу)"""
+        with self._lock:
+            return list(self._warm)
+
+    def start(self):
+        """Запускает проходы в фоновом потоке"""
+        if self._thread is not None:
+            return
+        
+        def run():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.run_once()
+                except Exception as e:
+                    print(f"❌ Ошибка предзагрузки: {e}")
+        
+        self._thread = threading.Thread(target=run, name='cache-prefetch', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def start_prefetcher() -> Prefetcher:
+    """Запускает общую предзагрузку популярных ключей (один раз на процесс)"""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher()
+            _prefetcher.start()
+        return _prefetcher
+
+
+def get_prefetch_status() -> dict:
+    """Состояние предзагрузки: счётчики и ключи, которые она держит свежими"""
+    prefetcher = _prefetcher
+    if prefetcher is None:
+        return {'running': False, 'tracked_keys': len(_access), 'warm_keys': []}
+    return {'running': True, 'tracked_keys': len(_access), **prefetcher.stats, 'warm_keys': prefetcher.warm_keys()}
+
+
+def get_weather_by_coordinates(latitude: float, longitude: float) -> dict:
     try:
-        response = http_client.get_with_retries(url)
-        if response and response.status_code == 200:
-            data = response.json()
-            save_to_cache_by_key(data, latitude, longitude, 'weather')
-            return data
-        else:
-            return {"error": f"Ошибка запроса: {response.status_code if response else 'Нет ответа'}"}
+        return fetch_endpoint('weather', latitude, longitude)
     except Exception as e:
         return {"error": f"Ошибка получения погоды: {e}"}
 
 
+def suggest_cities(city: str, limit: int = 3) -> list:
+    """Похожие названия из справочника городов — для подсказки «возможно, вы имели в виду»"""
+    return [place.name for place in get_gazetteer().suggest(city, limit=limit)]
+
+
+def city_not_found(city: str) -> dict:
+    """Ошибка «Город не найден» с подсказками похожих названий"""
+    if not http_client.upstream_allowed():
+        # Без запроса к API нельзя сказать, что такого города нет
+        return {"error": CACHE_ONLY_ERROR}
+    return {"error": "Город не найден", "suggestions": suggest_cities(city)}
+
+
 def get_weather_by_city(city: str) -> dict:
-    coords = get_coordinates(city)
-    if not coords:
-        return {"error": "Город не найден"}
-    
-    lat, lon = coords
-    cached = load_from_cache_by_key(lat, lon, 'weather')
-    if cached:
-        return cached
-    
-    url = f"https://api.openweathermap.org/data/2.5/weather?q={city}&appid={API_KEY}&units=metric&lang=ru"
+    place = geocode(city)
+    if is_error(place):
+        return place
     
+    # Координаты берутся из геокэша, поэтому дальше идём в тот же кэш, что и запросы по геолокации
+    return with_place_name(get_weather_by_coordinates(place['lat'], place['lon']), place['name'])
+
+
+def with_place_name(data, name: str):
+    """
+    Данные погоды с названием найденного города вместо названия из ответа API.
+
+    OpenWeatherMap называет ближайшую станцию или центр ячейки кэша («Тверская Застава»),
+    а пользователь спрашивал про город. Данные из кэша общие для всех, поэтому меняется копия.
+    """
+    if not name or not isinstance(data, dict) or is_error(data) or 'name' not in data:
+        return data
+    return {**data, 'name': name}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Возвращает общий пул потоков для параллельных запросов (создаётся лениво)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='weather-fetch')
+        return _executor
+
+
+def _get_prefetch_executor() -> ThreadPoolExecutor:
+    """Возвращает пул потоков для предзагрузки и фоновых обновлений кэша (создаётся лениво)"""
+    global _prefetch_executor
+    with _prefetch_executor_lock:
+        if _prefetch_executor is None:
+            _prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='cache-prefetch')
+        return _prefetch_executor
+
+
+def _fetch_error(exc: BaseException) -> dict:
+    """Превращает исключение параллельного вызова в ответ с ошибкой"""
+    if isinstance(exc, (FutureTimeoutError, asyncio.TimeoutError)):
+        return {"error": "Превышено время ожидания ответа"}
+    return {"error": f"Ошибка получения данных: {exc}"}
+
+
+def submit(func, *args, **kwargs) -> Future:
+    """Запускает функцию weather_app в общем пуле потоков (с приоритетом вызывающего потока)"""
+    return _get_executor().submit(_run_with_priority, http_client.current_priority(), func, *args, **kwargs)
+
+
+def gather(*calls, timeout: float = FETCH_TIMEOUT, executor: ThreadPoolExecutor = None) -> list:
+    """
+    Выполняет несколько запросов параллельно и собирает результаты по порядку.
+
+    Каждый вызов — кортеж (функция, *аргументы), например
+    gather((get_weather_by_coordinates, lat, lon), (get_air_pollution, lat, lon)).
+    Вызов, не уложившийся в timeout или упавший с исключением, возвращает {"error": ...}.
+    executor — пул потоков (по умолчанию общий).
+    """
+    pool = executor or _get_executor()
+    priority = http_client.current_priority()
+    futures = [pool.submit(_run_with_priority, priority, func, *args) for func, *args in calls]
+    deadline = time.monotonic() + timeout
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result(timeout=max(0, deadline - time.monotonic())))
+        except Exception as e:
+            results.append(_fetch_error(e))
+    return results
+
+
+async def gather_async(*calls, timeout: float = FETCH_TIMEOUT) -> list:
+    """Асинхронный вариант gather для использования внутри event loop"""
+    loop = asyncio.get_running_loop()
+    tasks = [
+        asyncio.wait_for(loop.run_in_executor(_get_executor(), functools.partial(
+            _run_with_priority, http_client.current_priority(), func, *args)), timeout)
+        for func, *args in calls
+    ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    return [_fetch_error(r) if isinstance(r, BaseException) else r for r in results]
+
+
+def get_forecast_5days(latitude: float, longitude: float):
+    """Получает прогноз на 5 дней (CompactForecast) или {'error': ...}"""
     try:
-        response = http_client.get_with_retries(url)
-        if response and response.status_code == 200:
-            data = response.json()
-            save_to_cache_by_key(data, lat, lon, 'weather')
-            return data
-        else:
-            return {"error": f"Ошибка запроса: {response.status_code if response else 'Нет ответа'}"}
+        return fetch_endpoint('forecast5d', latitude, longitude, extract=CompactForecast.from_owm)
     except Exception as e:
-        return {"error": f"Ошибка получения погоды: {e}"}
+        return {"error": f"Ошибка получения прогноза: {e}"}
 
 
 def print_weather_info(weather_data: dict):
@@ -141,116 +721,187 @@ def print_weather_info(weather_data: dict):
         print(f"❌ Ошибка форматирования данных: {e}")
 
 
-def get_hourly_weather(latitude: float, longitude: float) -> dict:
-    """Получает почасовой прогноз погоды по координатам"""
-    cached = load_from_cache_by_key(latitude, longitude, 'hourly')
-    if cached:
-        return cached
-    
-    url = f"https://pro.openweathermap.org/data/2.5/forecast/hourly?lat={latitude}&lon={longitude}&appid={API_KEY}&units=metric&lang=ru"
-    
+def get_hourly_weather(latitude: float, longitude: float):
+    """Получает почасовой прогноз погоды по координатам (CompactForecast) или {'error': ...}"""
     try:
-        response = http_client.get_with_retries(url)
-        if response and response.status_code == 200:
-            data = response.json()
-            save_to_cache_by_key(data, latitude, longitude, 'hourly')
-            return data
-        else:
-            return {"error": f"Ошибка запроса: {response.status_code if response else 'Нет ответа'}"}
+        return fetch_endpoint('hourly', latitude, longitude, extract=CompactForecast.from_owm)
     except Exception as e:
         return {"error": f"Ошибка получения почасового прогноса: {e}"}
 
 
+def _extract_components(data: dict) -> dict:
+    return data['list'][0]['components']
+
+
 def get_air_pollution(latitude: float, longitude: float) -> dict:
     """Получает данные о загрязнении воздуха по координатам"""
-    cached = load_from_cache_by_key(latitude, longitude, 'air_pollution')
-    if cached:
-        return cached
-    
-    url = f"https://api.openweathermap.org/data/2.5/air_pollution?lat={latitude}&lon={longitude}&appid={API_KEY}"
-    
     try:
-        response = http_client.get_with_retries(url)
-        if response and response.status_code == 200:
-            data = response.json()['list'][0]['components']
-            save_to_cache_by_key(data, latitude, longitude, 'air_pollution')
-            return data
-        else:
-            return {"error": f"Ошибка запроса: {response.status_code if response else 'Нет ответа'}"}
+        return fetch_endpoint('air_pollution', latitude, longitude, extract=_extract_components)
     except Exception as e:
         return {"error": f"Ошибка получения данных о загрязнении воздуха: {e}"}
 
+# Функции, которыми пакетные запросы получают данные по одному endpoint'у
+BATCH_FUNCTIONS = {
+    'weather': get_weather_by_coordinates,
+    'hourly': get_hourly_weather,
+    'forecast5d': get_forecast_5days,
+    'air_pollution': get_air_pollution,
+}
+
+# Функции извлечения, с которыми BATCH_FUNCTIONS кэшируют endpoint (нужны для учёта популярности)
+BATCH_EXTRACTS = {
+    'hourly': CompactForecast.from_owm,
+    'forecast5d': CompactForecast.from_owm,
+    'air_pollution': _extract_components,
+}
+
+
+def _run_with_priority(priority: int, func, *args, **kwargs):
+    with http_client.request_priority(priority):
+        return func(*args, **kwargs)
+
+
+def _resolve_cities(cities: list, pool: ThreadPoolExecutor, priority: int):
+    """Находит координаты городов (повторы и города из геокэша не запрашиваются заново)"""
+    by_name = {}
+    for city in cities:
+        by_name.setdefault(normalize_city_name(city), []).append(city)
+    futures = {pool.submit(_run_with_priority, priority, geocode, names[0]): names
+               for names in by_name.values()}
+    for future in as_completed(futures):
+        try:
+            place = future.result()
+        except Exception as e:
+            place = {"error": GEOCODING_BUSY_ERROR}
+            print(f"❌ Ошибка геокодирования: {e}")
+        for city in futures[future]:
+            yield city, place
+
+
+def iter_batch(endpoint: str, locations, max_workers: int = FETCH_WORKERS):
+    """
+    Получает данные endpoint'а для многих мест, отдавая результаты по мере готовности.
+
+    locations — координаты (lat, lon) и/или названия городов. Одинаковые ячейки кэша
+    запрашиваются один раз, попадания в кэш отдаются сразу, промахи запрашиваются
+    параллельно не более чем в max_workers потоков с приоритетом квоты вызывающего потока.
+
+    Для названий городов в результате — название найденного города (with_place_name).
+
+    Yields:
+        (место, результат) — место в том виде, в каком оно было передано
+    """
+    fetch = BATCH_FUNCTIONS[endpoint]
+    priority = http_client.current_priority()
+    locations = list(locations)
+    cities = [location for location in locations if isinstance(location, str)]
+    coordinates = [location for location in locations if not isinstance(location, str)]
+    
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='weather-batch') as pool:
+        resolved = [(location, location) for location in coordinates]
+        names = {}
+        for city, place in _resolve_cities(cities, pool, priority):
+            if is_error(place):
+                yield city, place
+            else:
+                resolved.append((city, (place['lat'], place['lon'])))
+                names[city] = place['name']
+        
+        cells = {}
+        for location, (lat, lon) in resolved:
+            cell = quantize_coordinates(lat, lon, endpoint)
+            cells.setdefault(cell, []).append(location)
+        
+        misses = {}
+        for cell, cell_locations in cells.items():
+            cached = load_from_cache_by_key(cell[0], cell[1], endpoint)
+            if cached is not None:
+                # Промахи учитывает fetch_endpoint, попадания — здесь, по одному на место
+                cache_key = get_cache_key(cell[0], cell[1], endpoint)
+                for location in cell_locations:
+                    _access.hit(cache_key, (endpoint, cell[0], cell[1], BATCH_EXTRACTS.get(endpoint)))
+                    yield location, with_place_name(cached, names.get(location))
+            else:
+                misses[pool.submit(_run_with_priority, priority, fetch, cell[0], cell[1])] = cell_locations
+        
+        for future in as_completed(misses):
+            result = future.result()
+            for location in misses[future]:
+                yield location, with_place_name(result, names.get(location))
+
+
+def get_batch(endpoint: str, locations, max_workers: int = FETCH_WORKERS) -> dict:
+    """Пакетный запрос: {место: результат} для всех мест сразу"""
+    return dict(iter_batch(endpoint, locations, max_workers=max_workers))
+
+
+def warm_cache(locations, endpoints=('weather',), budget: int = 60,
+               max_workers: int = FETCH_WORKERS) -> dict:
+    """
+    Прогревает кэш для списка мест (например, после перезапуска).
+
+    Места группируются по ячейкам кэша, популярные ячейки идут первыми. Свежие записи
+    файлового кэша просто поднимаются в память, недостающие запрашиваются в API с
+    приоритетом PRIORITY_PREFETCH, но не больше budget запросов на все endpoint'ы.
+
+    Returns:
+        Счётчики: cells, cached, fetched, failed, skipped, duration
+    """
+    started = time.monotonic()
+    locations = list(locations)
+    stats = {'cells': 0, 'cached': 0, 'fetched': 0, 'failed': 0, 'skipped': 0}
+    
+    for endpoint in endpoints:
+        popularity = {}
+        for lat, lon in locations:
+            cell = quantize_coordinates(lat, lon, endpoint)
+            popularity[cell] = popularity.get(cell, 0) + 1
+        cells = sorted(popularity, key=popularity.get, reverse=True)
+        stats['cells'] += len(cells)
+        
+        missing = []
+        for lat, lon in cells:
+            if load_from_cache_by_key(lat, lon, endpoint) is not None:
+                stats['cached'] += 1
+            elif budget > 0:
+                missing.append((lat, lon))
+                budget -= 1
+            else:
+                stats['skipped'] += 1
+        
+        with http_client.request_priority(http_client.PRIORITY_PREFETCH):
+            for _, result in iter_batch(endpoint, missing, max_workers=max_workers):
+                stats['failed' if is_error(result) else 'fetched'] += 1
+    
+    stats['duration'] = round(time.monotonic() - started, 3)
+    return stats
+
+
 def analize_air_pollution(air_pollution: dict, extended: bool = False) -> str:
     """Анализирует данные о загрязнении воздуха и возвращает статус"""
     if "error" in air_pollution:
         return air_pollution["error"]
-    
-    quality_levels = {
-        1: "Хорошо",
-        2: "Удовлетворительно", 
-        3: "Умеренно",
-        4: "Плохо",
-        5: "Очень плохо"
-    }
-    
-    thresholds = {
-        "so2": [(0, 20, 1), (20, 80, 2), (80, 250, 3), (250, 350, 4), (350, float('inf'), 5)],
-        "no2": [(0, 40, 1), (40, 70, 2), (70, 150, 3), (150, 200, 4), (200, float('inf'), 5)],
-        "pm10": [(0, 20, 1), (20, 50, 2), (50, 100, 3), (100, 200, 4), (200, float('inf'), 5)],
-        "pm2_5": [(0, 10, 1), (10, 25, 2), (25, 50, 3), (50, 75, 4), (75, float('inf'), 5)],
-        "o3": [(0, 60, 1), (60, 100, 2), (100, 140, 3), (140, 180, 4), (180, float('inf'), 5)],
-        "co": [(0, 4400, 1), (4400, 9400, 2), (9400, 12400, 3), (12400, 15400, 4), (15400, float('inf'), 5)]
-    }
-    
-    pollutant_names = {
-        "so2": "SO₂",
-        "no2": "NO₂", 
-        "pm10": "PM₁₀",
-        "pm2_5": "PM₂.₅",
-        "o3": "O₃",
-        "co": "CO"
-    }
-    
-    results = []
-    max_level = 1
-    
-    for pollutant, ranges in thresholds.items():
-        if pollutant in air_pollution:
-            value = air_pollution[pollutant]
-            level = 1
-            
-            for min_val, max_val, lvl in ranges:
-                if min_val <= value < max_val:
-                    level = lvl
-                    break
-            
-            max_level = max(max_level, level)
-            
-            status = quality_levels[level]
-            name = pollutant_names.get(pollutant, pollutant)
-            results.append(f"  {name}: {value} μg/m³ [{status}]")
-    
-    overall_status = quality_levels[max_level]
-    
-    output = f"\n🌬️  Качество воздуха: {overall_status}\n"
-    output += "\n".join(results)
-    
-    if extended:
-        output += "\n\n📊 Все компоненты воздуха:"
-        for component, value in air_pollution.items():
-            if component not in thresholds:
-                output += f"\n  {component}: {value} μg/m³"
-    
-    warnings = []
-    if max_level >= 4:
-        warnings.append("⚠️  Высокий уровень загрязнения! Ограничьте время на улице.")
-    elif max_level == 3:
-        warnings.append("⚠️  Умеренное загрязнение. Чувствительным людям быть осторожнее.")
-    
-    if warnings:
-        output += "\n" + "\n".join(warnings)
-    
-    return output
+    return format_air_quality(air_pollution, AIR_QUALITY.classify(air_pollution), extended=extended)
+
+
+def get_air_quality_batch(locations, max_workers: int = FETCH_WORKERS) -> dict:
+    """
+    Качество воздуха для многих мест: {место: классификация или {'error': ...}}.
+
+    Данные загрязнения получаются пакетно (см. iter_batch), а классифицируются разом.
+    Классификация — {'levels': {загрязнитель: уровень 1..5}, 'max_level': общий уровень}.
+    """
+    results = {}
+    classified = []
+    for location, components in iter_batch('air_pollution', locations, max_workers=max_workers):
+        if "error" in components:
+            results[location] = components
+        else:
+            classified.append((location, components))
+    levels = AIR_QUALITY.classify_many(components for _, components in classified)
+    for (location, _), classification in zip(classified, levels):
+        results[location] = classification
+    return results
 
 
 def main():
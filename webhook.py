@@ -0,0 +1,185 @@
+import hmac
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional
+
+
+def update_chat_id(update: Dict[str, Any]) -> Optional[int]:
+    """Возвращает id чата (или пользователя), к которому относится сырое обновление Telegram"""
+    for kind in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if kind in update:
+            return update[kind].get('chat', {}).get('id')
+    callback = update.get('callback_query')
+    if callback:
+        message = callback.get('message')
+        if message and 'chat' in message:
+            return message['chat']['id']
+        return callback.get('from', {}).get('id')
+    for kind in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query',
+                 'my_chat_member', 'chat_member', 'chat_join_request'):
+        if kind in update:
+            payload = update[kind]
+            return payload.get('chat', {}).get('id') or payload.get('from', {}).get('id')
+    return None
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """Возвращает id пользователя, от которого пришло обновление (или id чата, если автора нет)"""
+    for kind, payload in update.items():
+        if isinstance(payload, dict) and isinstance(payload.get('from'), dict):
+            return payload['from'].get('id')
+    return update_chat_id(update)
+
+
+class UpdateDispatcher:
+    """
+    Пул обработчиков обновлений с ограниченными очередями.
+
+    Обновления одного чата всегда попадают к одному и тому же обработчику,
+    поэтому обрабатываются по порядку. Медленный чат задерживает только свою очередь.
+    При переполнении очереди:
+      - 'block' — ждём до put_timeout секунд, затем отказываем (Telegram повторит доставку позже);
+      - 'drop'  — сразу отбрасываем обновление.
+    """
+
+    def __init__(self, handler: Callable[[Dict[str, Any]], None], workers: int = 8,
+                 queue_size: int = 100, overflow: str = 'block', put_timeout: float = 1.0):
+        """
+        Args:
+            handler: Функция обработки одного сырого обновления (dict)
+            workers: Число потоков-обработчиков
+            queue_size: Размер очереди каждого обработчика
+            overflow: Политика при переполнении: 'block' или 'drop'
+            put_timeout: Сколько ждать места в очереди в режиме 'block'
+        """
+        if overflow not in ('block', 'drop'):
+            raise ValueError(f"Неизвестная политика переполнения: {overflow}")
+        self.handler = handler
+        self.overflow = overflow
+        self.put_timeout = put_timeout
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = []
+        self._stats_lock = threading.Lock()
+        self.stats = {'accepted': 0, 'rejected': 0, 'dropped': 0, 'processed': 0, 'errors': 0}
+
+    def _count(self, counter: str):
+        with self._stats_lock:
+            self.stats[counter] += 1
+
+    def start(self):
+        """Запускает потоки-обработчики"""
+        for index, updates in enumerate(self._queues):
+            thread = threading.Thread(target=self._work, args=(updates,), name=f'update-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Останавливает обработчики после того, как они разберут свои очереди"""
+        for updates in self._queues:
+            updates.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, update: Dict[str, Any]) -> bool:
+        """Ставит обновление в очередь; False — обновление не принято (нужно повторить позже)"""
+        chat_id = update_chat_id(update)
+        key = chat_id if chat_id is not None else update.get('update_id', 0)
+        updates = self._queues[hash(key) % len(self._queues)]
+        try:
+            if self.overflow == 'block':
+                updates.put(update, timeout=self.put_timeout)
+            else:
+                updates.put_nowait(update)
+        except queue.Full:
+            if self.overflow == 'drop':
+                self._count('dropped')
+                return True
+            self._count('rejected')
+            return False
+        self._count('accepted')
+        return True
+
+    def queue_sizes(self) -> list:
+        return [updates.qsize() for updates in self._queues]
+
+    def _work(self, updates: queue.Queue):
+        while True:
+            update = updates.get()
+            if update is None:
+                return
+            try:
+                self.handler(update)
+                self._count('processed')
+            except Exception as e:
+                self._count('errors')
+                print(f"❌ Ошибка обработки обновления {update.get('update_id')}: {e}")
+
+
+class WebhookServer:
+    """Локальный HTTP сервер, принимающий обновления Telegram через webhook"""
+
+    def __init__(self, dispatcher: UpdateDispatcher, host: str = '127.0.0.1', port: int = 8443,
+                 path: str = '/webhook', secret_token: Optional[str] = None):
+        self.dispatcher = dispatcher
+        self.path = path
+        self.secret_token = secret_token
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404)
+                    return
+                if server.secret_token is not None:
+                    # Сравниваем байты: compare_digest не принимает строки с не-ASCII символами
+                    token = self.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+                    if not hmac.compare_digest(token.encode('utf-8', 'surrogateescape'),
+                                               server.secret_token.encode('utf-8')):
+                        self._reply(403)
+                        return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    update = json.loads(self.rfile.read(length))
+                except (ValueError, json.JSONDecodeError):
+                    self._reply(400)
+                    return
+                if not isinstance(update, dict):
+                    # Обновление Telegram — всегда объект; списки и строки дальше не пускаем
+                    self._reply(400)
+                    return
+                self._reply(200 if server.dispatcher.submit(update) else 503)
+
+            def _reply(self, status: int):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve_forever(self):
+        """Обрабатывает запросы в текущем потоке"""
+        self._server.serve_forever()
+
+    def start(self):
+        """Запускает сервер в фоновом потоке"""
+        self._thread = threading.Thread(target=self.serve_forever, name='webhook-server', daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()